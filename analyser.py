@@ -2,15 +2,148 @@
 """ Contains functions for analysing output data from reddit. """
 
 from __future__ import division
-from collections import defaultdict
-from nltk.collocations import *
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 import scraper as scraper
-import nltk as nltk
-import cPickle as pickle
-import copy as copy
+import corpus as corpus
+import scoring as scoring
+import stream as stream
+import ngramstore as ngramstore
+import unknownstats as unknownstats
+import cloudfarm as cloudfarm
+import phrases as phr
+import instrument as instrument
+import lazy as lazy
 import random
+import re
+
+nltk = lazy.LazyModule('nltk')
+
+
+TOKEN_PATTERN = r'[a-zA-Z]+\'[a-zA-Z]+|[a-zA-Z]+'
+
+
+class Normalizer(object):
+    
+    """
+    Reusable string handling.
+    
+    Does the same as fixer, but the tokenizer, stopwords and stemmer 
+    are set up once and the comments are returned as lists of words. 
+    Normalized words are memoized, the memo is cleared when it holds 
+    cache_size words.
+    """
+    
+    def __init__(self, stop, stem, split=False, cache_size=100000):
+        """
+        Create a new normalizer.
+        
+        stop = Boolean to determine if stopwords should be removed
+        
+        stem = Boolean to determine if stemming should be applied
+        
+        split = Boolean to split on whitespace only, keeping punctuation 
+        like comment.lower().split()
+        
+        cache_size = maximum number of memoized words
+        """
+        self.stop = stop
+        self.stem = stem
+        self.split = split
+        self.settings = (bool(stop), bool(stem), bool(split))
+        self.cache_size = cache_size
+        self.cache = {}
+        self.findall = re.compile(TOKEN_PATTERN, re.UNICODE | re.MULTILINE | re.DOTALL).findall
+        self.stopwords = frozenset(nltk.corpus.stopwords.words('english')) if stop else frozenset()
+        self.stemmer = nltk.stem.PorterStemmer() if stem else None
+        
+    def normalize(self, word):
+        """Return the stemmed word, or None if it is a stopword."""
+        try:
+            return self.cache[word]
+        except KeyError:
+            pass
+        
+        if word in self.stopwords:
+            norm = None
+        elif self.stemmer:
+            norm = self.stemmer.stem(word)
+        else:
+            norm = word
+            
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[word] = norm
+        return norm
+    
+    def tokens(self, comment):
+        """Return the words of a single comment."""
+        words = comment.lower().split() if self.split else self.findall(comment.lower())
+        if not (self.stop or self.stem):
+            return words
+        
+        normalize = self.normalize
+        return [norm for norm in map(normalize, words) if norm is not None]
+    
+    def batch(self, comments):
+        """Yield the words of each comment in an iterable of comments."""
+        for comment in comments:
+            yield self.tokens(comment)
+            
+    def words(self, comments):
+        """Return the words of all comments concatenated."""
+        return [word for tokens in self.batch(comments) for word in tokens]
+
+
+_normalizers = {}
+
+
+def get_normalizer(stop, stem, split=False):
+    """Return the shared normalizer for the given settings."""
+    key = (bool(stop), bool(stem), bool(split))
+    if key not in _normalizers:
+        _normalizers[key] = Normalizer(*key)
+    return _normalizers[key]
+
+
+def comment_words(subreddit, stop, stem, split=False):
+    """
+    Tokenize comments.
+    
+    Return a function giving the words of each comment of a submission. 
+    Submissions of a corpus.TokenizedCorpus are not tokenized again, 
+    other submissions are tokenized with the shared normalizer.
+    
+    -> subreddit: dictionary containing data from sub-reddits or a TokenizedCorpus
+    -> stop, stem, split: settings for the Normalizer
+    """
+    normalizer = get_normalizer(stop, stem, split)
+    if isinstance(subreddit, corpus.TokenizedCorpus):
+        if subreddit.settings != normalizer.settings:
+            raise ValueError('corpus is tokenized with (stop, stem, split) = %s, expected %s' 
+                             % (subreddit.settings, normalizer.settings))
+        return instrument.tokenized(lambda sub: sub.token_lists())
+    return instrument.tokenized(lambda sub: normalizer.batch(sub.comments))
+
+
+def ngram_store(subreddit, stop, stem, split=False, orders=(2, 3)):
+    """
+    Count n-grams.
+    
+    Return the ngramstore.NgramStore of sub-reddit data, the store of the 
+    cached corpus is loaded if subreddit is None.
+    
+    -> subreddit: data, corpus.TokenizedCorpus or None
+    -> stop, stem, split: settings for the Normalizer
+    -> orders: the n-gram orders to count
+    """
+    if subreddit is None:
+        return ngramstore.load_ngrams('sub-reddits.txt', stop, stem, split, orders)
+    if not isinstance(subreddit, corpus.TokenizedCorpus):
+        subreddit = corpus.TokenizedCorpus.build(subreddit, stop, stem, split)
+    elif subreddit.settings != get_normalizer(stop, stem, split).settings:
+        raise ValueError('corpus is tokenized with (stop, stem, split) = %s, expected %s' 
+                         % (subreddit.settings, (stop, stem, split)))
+    with instrument.stage('aggregate'):
+        return ngramstore.NgramStore.build(subreddit, orders)
 
 
 def fixer(comment, stop, stem):
@@ -27,36 +160,28 @@ def fixer(comment, stop, stem):
 
     stem -> Boolean to determine if stemming should be applied
     """
-    token = nltk.RegexpTokenizer(r'[a-zA-Z]+\'[a-zA-Z]+|[a-zA-Z]+')
-
-    comment = comment.lower()
-    comment = ' '.join(token.tokenize(comment))
-
-    if(stop):
-        stopwords = set(nltk.corpus.stopwords.words('english'))
-        split = filter(lambda word: word not in stopwords, comment.split())
+    return ' '.join(get_normalizer(stop, stem).tokens(comment))
         
-        comment = ' '.join(split)
-    
-    if(stem):
-        stemmer = nltk.stem.PorterStemmer()
-        split = [stemmer.stem(word) for word in comment.split()]
-        
-        comment = ' '.join(split)
-    
-    return comment
-        
-def sentiment(subreddit, sentiment):
+def sentiment(subreddit, sentiment, phrases=False):
     """
     Sentiment analysis.
     
     Calculate and return the average sentiment for each thread with all comments concatenated
     
-    -> subreddit: dictionary containing data from sub-reddits
+    -> subreddit: dictionary containing data from sub-reddits, 
+    or a corpus.TokenizedCorpus with split=True which is scored by scoring.SentimentEngine
+    -> phrases: also score multi-word entries of the lexicon and negation, 
+    see phrases.PhraseScorer
     
     <- (names, scores_all, titles_all): Tuple of the names of the sub-reddits, 
     sentiment scores and titles of posts in each sub-reddit
     """
+    if phrases:
+        return phr.sentiment(subreddit, sentiment)
+    words_of = comment_words(subreddit, False, False, split=True)
+    if isinstance(subreddit, corpus.TokenizedCorpus) and isinstance(sentiment, dict):
+        return scoring.SentimentEngine(sentiment).score(subreddit)
+    
     scores_all = []
     names = []
     titles_all = []
@@ -66,10 +191,10 @@ def sentiment(subreddit, sentiment):
         names.append(name)
         for sub_id, sub in data.items():
             comment_score = []
-            for comment in sub.comments:
-                words = comment.lower().split()
-                words_in_sent = [word for word in words if word in sentiment]
-                comment_score += [sum([sentiment.get(word) for word in words_in_sent])]
+            with instrument.stage('score', name, sub_id):
+                for words in words_of(sub):
+                    words_in_sent = [word for word in words if word in sentiment]
+                    comment_score += [sum([sentiment.get(word) for word in words_in_sent])]
                 
             score_filter = [score for score in comment_score if score not in range(-2, 3)]    
             total = sum(score_filter)
@@ -82,17 +207,23 @@ def sentiment(subreddit, sentiment):
         
     return names, scores_all, titles_all 
 
-def lexical_diversity(subreddit):
+def lexical_diversity(subreddit, sketch=False):
     """
     Lexical diversity.
     
     Calculate and return the lexical diversity for each thread with all comments concatenated
     
-    -> subreddit: dictionary containing data from sub-reddits
+    -> subreddit: dictionary containing data from sub-reddits, 
+    or a corpus.TokenizedCorpus with stop=True
+    -> sketch: estimate the distinct words with a sketch.HyperLogLog 
+    in bounded memory instead of keeping them, see stream.lexical_diversity
     
     <- (names, scores_all, titles_all): Tuple of the names of the sub-reddits, 
     lexical diversity scores and titles of posts in each sub-reddit
     """
+    if sketch:
+        return stream.lexical_diversity(subreddit, sketch=True)
+    words_of = comment_words(subreddit, True, False)
     scores_all = []
     names = []
     titles_all = []
@@ -101,7 +232,8 @@ def lexical_diversity(subreddit):
         titles_subs = []
         names.append(name)
         for sub_id, sub in data.items(): 
-            words = " ".join([fixer(comment, True, False) for comment in sub.comments]).split()
+            with instrument.stage('aggregate', name, sub_id):
+                words = [word for words in words_of(sub) for word in words]
             lex_div = len(set(words)) / len(words)
             
             scores_subs.append(lex_div)
@@ -112,131 +244,147 @@ def lexical_diversity(subreddit):
         
     return names, scores_all, titles_all 
       
-def most_frequent_words(subreddit):
+def most_frequent_words(subreddit, sketch=False):
     """
     Word counting.
     
-    Returns the most frequent words for each sub-reddit
+    Returns the word frequencies of all threads of each sub-reddit
     
-    -> subreddit: dictionary containing data from sub-reddits
+    -> subreddit: dictionary containing data from sub-reddits, 
+    or a corpus.TokenizedCorpus with stop=True
+    -> sketch: keep only the 1000 most frequent words of each sub-reddit 
+    with approximate counts, in bounded memory, see stream.most_frequent_words
     
     <- (names, freq_dists, titles_all): Tuple of the names of the sub-reddits, 
     frequency distributions and titles of posts in each sub-reddit
     """
+    if sketch:
+        return stream.most_frequent_words(subreddit, sketch=True)
+    words_of = comment_words(subreddit, True, False)
     freq_dists = []
     names = []
     titles_all = []
-    for name, data in subreddit.items()[-1:]:
+    for name, data in subreddit.items():
         titles_subs = []
-        all_words = ['']
+        freq_dist = nltk.probability.FreqDist()
         for sub_id, sub in data.items():
-            all_words = " ".join([fixer(comment, True, False) 
-                        for comment in sub.comments]).split()
+            with instrument.stage('aggregate', name, sub_id):
+                for words in words_of(sub):
+                    freq_dist.update(words)
             
             titles_subs.append(sub.title)            
             
-        freq_dist = nltk.probability.FreqDist(all_words)
         names.append(name)
         titles_all.append(titles_subs)
         freq_dists.append(freq_dist)
     return names, freq_dists, titles_all
 
         
-def collocations_bigram(stop=True, stem=True):
+def collocations_bigram(stop=True, stem=True, subreddit=None):
     """
     Topic mining.
     
     Collocations: multi-word expressions that commonly co-occur
     
     Calculate collocations for each thread with all comments concatenated
+    
+    -> subreddit: data or corpus.TokenizedCorpus, the cached corpus is loaded if omitted
     """
-    subreddit = scraper.load_data()
+    store = ngram_store(subreddit, stop, stem, orders=(2,))
     
-    bigram_measures = nltk.collocations.BigramAssocMeasures()
-
-    for name, data in subreddit.items()[-2:]:
+    for name in store.names()[-2:]:
         print name
-        for sub_id, sub in data.items(): 
-            words = " ".join([fixer(comment, stop, stem) 
-                        for comment in sub.comments]).split()
-            finder = nltk.collocations.BigramCollocationFinder.from_words(words)
-            finder.apply_freq_filter(4)
-            collo = finder.nbest(bigram_measures.raw_freq, 5)
-            print sub.title
+        for sub_id, title in store.threads_of(name):
+            # Same as nbest(raw_freq, 5) after apply_freq_filter(4)
+            collo = store.top(2, 5, name, sub_id, freq=4)
+            print title
             print collo
             
         print "\n"
         
 
-def collocations_trigram(stop=True, stem=True):
+def collocations_trigram(stop=True, stem=True, subreddit=None):
     """
     Topic mining.
     
     Calculate collocations for each thread with all comments concatenated
-    """
-    subreddit = scraper.load_data()
     
-    trigram_measures = nltk.TrigramAssocMeasures()
+    -> subreddit: data or corpus.TokenizedCorpus, the cached corpus is loaded if omitted
+    """
+    store = ngram_store(subreddit, stop, stem, orders=(3,))
     
-    for name, data in subreddit.items()[-2:]:
+    for name in store.names()[-2:]:
         print name
-        for sub_id, sub in data.items(): 
-            words = " ".join([fixer(comment, stop, stem) for comment in sub.comments]).split()
-            finder = nltk.TrigramCollocationFinder.from_words(words)
-            finder.apply_freq_filter(4)
+        for sub_id, title in store.threads_of(name):
             # Add filter function
-            finder.apply_ngram_filter(lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3))
-            collo = finder.nbest(trigram_measures.raw_freq, 5)
-            print sub.title
+            collo = store.top(3, 5, name, sub_id, freq=4, 
+                              ngram_filter=lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3))
+            print title
             print collo
 
         print "\n"
         
 
-def collocations_ngram(n):
+def collocations_ngram(n, subreddit=None):
     """
     Topic mining.
     
     Calculate collocations for each thread with all comments concatenated.
+    
+    -> subreddit: data or corpus.TokenizedCorpus with split=True, 
+    the cached corpus is loaded if omitted
     """
-    subreddit = scraper.load_data()
+    store = ngram_store(subreddit, False, False, split=True, orders=(n,))
     
-    nltk.metrics.association.NgramAssocMeasures()
-
-    for name, data in subreddit.items():
+    for name in store.names():
         print name
-        for sub_id, sub in data.items(): 
-            words = " ".join([comment for comment in sub.comments]).lower().split()
-            ngrams = nltk.util.ngrams(words, n)
-            freq_dist = nltk.probability.FreqDist(ngrams)
-            print sub.title
-            print [key for key, val in freq_dist.items() if val >= 4]
+        for sub_id, title in store.threads_of(name):
+            print title
+            print [ngram for ngram, _ in store.frequent(n, 4, name, sub_id)]
 
         print "\n"
 
 
-def get_unknownwords(filename, stem):
+def get_unknownwords(filename, stem, subreddit=None):
     """
     Extended sentiment analysis.
     
     Find all words that do not have a sentiment classification (stopwords excluded).
+    Their statistics are written to filename.npz, see unknownstats.UnknownStats
+    
+    -> subreddit: data or corpus.TokenizedCorpus, the cached corpus is loaded if omitted
+    """
+    if subreddit is None:
+        subreddit = corpus.load_corpus('sub-reddits.txt', True, stem)
+    unknown_stats(subreddit, stem, scraper.load_sent(stem)).save(filename + '.npz')
+
+
+def unknown_stats(subreddit, stem, sentiment, verbose=True):
     """
-    subreddit = scraper.load_data('sub-reddits.txt')
-    sentiment = scraper.load_sent(stem)
+    Extended sentiment analysis.
+    
+    Return the unknownstats.UnknownStats of the words that do not have 
+    a sentiment classification, see get_unknownwords
     
-    unknowndict = defaultdict(list)
+    -> subreddit: data or corpus.TokenizedCorpus with stop=True
+    -> stem: stem the words
+    -> sentiment: dictionary of word valences, stemmed if stem is
+    -> verbose: print the name of each sub-reddit
+    """
+    words_of = comment_words(subreddit, True, stem)
+    stats = unknownstats.UnknownStats()
     
     for name, data in subreddit.items():
-        print name
+        if verbose:
+            print name
         for sub_id, sub in data.items():
-            for comment in sub.comments:
-                words = fixer(comment, True, stem).split()
-                value = sum(map(lambda word: sentiment.get(word, 0), words))
-                unknown = [word for word in words if word not in sentiment]
-                for word in unknown:
-                    unknowndict[word].append(UnknownWord(name, value, value / len(words)))
-                    
-    pickle.dump(unknowndict, open(filename + '.p', 'wb'))
+            with instrument.stage('score', name, sub_id):
+                for words in words_of(sub):
+                    value = sum(map(lambda word: sentiment.get(word, 0), words))
+                    unknown = [word for word in words if word not in sentiment]
+                    if unknown:
+                        stats.add(name, unknown, value, value / len(words))
+    return stats
 
 
 def unknownsent(filename):
@@ -248,95 +396,55 @@ def unknownsent(filename):
     they satisfy that they appear atleast 100 times, 
     and they have a collected sentiment-score higher than 5.
     
-    -> filename: name of the file to load
+    -> filename: name of the file to load, without extension, 
+    see unknownstats.load_unknown
     
     <- [(word, score), \S..]: list of tuples containing an unknown word 
     and its corresponding sentiment score
     """
-    words = []
-
-    for word, data in pickle.load(open('data/' + filename + '.p', 'rb')).items():
-        if(len(data) > 100 and abs(sum([point.value for point in data]) / len(data)) > 5):
-            words.append((word, sum([point.value for point in data]) / len(data)))
-
-    return words
+    return unknownstats.load_unknown('data/' + filename).frequent(100, 5)
 
 
-def unknowncoll(filename='unknownwords.p', stem=False):
+def unknowncoll(filename='unknownwords.p', stem=False, subreddits=None, 
+                font_path=None, workers=None, directory='plots/clouds/'):
     """
     Word cloud from sentiment analysis.
     
     Finds the bi-collocation of unknown words (words without sentiment) 
     and displays the 10 most common words based on frequency in a word-cloud, 
     colored green for words seen mostly in positive sentiments and red 
-    for the opposite. Comparison is made on all comments concatenated
+    for the opposite. Comparison is made on all comments concatenated.
+    The clouds are written to directory in a process pool, 
+    see cloudfarm.render_all
     
     -> filename: name of the file to load unknown words from
     -> stem: stem the words
+    -> subreddits: data or corpus.TokenizedCorpus, the cached corpus is loaded if omitted
+    -> font_path: TrueType font, the font bundled with wordcloud if None
+    -> workers: number of rendering processes, the number of CPUs if None
+    -> directory: where the clouds are written, apart from the other plots
     """
-    bigram_measures = nltk.collocations.BigramAssocMeasures()
-    subreddits = scraper.load_data('sub-reddits.txt')
-    fullcomment = []
+    if subreddits is None:
+        subreddits = corpus.load_corpus('sub-reddits.txt', True, stem)
     
     print 'building comment'
-    for name, data in subreddits.items():
-        for sub_id, sub in data.items():
-            fullcomment += [fixer(comment, True, stem).split() for comment in sub.comments]
+    index = stream.bigram_index(subreddits, True, stem)
 
     print 'getting unknowns'
     unknownwords = unknownsent(filename)
     
-    #flatten the comment structure
-    fullcomment = [word for comment in fullcomment for word in comment]
-    
-    basefinder = BigramCollocationFinder.from_words(fullcomment)
-    count = 0
-    
-    for unknown, unknownscore in unknownwords:
-        finder = copy.copy(basefinder)
-        
-        print '\n' + unknown
-        #only bigrams that contain the unknown word
-        finder.apply_ngram_filter(lambda w1, w2: unknown != w1 and unknown != w2)
-        
-        wordcloud = WordCloud()
-        wordcloud.font_path = 'C:\Windows\Fonts\comic.ttf'
-        #trick the wordcloud to accept custom input
-        wordcloud.generate('generate')
-        
-        colls = finder.score_ngrams(bigram_measures.raw_freq)
-        colls = colls[:10]        
-        maximum = colls[1][1]
-        
-        #generate the tuple (word, score) for the wordcloud
-        cloudwords = [(word, score) for ((word, _), score) in colls if word != unknown]
-        cloudwords += [(word, score) for ((_, word), score) in colls if word != unknown]
-        
-        #normalize the scores
-        cloudwords = [(word, score / maximum) for (word, score) in cloudwords]
-        
-        #tricking part 2.
-        wordcloud.fit_words(cloudwords)
-        wordcloud.to_image()
-        if(unknownscore > 0):
-            wordcloud = wordcloud.recolor(color_func=green_color_func, random_state=3)
-        else:
-            wordcloud = wordcloud.recolor(color_func=red_color_func, random_state=3)
-        
-        count += 1
-        plt.figure(count)
-        plt.title(unknown)
-        plt.imshow(wordcloud)
-        plt.axis("off")
-        plt.savefig('plots/' + unknown + '.png', bbox_inches='tight')
-        plt.close()
+    #only bigrams that contain the unknown word
+    jobs = cloudfarm.cloud_jobs(index, unknownwords, 10)
+    return cloudfarm.render_all(jobs, directory, font_path, workers)
 
 
-def green_color_func(word, font_size, position, orientation, hue=None, random_state=None):
+def green_color_func(word, font_size, position, orientation, hue=None, random_state=None, 
+                     **kwargs):
     """ Return a green color map for a wordcloud."""
-    return "hsl(120, 100%%, %d%%)" % random.randint(30, 50)
+    return "hsl(120, 100%%, %d%%)" % (random_state or random).randint(30, 50)
 
     
-def red_color_func(word, font_size, position, orientation, hue=None, random_state=None):
+def red_color_func(word, font_size, position, orientation, hue=None, random_state=None, 
+                   **kwargs):
     """Return a red color map for a wordcloud."""
-    return "hsl(0, 100%%, %d%%)" % random.randint(30, 50)
\ No newline at end of file
+    return "hsl(0, 100%%, %d%%)" % (random_state or random).randint(30, 50)
\ No newline at end of file
@@ -0,0 +1,1178 @@
+# -*- coding: utf-8 -*-
+""" Contains benchmarks for the hot paths of the analysis. """
+
+from __future__ import division
+import argparse
+import collections
+import random
+import copy
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import cPickle as pickle
+import nltk as nltk
+import numpy as np
+
+import analyser as anl
+import cloudfarm as cloudfarm
+import corpus as corpus
+import harvester as harvester
+import instrument as instrument
+import lexicon as lexicon
+import ngramstore as ngramstore
+import parallel as parallel
+import phrases as phrases
+import results as results
+import scraper as scraper
+import sqlstore as sqlstore
+import store as store
+import scoring as scoring
+import sketch as sketch
+import stream as stream
+import visualizer as visualizer
+import unknownstats as unknownstats
+from submission import Submission
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SENTIMENT = {'good': 3, 'bad': -3, 'love': 3, 'hate': -3, 'amazing': 4,
+             'terrible': -3, 'funny': 4, 'really': 1}
+
+WORDS = ['the', 'and', 'good', 'bad', 'game', 'love', 'hate', 'people', 'running',
+         'thought', 'isn\'t', 'really', 'amazing', 'terrible', 'movies', 'reddit',
+         'posted', 'comments', 'funny', 'this', 'that', 'what', 'happened', 'yesterday']
+
+
+def synthetic_comments(count, length=20, seed=0):
+    """
+    Synthetic data.
+
+    Return a list of random comments with punctuation and mixed case
+
+    -> count: number of comments
+    -> length: number of words in each comment
+    -> seed: seed for the random generator
+    """
+    rand = random.Random(seed)
+    comments = []
+    for _ in xrange(count):
+        words = [rand.choice(WORDS) for _ in xrange(length)]
+        words[0] = words[0].capitalize()
+        comments.append(' '.join(words) + rand.choice(['.', '!', '?', ', ok.']))
+    return comments
+
+
+def synthetic_data(subs=10, posts=10, comments=100, length=20, seed=0):
+    """
+    Synthetic data.
+
+    Return a dictionary of dictionaries of Submissions like scraper.load_data
+    """
+    subreddit = dict()
+    for i in xrange(subs):
+        data = dict()
+        for j in xrange(posts):
+            data['p%d_%d' % (i, j)] = Submission('url', 'title %d' % j, 'text',
+                    synthetic_comments(comments, length, seed=(seed, i, j)))
+        subreddit['sub%d' % i] = data
+    return subreddit
+
+
+def write_data(subreddit, filename='sub-reddits.txt'):
+    """Write data in the layout read by scraper.load_data in the working directory."""
+    if not os.path.isdir('data'):
+        os.mkdir('data')
+    with open('data/' + filename, 'wb') as subreddits:
+        subreddits.write('\n'.join(sorted(subreddit)) + '\n')
+    for name, data in subreddit.items():
+        with open('data/' + name + '.p', 'wb') as out:
+            pickle.dump(data, out, pickle.HIGHEST_PROTOCOL)
+
+
+def peak_memory(statement):
+    """Return the peak resident memory in MB of running a statement in a new interpreter."""
+    code = ('import resource, sys\n'
+            'sys.path.insert(0, %r)\n'
+            'import benchmark\n'
+            '%s\n'
+            'print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss' 
+            % (HERE, statement))
+    return int(subprocess.check_output([sys.executable, '-c', code]).split()[-1]) / 1024
+
+
+def import_time(module):
+    """
+    Return the seconds of importing a module in a new interpreter, 
+    and the sorted list of the lazy.HEAVY packages the import loaded.
+    """
+    code = ('import sys, time\n'
+            'sys.path.insert(0, %r)\n'
+            'start = time.time()\n'
+            'import %s\n'
+            'seconds = time.time() - start\n'
+            'import lazy\n'
+            'print seconds, " ".join(sorted(set(name.split(".")[0] for name in sys.modules) '
+            '& set(lazy.HEAVY)))'
+            % (HERE, module))
+    output = subprocess.check_output([sys.executable, '-c', code]).split()
+    return float(output[0]), output[1:]
+
+
+def legacy_fixer(comment, stop, stem):
+    """String handling as done before the Normalizer, used as a baseline."""
+    token = nltk.RegexpTokenizer(r'[a-zA-Z]+\'[a-zA-Z]+|[a-zA-Z]+')
+
+    comment = comment.lower()
+    comment = ' '.join(token.tokenize(comment))
+
+    if(stop):
+        stopwords = set(nltk.corpus.stopwords.words('english'))
+        split = filter(lambda word: word not in stopwords, comment.split())
+        comment = ' '.join(split)
+
+    if(stem):
+        stemmer = nltk.stem.PorterStemmer()
+        split = [stemmer.stem(word) for word in comment.split()]
+        comment = ' '.join(split)
+
+    return comment
+
+
+def timed(func, *args):
+    """Return the result of calling func and the seconds it took."""
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def bench_fixer(count=20000, stop=True, stem=True):
+    """
+    Benchmark.
+
+    Prints comments per second for the old per-call fixer
+    and the shared Normalizer
+    """
+    comments = synthetic_comments(count)
+    normalizer = anl.Normalizer(stop, stem)
+
+    before, before_time = timed(lambda: [legacy_fixer(c, stop, stem).split() for c in comments])
+    after, after_time = timed(lambda: list(normalizer.batch(comments)))
+    assert before == after
+
+    print 'fixer (stop=%s, stem=%s), %d comments' % (stop, stem, count)
+    print '  before: %10.0f comments/sec' % (count / before_time)
+    print '  after:  %10.0f comments/sec' % (count / after_time)
+    print '  speedup: %.1fx' % (before_time / after_time)
+
+
+def bench_sentiment(count=1000000):
+    """
+    Benchmark.
+
+    Prints comments per second for the word lookup loop in analyser.sentiment
+    and the vectorized scoring.SentimentEngine
+    """
+    subreddit = synthetic_data(subs=10, posts=100, comments=count // 1000)
+    tokenized = corpus.TokenizedCorpus.build(subreddit, False, False, split=True)
+
+    before, before_time = timed(anl.sentiment, subreddit, SENTIMENT)
+    after, after_time = timed(scoring.SentimentEngine(SENTIMENT).score, tokenized)
+    assert before == after
+
+    print 'sentiment, %d comments' % count
+    print '  before: %10.0f comments/sec' % (count / before_time)
+    print '  after:  %10.0f comments/sec' % (count / after_time)
+    print '  speedup: %.1fx' % (before_time / after_time)
+
+
+def bench_parallel(count=200000, workers=(1, 2, 4, 8), chunksize=16):
+    """
+    Benchmark.
+
+    Prints the time of the parallel analysis functions for a number of workers,
+    the number of CPUs is always included
+    """
+    subreddit = synthetic_data(subs=10, posts=100, comments=count // 1000)
+    split = corpus.TokenizedCorpus.build(subreddit, False, False, split=True)
+    stop = corpus.TokenizedCorpus.build(subreddit, True, False)
+    runs = [('sentiment', lambda n: parallel.sentiment(split, SENTIMENT, n, chunksize)),
+            ('lexical_diversity', lambda n: parallel.lexical_diversity(stop, n, chunksize)),
+            ('collocations_bigram', lambda n: parallel.collocations_bigram(stop, workers=n,
+                                                                             chunksize=chunksize)),
+            ('get_unknownwords', lambda n: parallel.get_unknownwords(stop, SENTIMENT, n, chunksize))]
+
+    workers = sorted(set(workers) | set([multiprocessing.cpu_count()]))
+    print 'parallel, %d comments' % count
+    for name, func in runs:
+        _, single = timed(func, 1)
+        print '  %s' % name
+        for n in workers:
+            _, seconds = timed(func, n)
+            print '    %2d workers: %7.2f s  speedup %.1fx' % (n, seconds, single / seconds)
+
+
+def touch_last(subreddit, count=2):
+    """Read every comment of the last sub-reddits."""
+    for name in sorted(subreddit.keys())[-count:]:
+        for sub in subreddit[name].values():
+            for comment in sub.comments:
+                pass
+
+
+def bench_store(count=500000):
+    """
+    Benchmark.
+
+    Prints the time and peak memory of reading the last two sub-reddits
+    with scraper.load_data and with the memory-mapped store.open_store
+    """
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        write_data(synthetic_data(subs=10, posts=100, comments=count // 1000))
+        _, convert_time = timed(store.convert, 'sub-reddits.txt')
+
+        runs = [('load_data', "scraper.load_data('sub-reddits.txt')"),
+                ('open_store', "store.open_store('sub-reddits.txt')")]
+        print 'store, %d comments, reading the last 2 of 10 sub-reddits' % count
+        print '  convert: %7.2f s' % convert_time
+        for name, loader in runs:
+            statement = 'benchmark.touch_last(benchmark.%s)' % loader
+            _, seconds = timed(lambda: eval(statement, {'benchmark': sys.modules[__name__]}))
+            print '  %-11s %6.2f s  peak %7.1f MB' % (name + ':', seconds, peak_memory(statement))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+
+def pickle_search(subreddit, phrase, limit=None):
+    """Return the first limit comments containing a phrase, scanning every comment."""
+    found = []
+    for name, data in subreddit.items():
+        for sub_id, sub in data.items():
+            for comment in sub.comments:
+                if phrase in comment:
+                    found.append((name, sub_id, comment))
+                    if len(found) == limit:
+                        return found
+    return found
+
+
+def bench_sqlite(count=200000, queries=20):
+    """
+    Benchmark.
+
+    Prints the time of migrating the pickles to the SQLite store, and the
+    latency of full-text search and thread sentiment queries against
+    loading the pickles and scanning them
+    """
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        write_data(synthetic_data(subs=10, posts=100, comments=count // 1000))
+        database, migrate_time = timed(sqlstore.migrate, 'sub-reddits.txt', False)
+        _, score_time = timed(database.add_scores, SENTIMENT)
+        size = os.path.getsize(sqlstore.database_path('sub-reddits.txt')) / 2 ** 20
+        print 'sqlite, %d comments in 10 sub-reddits' % count
+        print '  migrate: %7.2f s  scores %.2f s  %.1f MB' % (migrate_time, score_time, size)
+
+        def search_pickles(phrase, limit):
+            return lambda: pickle_search(scraper.load_data('sub-reddits.txt'), phrase, limit)
+
+        def search_database(phrase, limit):
+            return lambda: database.search('"%s"' % phrase, limit=limit)
+
+        def sentiment_pickles():
+            return anl.sentiment(scraper.load_data('sub-reddits.txt'), SENTIMENT)
+
+        def sentiment_database():
+            return database.thread_sentiment(below=0)
+
+        runs = [('first 100, pickles', search_pickles('love hate', 100), 1),
+                ('first 100, sqlite', search_database('love hate', 100), queries),
+                ('rare phrase, pickles', search_pickles('love hate amazing', None), 1),
+                ('rare phrase, sqlite', search_database('love hate amazing', None), queries),
+                ('sentiment, pickles', sentiment_pickles, 1),
+                ('sentiment, sqlite', sentiment_database, queries)]
+        for name, run, repeat in runs:
+            _, seconds = timed(lambda: [run() for _ in xrange(repeat)])
+            print '  %-22s %9.2f ms per query' % (name + ':', 1000 * seconds / repeat)
+        database.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+class _Post(object):
+
+    def __init__(self, id):
+        self.id = id
+        self.url = self.title = self.selftext = id
+        self.num_comments = 100
+
+
+class LatencyClient(object):
+
+    """Reddit client without network access where every request takes latency seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def top(self, name, limit):
+        time.sleep(self.latency)
+        return [_Post('%s_%d' % (name, i)) for i in xrange(limit)]
+
+    def comment_items(self, submission):
+        time.sleep(self.latency)
+        return list(enumerate(synthetic_comments(100, seed=submission.id)))
+
+
+def bench_harvest(subs=10, latency=0.05, rate=1000, workers=(1, 4, 16)):
+    """
+    Benchmark.
+
+    Prints submissions per second fetched by the Harvester from a client
+    with a fixed latency per request, below the given rate limit
+    """
+    names = ['sub%d' % i for i in xrange(subs)]
+    print 'harvest, %d sub-reddits, %.0f ms per request, %d requests/sec limit' % (
+        subs, latency * 1000, rate)
+    for n in workers:
+        crawler = harvester.Harvester(LatencyClient(latency), harvester.TokenBucket(rate, n), n)
+        _, seconds = timed(crawler.harvest, names, lambda name, data: None)
+        print '  %2d workers: %7.2f s  %7.1f submissions/sec' % (n, seconds, subs * 10 / seconds)
+
+
+class LegacySubmission:
+
+    """The Submission class before it stored comments in a buffer."""
+
+    def __init__(self, url, title, text, comments):
+        self.url = url
+        self.text = text
+        self.title = title
+        self.comments = comments
+
+
+def build_submissions(cls, count, per_submission=100):
+    """Return a list of submissions of a class holding count comments in total."""
+    return [cls('url', 'title', 'text',
+                [comment.decode('ascii') for comment in synthetic_comments(per_submission, seed=i)])
+            for i in xrange(count // per_submission)]
+
+
+def bench_submission(count=100000):
+    """
+    Benchmark.
+
+    Prints the memory used per 100k comments by the old and the compact Submission
+    """
+    base = peak_memory('benchmark.build_submissions(benchmark.LegacySubmission, 100)')
+    print 'submission, %d comments' % count
+    for name in ('LegacySubmission', 'Submission'):
+        peak = peak_memory('subs = benchmark.build_submissions(benchmark.%s, %d)' % (name, count))
+        print '  %-17s %7.1f MB per 100k comments' % (name + ':', (peak - base) * 100000 / count)
+
+
+def finder_collocations(tokenized):
+    """Return the top bigrams and trigrams of every thread with NLTK finders, as analyser did."""
+    no_the = lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3)
+    result = []
+    for name, data in tokenized.items():
+        for sub_id, sub in data.items():
+            words = sub.words()
+            finder = nltk.collocations.BigramCollocationFinder.from_words(words)
+            finder.apply_freq_filter(4)
+            result.append(finder.nbest(nltk.collocations.BigramAssocMeasures.raw_freq, 5))
+            finder = nltk.collocations.TrigramCollocationFinder.from_words(words)
+            finder.apply_freq_filter(4)
+            finder.apply_ngram_filter(no_the)
+            result.append(finder.nbest(nltk.collocations.TrigramAssocMeasures.raw_freq, 5))
+    return result
+
+
+def store_collocations(store):
+    """Return the same collocations as finder_collocations from an ngramstore.NgramStore."""
+    no_the = lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3)
+    result = []
+    for name, sub_id, _ in store.threads:
+        result.append(store.top(2, 5, name, sub_id, freq=4))
+        result.append(store.top(3, 5, name, sub_id, freq=4, ngram_filter=no_the))
+    return result
+
+
+def bench_ngrams(count=200000):
+    """
+    Benchmark.
+
+    Prints the time of the bigram and trigram collocations of every thread
+    with a new NLTK finder per thread and with the shared n-gram store
+    """
+    subreddit = synthetic_data(subs=10, posts=100, comments=count // 1000)
+    tokenized = corpus.TokenizedCorpus.build(subreddit, False, False)
+
+    before, before_time = timed(finder_collocations, tokenized)
+    counts, build_time = timed(ngramstore.NgramStore.build, tokenized)
+    after, query_time = timed(store_collocations, counts)
+    assert before == after
+
+    print 'ngrams, %d comments, %d threads' % (count, len(counts.threads))
+    print '  finders: %7.2f s' % before_time
+    print '  build:   %7.2f s' % build_time
+    print '  queries: %7.2f s' % query_time
+    print '  speedup: %.1fx, %.1fx with a saved store' % (before_time / (build_time + query_time),
+                                                         before_time / query_time)
+
+
+def filtered_neighbours(finder, words):
+    """Return the top 10 bigrams of each word by copying and filtering the finder, as analyser did."""
+    result = []
+    for word in words:
+        filtered = copy.copy(finder)
+        filtered.apply_ngram_filter(lambda w1, w2: word != w1 and word != w2)
+        result.append(filtered.score_ngrams(nltk.collocations.BigramAssocMeasures.raw_freq)[:10])
+    return result
+
+
+def bench_unknowncoll(count=100000, unknown=200):
+    """
+    Benchmark.
+
+    Prints the time to find the top 10 bigrams of unknown words by filtering
+    a copy of the corpus finder per word and with the inverted stream.BigramIndex
+    """
+    subreddit = synthetic_data(subs=10, posts=10, comments=count // 100)
+    finder = stream.bigram_finder(subreddit, True, False)
+    # numbered words give the corpus a realistic number of distinct bigrams
+    rand = random.Random(0)
+    for i in xrange(count):
+        finder.ngram_fd[('word%d' % rand.randrange(5000), 'word%d' % rand.randrange(5000))] += 1
+    words = ['word%d' % i for i in xrange(unknown)]
+
+    before, before_time = timed(filtered_neighbours, finder, words)
+    index, build_time = timed(stream.BigramIndex.from_finder, finder)
+    after, query_time = timed(lambda: [index.neighbours(word, 10) for word in words])
+    assert before == after
+
+    print 'unknowncoll, %d bigrams, %d unknown words' % (len(finder.ngram_fd), unknown)
+    print '  copy and filter: %7.2f s' % before_time
+    print '  index build:     %7.2f s' % build_time
+    print '  index queries:   %7.3f s' % query_time
+    print '  speedup: %.1fx' % (before_time / (build_time + query_time))
+
+
+def unknown_words(tokenized, legacy):
+    """
+    Collect the unknown words of a corpus as analyser.get_unknownwords does,
+    in lists of scraper.UnknownWord if legacy is True
+    """
+    unknowndict = collections.defaultdict(list)
+    stats = unknownstats.UnknownStats()
+    for name, data in tokenized.items():
+        for sub_id, sub in data.items():
+            for words in sub.token_lists():
+                value = sum(map(lambda word: SENTIMENT.get(word, 0), words))
+                unknown = [word for word in words if word not in SENTIMENT]
+                if legacy:
+                    for word in unknown:
+                        unknowndict[word].append(scraper.UnknownWord(name, value, value / len(words)))
+                elif unknown:
+                    stats.add(name, unknown, value, value / len(words))
+    return unknowndict if legacy else stats
+
+
+def save_unknown(tokenized, legacy, path):
+    """Collect and write the unknown words of a corpus, see unknown_words."""
+    collected = unknown_words(tokenized, legacy)
+    if legacy:
+        with open(path + '.p', 'wb') as out:
+            pickle.dump(collected, out)
+    else:
+        collected.save(path + '.npz')
+
+
+def legacy_unknownsent(path):
+    """Filter the unknown words of a pickle as analyser.unknownsent did, used as a baseline."""
+    words = []
+    for word, data in pickle.load(open(path + '.p', 'rb')).items():
+        if(len(data) > 100 and abs(sum([point.value for point in data]) / len(data)) > 5):
+            words.append((word, sum([point.value for point in data]) / len(data)))
+    return words
+
+
+def bench_unknown(count=100000):
+    """
+    Benchmark.
+
+    Prints the time, peak memory and file size of collecting the unknown
+    words in lists of scraper.UnknownWord and in an unknownstats.UnknownStats,
+    and the time of analyser.unknownsent on the written file
+    """
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        write_data(synthetic_data(subs=10, posts=10, comments=count // 100))
+        corpus.load_corpus('sub-reddits.txt', True, False)
+        print 'unknown words, %d comments' % count
+        for name, legacy, load in (('UnknownWord', True, legacy_unknownsent),
+                                   ('UnknownStats', False,
+                                    lambda path: unknownstats.load_unknown(path).frequent())):
+            statement = ("benchmark.save_unknown(benchmark.corpus.load_corpus("
+                         "'sub-reddits.txt', True, False), %s, 'unknown')" % legacy)
+            _, seconds = timed(lambda: eval(statement, {'benchmark': sys.modules[__name__]}))
+            peak = peak_memory(statement)
+            size = os.path.getsize('unknown' + ('.p' if legacy else '.npz')) / 2 ** 10
+            _, load_time = timed(load, 'unknown')
+            print '  %-13s collect %6.2f s  peak %7.1f MB  file %8.1f KB  unknownsent %6.3f s' % (
+                name + ':', seconds, peak, size, load_time)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def bench_clouds(count=40, workers=(1, 2, 4)):
+    """
+    Benchmark.
+
+    Prints the time of rendering word clouds with cloudfarm.render_all for
+    a number of workers, and of a second run where nothing has changed
+    """
+    words = [word for comment in synthetic_comments(2000) for word in comment.split()]
+    index = stream.BigramIndex.from_finder(nltk.collocations.BigramCollocationFinder.from_words(words))
+    unknown = [(word, 1 if i % 2 else -1) for i, word in enumerate(WORDS[:count])]
+    jobs = cloudfarm.cloud_jobs(index, unknown * (count // len(unknown) + 1))[:count]
+    jobs = [('%s%d' % (word, i), score, cloudwords) for i, (word, score, cloudwords) in enumerate(jobs)]
+
+    workers = sorted(set(workers) | set([multiprocessing.cpu_count()]))
+    print 'clouds, %d images' % len(jobs)
+    for n in workers:
+        tmp = tempfile.mkdtemp()
+        try:
+            timings, seconds = timed(cloudfarm.render_all, jobs, tmp, None, n, False)
+            _, unchanged = timed(cloudfarm.render_all, jobs, tmp, None, n, False)
+        finally:
+            shutil.rmtree(tmp)
+        print '    %2d workers: %6.2f s, %.3f s per image, unchanged run %.3f s' % (
+            n, seconds, sum(t for _, t in timings) / len(timings), unchanged)
+
+
+def bench_report(count=100000, workers=(1, 2, 4)):
+    """
+    Benchmark.
+
+    Prints the time of writing the plots of visualizer.report with
+    visualizer.render_plots for a number of workers
+    """
+    subreddit = synthetic_data(subs=10, posts=10, comments=count // 100)
+    tokenized = corpus.TokenizedCorpus.build(subreddit, True, False)
+    names, sent_scores, _ = anl.sentiment(subreddit, SENTIMENT)
+    lex_names, lex_scores, _ = anl.lexical_diversity(tokenized)
+    freq_names, freq_dists, _ = anl.most_frequent_words(tokenized)
+    plots = [('lexical_avg', 'plot_bar_avg', (lex_names, lex_scores)),
+             ('lexical', 'plot_bar', (lex_names, lex_scores)),
+             ('sentiment_avg', 'plot_bar_avg', (names, sent_scores)),
+             ('sentiment', 'plot_bar', (names, sent_scores)),
+             ('freqs', 'plot_bar_compare_freqs', (freq_names, freq_dists)),
+             ('sent_lex_avg', 'plot_bar_compare_avg', (names, sent_scores, lex_scores)),
+             ('sent_lex', 'plot_bar_compare', (names, sent_scores, lex_scores))]
+
+    workers = sorted(set(workers) | set([multiprocessing.cpu_count()]))
+    print 'report, %d plots' % len(plots)
+    for n in workers:
+        tmp = tempfile.mkdtemp()
+        try:
+            _, seconds = timed(visualizer.render_plots, plots, tmp, n)
+        finally:
+            shutil.rmtree(tmp)
+        print '    %2d workers: %6.2f s' % (n, seconds)
+
+
+def legacy_cumulative_distribution(freq_dist):
+    """The cumulative distribution loop of plot_bar_compare_freqs before numpy, used as a baseline."""
+    freq_values = sorted(freq_dist.values(), reverse=True)
+    nr_of_words = sum(freq_dist.values())
+    percents = [value / nr_of_words for value in freq_values]
+    cum_dist = []
+    s = 0
+    for p in percents:
+        s = s + p
+        cum_dist.append(s)
+    return cum_dist
+
+
+def bench_cdf(vocabulary=1000000, subs=10):
+    """
+    Benchmark.
+
+    Prints the time of the cumulative distributions of plot_bar_compare_freqs
+    with the Python loop and with visualizer.cumulative_distribution, and of
+    drawing the plot with all points and with one point per pixel
+    """
+    rand = random.Random(0)
+    freq_dist = nltk.FreqDist(dict(('w%d' % i, int(rand.paretovariate(1.1))) for i in xrange(vocabulary)))
+
+    before, before_time = timed(legacy_cumulative_distribution, freq_dist)
+    (_, after), after_time = timed(visualizer.cumulative_distribution, freq_dist)
+    assert abs(before[-1] - after[-1]) < 1e-6
+
+    print 'cdf, %d words' % vocabulary
+    print '  loop:   %6.2f s' % before_time
+    print '  numpy:  %6.2f s  speedup %.1fx' % (after_time, before_time / after_time)
+    visualizer.plt.switch_backend('Agg')
+    names = ['sub%d' % i for i in xrange(subs)]
+    tmp = tempfile.mkdtemp()
+    try:
+        for name, downsample in (('all points', False), ('downsampled', True)):
+            _, seconds = timed(visualizer.plot_bar_compare_freqs, names, [freq_dist] * subs,
+                               os.path.join(tmp, 'freqs.png'), downsample)
+            print '  plot of %d sub-reddits, %-11s %6.2f s' % (subs, name + ':', seconds)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def bench_lexicon(entries=2477, loads=1000):
+    """
+    Benchmark.
+
+    Prints the time of parsing an AFINN sized word list as scraper.load_sent
+    did, of compiling it and of loading the compiled lexicon
+    """
+    rand = random.Random(0)
+    words = ['%s%d' % (rand.choice(WORDS), i) for i in xrange(entries)]
+    lines = ['%s\t%d\n' % (' '.join(words[i:i + 1 + (i % 100 == 0) * 2]), rand.randint(-5, 5))
+             for i in xrange(entries)]
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+        os.mkdir('AFINN')
+        with open('AFINN/AFINN-111.txt', 'wb') as out:
+            out.writelines(lines)
+
+        def legacy_load_sent():
+            return dict(map(lambda (k, v): (k, int(v)),
+                            [line.split('\t') for line in open('AFINN/AFINN-111.txt', 'rb')]))
+
+        def cached(stem):
+            for _ in xrange(loads):
+                lexicon.load_lexicon('afinn', stem)
+
+        print 'lexicon, %d entries' % entries
+        _, seconds = timed(lambda: [legacy_load_sent() for _ in xrange(loads)])
+        print '  text parse:         %8.3f ms' % (seconds * 1000 / loads)
+        for stem in (False, True):
+            _, build = timed(lexicon.load_lexicon, 'afinn', stem)
+            _, seconds = timed(cached, stem)
+            print '  stem=%-5s build:   %8.3f ms  cached load %.3f ms' % (stem, build * 1000,
+                                                                        seconds * 1000 / loads)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def bench_phrases(count=200000):
+    """
+    Benchmark.
+
+    Prints comments per second for the word lookup loop in analyser.sentiment
+    and for phrases.PhraseScorer with multi-word entries and negation
+    """
+    subreddit = synthetic_data(subs=10, posts=100, comments=count // 1000)
+    entries = dict(SENTIMENT)
+    entries.update({'really good': 4, 'people hate': -4, 'terrible game': -4, 'isn\'t funny': -3})
+    lex = lexicon.Lexicon.build(entries.items())
+    tokenized = corpus.TokenizedCorpus.build(subreddit, False, False)
+
+    _, before_time = timed(anl.sentiment, subreddit, SENTIMENT)
+    _, raw_time = timed(phrases.sentiment, subreddit, lex)
+    _, after_time = timed(phrases.sentiment, tokenized, lex)
+
+    print 'phrases, %d comments' % count
+    print '  word lookup:           %10.0f comments/sec' % (count / before_time)
+    print '  phrases, raw data:     %10.0f comments/sec' % (count / raw_time)
+    print '  phrases, tokenized:    %10.0f comments/sec' % (count / after_time)
+
+
+def zipf_words(count, vocabulary, chunk=20, seed=0):
+    """
+    Synthetic data.
+
+    Yield lists of chunk words, count words in all, drawn from a vocabulary
+    with Zipfian frequencies, 'w0' the most frequent. Only 100000 words
+    are held at a time.
+    """
+    cumulative = np.cumsum(1 / np.arange(1, vocabulary + 1))
+    rand = np.random.RandomState(seed)
+    for start in xrange(0, count, 100000):
+        draws = rand.random_sample(min(100000, count - start)) * cumulative[-1]
+        words = ['w%d' % rank for rank in np.searchsorted(cumulative, draws)]
+        for i in xrange(0, len(words), chunk):
+            yield words[i:i + chunk]
+
+
+def exact_counts(count, vocabulary):
+    """Return the exact word counts and distinct words of zipf_words."""
+    counts = collections.Counter()
+    distinct = set()
+    for words in zipf_words(count, vocabulary):
+        counts.update(words)
+        distinct.update(words)
+    return counts, distinct
+
+
+def sketch_counts(count, vocabulary, k=1000):
+    """Return a sketch.TopWords and a stream.DistinctSketch of zipf_words."""
+    top, distinct = sketch.TopWords(k), stream.DistinctSketch()
+    for words in zipf_words(count, vocabulary):
+        top.update(words)
+        distinct.update(words)
+    distinct.flush()
+    top.flush()
+    return top, distinct
+
+
+def bench_sketch(count=2000000, vocabulary=500000, n=100):
+    """
+    Benchmark.
+
+    Prints the time, peak memory and accuracy of the top n words and of the
+    number of distinct words counted exactly and with sketches
+    """
+    # measured first, a child reports at least the peak memory of this process
+    exact_memory = peak_memory('benchmark.exact_counts(%d, %d)' % (count, vocabulary))
+    sketch_memory = peak_memory('benchmark.sketch_counts(%d, %d)' % (count, vocabulary))
+    baseline = peak_memory('for words in benchmark.zipf_words(%d, %d): pass' % (count, vocabulary))
+    (counts, distinct), exact_time = timed(exact_counts, count, vocabulary)
+    (top, estimate), sketch_time = timed(sketch_counts, count, vocabulary)
+
+    expected = counts.most_common(n)
+    found = top.most_common(n)
+    recall = len(set(word for word, _ in expected) & set(word for word, _ in found)) / n
+    error = max(abs(top.sketch[word] - exact) for word, exact in expected)
+    distinct_error = abs(len(estimate.words) - len(distinct)) / len(distinct)
+
+    print 'sketch, %d words, %d distinct' % (count, len(distinct))
+    print '  exact:    %6.2f s  %6.1f MB' % (exact_time, exact_memory - baseline)
+    print '  sketches: %6.2f s  %6.1f MB' % (sketch_time, sketch_memory - baseline)
+    print '  top %d recall %.2f, max count error %d (bound %d)' % (
+        n, recall, error, count / top.sketch.width * math.e)
+    print '  distinct error %.2f%% (standard error %.2f%%)' % (
+        distinct_error * 100, 104 / estimate.words.m ** 0.5)
+
+
+def bench_instrument(count=200000, stages=1000000):
+    """
+    Benchmark.
+
+    Prints the cost of a stage with and without recording, and comments per
+    second of the analyses with and without recording
+    """
+    def empty_stages():
+        stage = instrument.stage
+        for _ in xrange(stages):
+            with stage('score', 'sub', 1):
+                pass
+
+    def analyses(subreddit):
+        anl.sentiment(subreddit, SENTIMENT)
+        anl.lexical_diversity(subreddit)
+        anl.most_frequent_words(subreddit)
+
+    subreddit = synthetic_data(subs=10, posts=100, comments=count // 1000)
+    analyses(subreddit)
+    print 'instrument, %d comments' % count
+    _, disabled = timed(empty_stages)
+    _, off_time = timed(analyses, subreddit)
+    instrument.start()
+    try:
+        _, enabled = timed(empty_stages)
+        _, on_time = timed(analyses, subreddit)
+    finally:
+        instrument.stop()
+    print '  stage, disabled:   %8.3f us' % (disabled * 1e6 / stages)
+    print '  stage, recorded:   %8.3f us' % (enabled * 1e6 / stages)
+    print '  analyses, disabled: %10.0f comments/sec' % (3 * count / off_time)
+    print '  analyses, recorded: %10.0f comments/sec' % (3 * count / on_time)
+
+
+def bench_results(subs=50, submissions=200000):
+    """
+    Benchmark.
+
+    Prints the time of the means per sub-reddit of uneven nested lists and
+    of the result table, and of saving and loading them
+    """
+    rand = random.Random(0)
+    sizes = [rand.randint(1, 2 * submissions // subs) for _ in xrange(subs)]
+    names = ['sub%d' % i for i in xrange(subs)]
+    scores = [[rand.gauss(0, 1) for _ in xrange(size)] for size in sizes]
+    titles = [['title %d' % j for j in xrange(size)] for size in sizes]
+    ids = [['%s_%d' % (name, j) for j in xrange(size)] for name, size in zip(names, sizes)]
+    table = results.ResultTable.from_analysis((names, scores, titles), ids, 'sentiment')
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        os.chdir(tmp)
+
+        def save_nested():
+            with open('nested.p', 'wb') as out:
+                pickle.dump((names, scores, titles, ids), out, pickle.HIGHEST_PROTOCOL)
+
+        def load_nested():
+            with open('nested.p', 'rb') as saved:
+                return pickle.load(saved)
+
+        print 'results, %d submissions in %d sub-reddits' % (sum(sizes), subs)
+        _, nested_time = timed(visualizer.means, scores)
+        _, table_time = timed(table.reduce, 'sentiment')
+        print '  means, nested lists: %8.2f ms' % (nested_time * 1000)
+        print '  means, table:        %8.2f ms' % (table_time * 1000)
+        _, seconds = timed(save_nested)
+        _, load_time = timed(load_nested)
+        print '  pickle nested lists: %8.2f ms save  %8.2f ms load' % (seconds * 1000, load_time * 1000)
+        _, seconds = timed(table.save, 'results.npz')
+        _, load_time = timed(results.load_results, 'results.npz')
+        print '  npz table:           %8.2f ms save  %8.2f ms load' % (seconds * 1000, load_time * 1000)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def bench_import(modules=('analyser', 'scoring', 'scraper', 'sqlstore', 'visualizer', 'pipeline'),
+                 repeat=5, limit=0.1):
+    """
+    Benchmark.
+
+    Prints the best time of importing each module in a new interpreter, 
+    and the heavy packages loaded by the import, see lazy.HEAVY. Python 2 
+    has no -X importtime, the import is timed around the statement.
+
+    -> limit: seconds an import may take
+
+    <- list of the modules that took longer than limit or loaded a heavy package
+    """
+    print 'import, best of %d' % repeat
+    slow = []
+    for module in modules:
+        seconds, heavy = min(import_time(module) for _ in xrange(repeat))
+        print '  %-12s %7.1f ms  %s' % (module + ':', seconds * 1000, ' '.join(heavy) or '-')
+        if seconds > limit or heavy:
+            slow.append(module)
+    return slow
+
+
+def synthetic_vocabulary(size):
+    """
+    Synthetic data.
+
+    Return size words, WORDS first and then made up words of letters only,
+    so that the tokenizer keeps them whole
+    """
+    words = list(WORDS[:size])
+    i = 0
+    while len(words) < size:
+        letters = ''
+        n = i
+        while True:
+            letters += chr(ord('a') + n % 26)
+            n //= 26
+            if not n:
+                break
+        words.append('q' + letters)
+        i += 1
+    return words
+
+
+def zipf_corpus(subs=10, posts=10, comments=100, length=20, vocabulary=10000, seed=0):
+    """
+    Synthetic data.
+
+    Return a dictionary of dictionaries of Submissions like scraper.load_data,
+    the same for the same arguments. Words are drawn from synthetic_vocabulary
+    with Zipfian frequencies, the word of rank r with weight 1 / r, and
+    comments have 1 + Poisson(length - 1) words.
+
+    -> subs, posts, comments: number of sub-reddits, posts per sub-reddit
+    and comments per post
+    -> length: mean number of words in a comment
+    -> vocabulary: number of distinct words
+    -> seed: seed for the random generator
+    """
+    vocab = np.array(synthetic_vocabulary(vocabulary), object)
+    cumulative = np.cumsum(1 / np.arange(1, vocabulary + 1))
+    rand = np.random.RandomState(seed)
+    endings = ['.', '!', '?', ', ok.', '']
+    subreddit = dict()
+    for i in xrange(subs):
+        data = dict()
+        for j in xrange(posts):
+            lengths = 1 + rand.poisson(length - 1, comments)
+            draws = rand.random_sample(lengths.sum()) * cumulative[-1]
+            words = vocab[np.searchsorted(cumulative, draws)]
+            ends = np.cumsum(lengths)
+            texts = []
+            for k, end in enumerate(ends):
+                text = ' '.join(words[end - lengths[k]:end])
+                texts.append(text.capitalize() + endings[rand.randint(len(endings))])
+            data['p%d_%d' % (i, j)] = Submission('url', 'title %d' % j, 'text', texts)
+        subreddit['sub%d' % i] = data
+    return subreddit
+
+
+def write_lexicon(vocabulary, seed=0):
+    """
+    Write an AFINN word list in the working directory, SENTIMENT 
+    and a valence for every 20th word of synthetic_vocabulary.
+    """
+    rand = random.Random(seed)
+    entries = dict(SENTIMENT)
+    for word in synthetic_vocabulary(vocabulary)[len(WORDS)::20]:
+        entries[word] = rand.choice([-5, -4, -3, -2, -1, 1, 2, 3, 4, 5])
+    if not os.path.isdir('AFINN'):
+        os.mkdir('AFINN')
+    with open(lexicon.LEXICONS['afinn'][0], 'wb') as out:
+        out.writelines('%s\t%d\n' % item for item in sorted(entries.items()))
+
+
+# name -> (sub-reddits, posts, comments, words per comment, vocabulary) of zipf_corpus
+SIZES = {'tiny': (2, 5, 20, 10, 2000),
+         'small': (5, 10, 100, 20, 10000),
+         'medium': (10, 20, 250, 20, 50000),
+         'large': (10, 50, 1000, 20, 200000)}
+
+
+def plot_inputs(subreddit):
+    """Return the arguments of the plot functions for a corpus, as visualizer.report computes them."""
+    names, lex_scores, _ = anl.lexical_diversity(subreddit)
+    freq_names, freq_dists, _ = anl.most_frequent_words(subreddit)
+    sent_names, sent_scores, _ = anl.sentiment(subreddit, scraper.load_sent())
+    lex_by_name = dict(zip(names, lex_scores))
+    aligned = [lex_by_name[name] for name in sent_names]
+    return {'plot_bar_avg': (names, lex_scores),
+            'plot_bar': (names, lex_scores),
+            'plot_bar_compare_freqs': (freq_names, freq_dists),
+            'plot_bar_compare_avg': (sent_names, sent_scores, aligned),
+            'plot_bar_compare': (sent_names, sent_scores, aligned)}
+
+
+def plot_case(plot):
+    """Return the suite case drawing one plot to a PNG file."""
+    def run(subreddit, inputs):
+        visualizer.plt.switch_backend('Agg')
+        getattr(visualizer, plot)(*inputs[plot], path=plot + '.png')
+    return plot, plot_inputs, run, 'plots'
+
+
+def all_comments(subreddit):
+    """Return the comments of all submissions of a corpus."""
+    return [comment for data in subreddit.values() for sub in data.values()
+            for comment in sub.comments]
+
+
+def load_sent(subreddit):
+    """Setup of the sentiment cases."""
+    return scraper.load_sent()
+
+
+def get_unknownwords(subreddit):
+    """Setup of the unknowncoll case."""
+    anl.get_unknownwords('data/unknownwords', False, subreddit)
+
+
+# (name, setup, run, unit) of the suite cases. setup(subreddit) returns the
+# state passed to run(subreddit, state), only run is timed. The throughput is
+# in comments of the corpus per second, or in plots per second for 'plots'.
+CASES = [('load_data', None, lambda subreddit, _: scraper.load_data('sub-reddits.txt'), 'comments'),
+         ('fixer', all_comments,
+          lambda subreddit, comments: [anl.fixer(comment, True, True) for comment in comments],
+          'comments'),
+         ('sentiment', load_sent, anl.sentiment, 'comments'),
+         ('sentiment_phrases', load_sent,
+          lambda subreddit, sent: anl.sentiment(subreddit, sent, phrases=True), 'comments'),
+         ('lexical_diversity', None, lambda subreddit, _: anl.lexical_diversity(subreddit), 'comments'),
+         ('lexical_diversity_sketch', None,
+          lambda subreddit, _: anl.lexical_diversity(subreddit, sketch=True), 'comments'),
+         ('most_frequent_words', None, lambda subreddit, _: anl.most_frequent_words(subreddit), 'comments'),
+         ('most_frequent_words_sketch', None,
+          lambda subreddit, _: anl.most_frequent_words(subreddit, sketch=True), 'comments'),
+         ('collocations_bigram', None,
+          lambda subreddit, _: anl.collocations_bigram(True, True, subreddit), 'comments'),
+         ('collocations_trigram', None,
+          lambda subreddit, _: anl.collocations_trigram(True, True, subreddit), 'comments'),
+         ('collocations_ngram', None, lambda subreddit, _: anl.collocations_ngram(3, subreddit), 'comments'),
+         ('get_unknownwords', None,
+          lambda subreddit, _: anl.get_unknownwords('data/unknownwords', False, subreddit), 'comments'),
+         ('unknowncoll', get_unknownwords,
+          lambda subreddit, _: anl.unknowncoll('unknownwords', False, subreddit, workers=1), 'comments')]
+CASES += [plot_case(plot) for plot in ['plot_bar_avg', 'plot_bar', 'plot_bar_compare_freqs',
+                                       'plot_bar_compare_avg', 'plot_bar_compare']]
+
+
+def run_case(name, size='small', seed=0):
+    """
+    Run one case of the suite in a temporary directory holding the corpus 
+    in the layout read by scraper.load_data and a synthetic AFINN word list.
+
+    -> name: name of a case in CASES, None to only create the corpus
+    -> size: name of a corpus size in SIZES
+
+    <- (seconds, units) of the timed run
+    """
+    subs, posts, comments, length, vocabulary = SIZES[size]
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        os.chdir(tmp)
+        subreddit = zipf_corpus(subs, posts, comments, length, vocabulary, seed)
+        write_data(subreddit)
+        write_lexicon(vocabulary, seed)
+        if name is None:
+            return 0, 0
+        setup, run, unit = dict((case[0], case[1:]) for case in CASES)[name]
+        # the analyses print their results
+        sys.stdout = open(os.devnull, 'w')
+        state = setup(subreddit) if setup else None
+        _, seconds = timed(run, subreddit, state)
+        return seconds, subs * posts * comments if unit == 'comments' else 1
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+
+
+def measure_case(name, size='small', seed=0):
+    """
+    Run one case of the suite, see run_case, in a new interpreter.
+
+    <- dictionary of the seconds, units, units per second and peak resident memory in MB
+    """
+    code = ('import json, resource, sys\n'
+            'sys.path.insert(0, %r)\n'
+            'import benchmark\n'
+            'seconds, units = benchmark.run_case(%r, %r, %r)\n'
+            'peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0\n'
+            'print json.dumps({"seconds": seconds, "units": units, "peak_mb": peak})'
+            % (HERE, name, size, seed))
+    env = dict(os.environ, MPLBACKEND='Agg')
+    result = json.loads(subprocess.check_output([sys.executable, '-c', code], env=env).splitlines()[-1])
+    result['rate'] = result['units'] / result['seconds'] if result['seconds'] else 0.0
+    return result
+
+
+def suite(size='small', names=None, baseline=None, save=None, tolerance=0.25):
+    """
+    Benchmark suite.
+
+    Runs every case of CASES on a zipf_corpus, each in a new interpreter, 
+    and prints its time, throughput and peak memory, compared to a saved 
+    baseline if one is given. 
+
+    -> size: name of a corpus size in SIZES
+    -> names: names of the cases to run, all if None
+    -> baseline: JSON file written by an earlier suite with save
+    -> save: write the results to this JSON file
+    -> tolerance: a case is reported as a regression if its time or peak 
+    memory over the corpus exceed the baseline by this fraction
+
+    <- list of the names of the regressed cases
+    """
+    names = names or [case[0] for case in CASES]
+    previous = {}
+    if baseline:
+        with open(baseline, 'rb') as saved:
+            previous = json.load(saved)
+        if previous.get('size') != size:
+            print 'baseline is for size %s, not %s' % (previous.get('size'), size)
+            previous = {}
+    previous = previous.get('results', {})
+
+    corpus_mb = measure_case(None, size)['peak_mb']
+    print 'suite, %s corpus %s, %.1f MB' % (size, SIZES[size], corpus_mb)
+    print '  %-28s %9s %13s %9s' % ('case', 'seconds', 'units/sec', 'MB')
+    results = {}
+    regressions = []
+    for name in names:
+        result = measure_case(name, size)
+        result['over_corpus_mb'] = max(result['peak_mb'] - corpus_mb, 0.0)
+        results[name] = result
+        line = '  %-28s %9.3f %13.0f %9.1f' % (name, result['seconds'], result['rate'], 
+                                               result['over_corpus_mb'])
+        old = previous.get(name)
+        if old:
+            time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.0
+            memory_ratio = ((result['over_corpus_mb'] + 1) / (old['over_corpus_mb'] + 1))
+            line += '  x%.2f time  x%.2f memory' % (time_ratio, memory_ratio)
+            if time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print line
+
+    if save:
+        with open(save, 'wb') as out:
+            json.dump({'size': size, 'python': sys.version.split()[0], 'time': time.time(),
+                       'results': results}, out, indent=1, sort_keys=True)
+    return regressions
+
+
+def main_suite(args):
+    """
+    Command line of the benchmark suite, see suite.
+
+    python benchmark.py suite --size small --save baseline.json
+    python benchmark.py suite --size small --baseline baseline.json
+
+    Exits with status 1 if a case regressed.
+    """
+    parser = argparse.ArgumentParser(prog='benchmark.py suite', description=suite.__doc__.split('\n\n')[1])
+    parser.add_argument('--size', default='small', choices=sorted(SIZES))
+    parser.add_argument('--cases', help='comma separated names of the cases to run')
+    parser.add_argument('--baseline', help='compare to the results saved in this file')
+    parser.add_argument('--save', help='save the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    options = parser.parse_args(args)
+    names = options.cases.split(',') if options.cases else None
+    regressions = suite(options.size, names, options.baseline, options.save, options.tolerance)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        sys.exit(main_suite(sys.argv[2:]))
+    if sys.argv[1:2] == ['imports']:
+        # python benchmark.py imports, exits with status 1 if an import is slow
+        sys.exit(1 if bench_import() else 0)
+    bench_fixer(stop=True, stem=False)
+    bench_fixer(stop=True, stem=True)
+    bench_sentiment()
+    bench_parallel()
+    bench_store()
+    bench_sqlite()
+    bench_harvest()
+    bench_submission()
+    bench_ngrams()
+    bench_unknowncoll()
+    bench_unknown()
+    bench_clouds()
+    bench_report()
+    bench_cdf()
+    bench_lexicon()
+    bench_phrases()
+    bench_sketch()
+    bench_instrument()
+    bench_results()
+    bench_import()
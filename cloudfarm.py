@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+""" Contains the batch rendering of word clouds for unknown words. """
+
+from __future__ import division
+import cPickle as pickle
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+
+import analyser as anl
+import instrument as instrument
+
+
+def cloud_jobs(index, unknownwords, k=10):
+    """
+    Word cloud inputs.
+
+    Return (word, score, cloudwords) for every unknown word with collocations,
+    cloudwords being the other word of its k most frequent bigrams and
+    the bigram frequency scaled to the most frequent one
+
+    -> index: stream.BigramIndex of all comments
+    -> unknownwords: list of (word, score), see analyser.unknownsent
+    """
+    jobs = []
+    for unknown, unknownscore in unknownwords:
+        colls = index.neighbours(unknown, k)
+        cloudwords = [(word, score) for ((word, _), score) in colls if word != unknown]
+        cloudwords += [(word, score) for ((_, word), score) in colls if word != unknown]
+        if not cloudwords:
+            continue
+        maximum = max(score for _, score in cloudwords)
+        jobs.append((unknown, unknownscore,
+                     [(word, score / maximum) for (word, score) in cloudwords]))
+    return jobs
+
+
+def job_key(job, font_path):
+    """Return a hash of everything that changes the image of a job."""
+    return hashlib.md5(repr((job, font_path))).hexdigest()
+
+
+def image_path(directory, word):
+    """Return the path of the image of a word."""
+    return os.path.join(directory, word + '.png')
+
+
+def render(job, path, font_path=None):
+    """
+    Draw the word cloud of a job to a PNG file, without a display.
+
+    Green words for a positive score and red for a negative one, with the
+    word as title.
+
+    -> font_path: TrueType font, the font bundled with wordcloud if None
+    """
+    # imported here so that only rendering needs matplotlib and wordcloud
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from wordcloud import WordCloud
+
+    unknown, unknownscore, cloudwords = job
+    wordcloud = WordCloud(font_path=font_path, random_state=3)
+    wordcloud.fit_words(dict(cloudwords))
+    if(unknownscore > 0):
+        wordcloud = wordcloud.recolor(color_func=anl.green_color_func, random_state=3)
+    else:
+        wordcloud = wordcloud.recolor(color_func=anl.red_color_func, random_state=3)
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    axes.set_title(unknown)
+    axes.imshow(wordcloud.to_array())
+    axes.axis("off")
+    figure.savefig(path, bbox_inches='tight')
+
+
+def _render_task(args):
+    job, path, font_path = args
+    start = time.time()
+    render(job, path, font_path)
+    return job[0], time.time() - start
+
+
+def render_all(jobs, directory='plots/clouds/', font_path=None, workers=None, verbose=True):
+    """
+    Render word clouds in a process pool.
+
+    Images whose job and font have not changed since the last call, according
+    to the hashes kept in directory/clouds.p, are not rendered again. Every
+    image is recorded as soon as it is rendered, so a failed call keeps
+    the images it finished.
+
+    -> jobs: list of (word, score, cloudwords), see cloud_jobs
+    -> directory: where the images are written
+    -> font_path: TrueType font, the font bundled with wordcloud if None
+    -> workers: number of processes, the number of CPUs if None, 1 renders in this process
+    -> verbose: print the time of every image
+
+    <- list of (word, seconds) for the rendered images
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    manifest_path = os.path.join(directory, 'clouds.p')
+    try:
+        with open(manifest_path, 'rb') as saved:
+            manifest = pickle.load(saved)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        manifest = {}
+
+    keys = {}
+    tasks = []
+    for job in jobs:
+        path = image_path(directory, job[0])
+        keys[job[0]] = job_key(job, font_path)
+        if manifest.get(job[0]) != keys[job[0]] or not os.path.exists(path):
+            tasks.append((job, path, font_path))
+
+    start = time.time()
+    timings = []
+    pool = None
+    try:
+        with instrument.stage('render'):
+            if workers == 1 or len(tasks) <= 1:
+                rendered = itertools.imap(_render_task, tasks)
+            else:
+                pool = multiprocessing.Pool(workers)
+                rendered = pool.imap_unordered(_render_task, tasks)
+            for word, seconds in rendered:
+                manifest[word] = keys[word]
+                timings.append((word, seconds))
+                if verbose:
+                    print '%s: %.2f s' % (word, seconds)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        with open(manifest_path, 'wb') as out:
+            pickle.dump(manifest, out, pickle.HIGHEST_PROTOCOL)
+    if verbose:
+        print '%d rendered, %d unchanged, %.2f s' % (len(timings), len(jobs) - len(tasks),
+                                                      time.time() - start)
+    return timings
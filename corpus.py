@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+""" Contains the tokenized corpus shared by the analysis functions. """
+
+from array import array
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import os
+
+import analyser as anl
+import instrument as instrument
+import scraper as scraper
+
+
+class Vocabulary(object):
+
+    """Mapping between words and integer token IDs."""
+
+    def __init__(self, words=()):
+        """
+        Create a new vocabulary.
+
+        words = initial words, the first word gets ID 0
+        """
+        self.words = []
+        self.ids = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Return the ID of a word, adding it if it is new."""
+        try:
+            return self.ids[word]
+        except KeyError:
+            self.ids[word] = len(self.words)
+            self.words.append(word)
+            return self.ids[word]
+
+    def encode(self, words):
+        """Return an array of IDs for a list of words."""
+        add = self.add
+        return array('I', [add(word) for word in words])
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, token_id):
+        return self.words[token_id]
+
+    def __contains__(self, word):
+        return word in self.ids
+
+
+class TokenizedSubmission(object):
+
+    """A submission whose comments are stored as token IDs."""
+
+    __slots__ = ('url', 'title', 'text', 'tokens', 'offsets', 'vocab')
+
+    def __init__(self, url, title, text, tokens, offsets, vocab):
+        """
+        Create a new tokenized submission.
+
+        tokens = array of token IDs of all comments concatenated
+
+        offsets = array where comment i is tokens[offsets[i]:offsets[i + 1]]
+
+        vocab = the Vocabulary the IDs refer to
+        """
+        self.url = url
+        self.title = title
+        self.text = text
+        self.tokens = tokens
+        self.offsets = offsets
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def comment_ids(self):
+        """Yield an array of token IDs for each comment."""
+        tokens = self.tokens
+        offsets = self.offsets
+        for i in xrange(len(offsets) - 1):
+            yield tokens[offsets[i]:offsets[i + 1]]
+
+    def token_lists(self):
+        """Yield the words of each comment."""
+        words = self.vocab.words
+        for ids in self.comment_ids():
+            yield [words[i] for i in ids]
+
+    def words(self):
+        """Return the words of all comments concatenated."""
+        words = self.vocab.words
+        return [words[i] for i in self.tokens]
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+class TokenizedCorpus(OrderedDict):
+
+    """
+    Sub-reddit data where every comment has been tokenized once.
+
+    Behaves like the dictionary of dictionaries returned by scraper.load_data,
+    with TokenizedSubmission values sharing a single Vocabulary.
+    """
+
+    def __init__(self, settings=(False, False, False), vocab=None):
+        """
+        Create a new empty corpus.
+
+        settings = (stop, stem, split) used by the Normalizer
+
+        vocab = shared Vocabulary, a new one is created if none is given
+        """
+        OrderedDict.__init__(self)
+        self.settings = tuple(settings)
+        self.vocab = vocab if vocab is not None else Vocabulary()
+        self.signature = None
+
+    @classmethod
+    def build(cls, subreddit, stop, stem, split=False):
+        """
+        Tokenize sub-reddit data.
+
+        -> subreddit: dictionary containing data from sub-reddits
+        -> stop, stem, split: settings for the Normalizer
+
+        <- a new TokenizedCorpus in the same order as subreddit.items()
+        """
+        normalizer = anl.get_normalizer(stop, stem, split)
+        corpus = cls(normalizer.settings)
+        for name, data in subreddit.items():
+            corpus[name] = corpus.tokenize(data, normalizer, name)
+        return corpus
+
+    def tokenize(self, data, normalizer, name=None):
+        """Return a dictionary of TokenizedSubmissions for the sub-reddit name."""
+        vocab = self.vocab
+        tokenized = OrderedDict()
+        for sub_id, sub in data.items():
+            tokens = array('I')
+            offsets = array('I', [0])
+            with instrument.stage('normalize', name, sub_id) as current:
+                for words in normalizer.batch(sub.comments):
+                    tokens.extend(vocab.encode(words))
+                    offsets.append(len(tokens))
+                current.add(len(offsets) - 1, len(tokens))
+            tokenized[sub_id] = TokenizedSubmission(sub.url, sub.title, sub.text,
+                                                    tokens, offsets, vocab)
+        return tokenized
+
+    def __reduce__(self):
+        return (self.__class__, (self.settings, self.vocab),
+                (self.signature,), None, iter(self.items()))
+
+    def __setstate__(self, state):
+        self.signature, = state
+
+
+def source_signature(names, content_hash=False):
+    """
+    Identify the state of the source pickles and their delta logs.
+
+    -> names: names of the sub-reddits
+    -> content_hash: use an md5 of the contents instead of mtime and size
+
+    <- list of (name, fingerprint) tuples
+    """
+    signature = []
+    for name in names:
+        fingerprint = []
+        for path in ('data/' + name + '.p', 'data/' + name + '.delta.p'):
+            if not os.path.exists(path) and path.endswith('.delta.p'):
+                continue
+            if content_hash:
+                md5 = hashlib.md5()
+                with open(path, 'rb') as source:
+                    for block in iter(lambda: source.read(1 << 20), ''):
+                        md5.update(block)
+                fingerprint.append(md5.hexdigest())
+            else:
+                stat = os.stat(path)
+                fingerprint.append((stat.st_mtime, stat.st_size))
+        signature.append((name, fingerprint))
+    return signature
+
+
+def cache_path(filename, stop, stem, split=False):
+    """Return the path of the cached corpus for a list of sub-reddits."""
+    return 'data/%s.tok-%d%d%d.p' % (os.path.splitext(filename)[0], stop, stem, split)
+
+
+def load_corpus(filename, stop, stem, split=False, content_hash=False):
+    """
+    Load a tokenized corpus.
+
+    Returns the cached corpus stored next to the data pickles,
+    tokenizing and saving it if the sub-reddit pickles have changed.
+
+    -> filename: file in data/ listing the sub-reddits, as for scraper.load_data
+    -> stop, stem, split: settings for the Normalizer
+    -> content_hash: detect changes by content instead of mtime and size
+    """
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    signature = source_signature(names, content_hash)
+    path = cache_path(filename, stop, stem, split)
+
+    try:
+        with instrument.stage('load'):
+            with open(path, 'rb') as cached:
+                if pickle.load(cached) == signature:
+                    return pickle.load(cached)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        pass
+
+    corpus = TokenizedCorpus.build(scraper.load_data(filename), stop, stem, split)
+    corpus.signature = signature
+    with open(path, 'wb') as cached:
+        pickle.dump(signature, cached, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(corpus, cached, pickle.HIGHEST_PROTOCOL)
+    return corpus
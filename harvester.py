@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+""" Responsible for downloading reddit data concurrently. """
+
+from multiprocessing.pool import ThreadPool
+import cPickle as pickle
+import os
+import threading
+import time
+
+import lazy as lazy
+from submission import Submission
+
+praw = lazy.LazyModule('praw', 'scraping')
+
+
+class TokenBucket(object):
+
+    """Thread-safe token bucket limiting the rate of requests."""
+
+    def __init__(self, rate, capacity=1, clock=time.time, sleep=time.sleep):
+        """
+        Create a new token bucket.
+
+        rate = tokens added per second
+
+        capacity = maximum number of tokens, the largest burst of requests
+
+        clock, sleep = time functions, replaceable for testing
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until one is available."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class PrawClient(object):
+
+    """Reddit client used by the Harvester, one method call per API request."""
+
+    def __init__(self, username, password):
+        """Login to reddit with a username and a matching password."""
+        self.reddit = praw.Reddit('Scraper bot for sentiment analysis v 1.0'
+                                  'Url: https://github.com/SwestJ/SAofReddit')
+        self.reddit.login(username, password)
+
+    def top(self, name, limit):
+        """Return the top submissions of the month in a sub-reddit."""
+        return list(self.reddit.get_subreddit(name).get_top_from_month(limit=limit))
+
+    def comment_items(self, submission):
+        """Return (comment_id, body) for all comments of a submission."""
+        submission.replace_more_comments(limit=None, threshold=0)
+        return [(c.id, c.body) for c in praw.helpers.flatten_tree(submission.comments)]
+
+
+def delta_path(directory, name):
+    """Return the path of the delta log of a sub-reddit."""
+    return directory + name + '.delta.p'
+
+
+def replace_file(source, path):
+    """Rename source to path, atomically on POSIX, Windows cannot rename over an existing file."""
+    if os.name != 'posix' and os.path.exists(path):
+        os.remove(path)
+    os.rename(source, path)
+
+
+def write_snapshot(directory, name, data):
+    """
+    Write the data of a sub-reddit as its new snapshot.
+
+    The snapshot holds every comment, so the delta log of the sub-reddit
+    is removed. It is written to a temporary file first, so a crash leaves
+    the old snapshot rather than a corrupt one.
+    """
+    path = directory + name + '.p'
+    with open(path + '.tmp', 'wb') as out:
+        pickle.dump(data, out)
+    replace_file(path + '.tmp', path)
+    if os.path.exists(delta_path(directory, name)):
+        os.remove(delta_path(directory, name))
+
+
+def merge_deltas(directory, name, data):
+    """
+    Add the comments of the delta log of a sub-reddit to its data.
+
+    -> directory: where the sub-reddit pickles are stored
+    -> name: name of the sub-reddit
+    -> data: dictionary of Submissions loaded from the snapshot, updated in place
+    """
+    try:
+        log = open(delta_path(directory, name), 'rb')
+    except IOError:
+        return data
+    with log:
+        while True:
+            try:
+                sub_id, sub = pickle.load(log)
+            except EOFError:
+                break
+            if sub_id in data:
+                data[sub_id].comments = data[sub_id].comments + sub.comments
+            else:
+                data[sub_id] = sub
+    return data
+
+
+class Checkpoint(object):
+
+    """
+    Harvesting progress.
+
+    Records the comment IDs and comment count of every stored submission,
+    the committed size of each delta log and the sub-reddits finished in
+    the current run.
+    """
+
+    def __init__(self, directory='data/'):
+        """
+        Load the checkpoint of a data directory, or start a new one.
+
+        directory = where the sub-reddit pickles are stored
+        """
+        self.directory = directory
+        self.path = directory + 'checkpoint.p'
+        self.seen = {}
+        self.sizes = {}
+        self.done = set()
+        try:
+            with open(self.path, 'rb') as saved:
+                self.seen, self.sizes, self.done = pickle.load(saved)
+        except IOError:
+            pass
+
+    def unchanged(self, name, submission):
+        """Return True if a submission is stored and has no new comments."""
+        count, _ = self.seen.get(name, {}).get(submission.id, (None, None))
+        return count == submission.num_comments
+
+    def known(self, name, sub_id):
+        """Return the set of stored comment IDs of a submission."""
+        return self.seen.get(name, {}).get(sub_id, (None, frozenset()))[1]
+
+    def commit(self, name, fetched):
+        """
+        Store the new comments of a sub-reddit and save the checkpoint.
+
+        The first time a sub-reddit is seen its snapshot is written, see
+        write_snapshot, afterwards new comments are appended to its delta log. Anything
+        written to the log after the last commit, e.g. by a run that
+        crashed, is truncated first.
+
+        -> name: name of the sub-reddit
+        -> fetched: list of (sub_id, Submission with only new comments,
+        all comment IDs, comment count)
+        """
+        seen = self.seen.setdefault(name, {})
+        if name not in self.sizes:
+            write_snapshot(self.directory, name,
+                           dict((sub_id, sub) for sub_id, sub, _, _ in fetched))
+            self.sizes[name] = 0
+        else:
+            path = delta_path(self.directory, name)
+            with open(path, 'ab') as log:
+                log.truncate(self.sizes[name])
+                log.seek(self.sizes[name])
+                for sub_id, sub, _, _ in fetched:
+                    if sub.comments or sub_id not in seen:
+                        pickle.dump((sub_id, sub), log)
+                self.sizes[name] = log.tell()
+        for sub_id, _, comment_ids, count in fetched:
+            seen[sub_id] = (count, frozenset(comment_ids))
+        self.save()
+
+    def forget(self, name):
+        """Drop a sub-reddit, its next commit writes a new snapshot."""
+        self.seen.pop(name, None)
+        self.sizes.pop(name, None)
+        self.done.discard(name)
+        self.save()
+
+    def finish(self, name):
+        """Record that a sub-reddit is done for the current run."""
+        self.done.add(name)
+        self.save()
+
+    def complete(self):
+        """Start a new run the next time."""
+        self.done = set()
+        self.save()
+
+    def save(self):
+        """Write the checkpoint, replacing the old one only when it is complete."""
+        with open(self.path + '.tmp', 'wb') as out:
+            pickle.dump((self.seen, self.sizes, self.done), out, pickle.HIGHEST_PROTOCOL)
+        replace_file(self.path + '.tmp', self.path)
+
+
+class Harvester(object):
+
+    """
+    Concurrent scraper.
+
+    Fetches the comment trees of several submissions at once from a pool of
+    threads. Every request waits for the rate limiter and is retried with
+    exponential backoff, a sub-reddit is saved as soon as all of its
+    submissions are done.
+    
+    With a Checkpoint, submissions whose comment count has not changed are 
+    not fetched again, only new comments are stored, and sub-reddits 
+    finished by a run that crashed are skipped when it is resumed.
+    """
+
+    def __init__(self, client, limiter, workers=4, attempts=3, backoff=2.0,
+                 directory='data/', limit=10, checkpoint=None):
+        """
+        Create a new harvester.
+
+        client = object with top(name, limit) and comment_items(submission), 
+        see PrawClient
+
+        limiter = TokenBucket shared by all requests
+
+        workers = number of concurrent requests
+
+        attempts = number of tries for each request
+
+        backoff = seconds to wait after the first failure, doubled after each failure
+
+        directory = where the sub-reddit pickles are written
+
+        limit = number of top submissions per sub-reddit
+        
+        checkpoint = Checkpoint for incremental harvesting, or None to 
+        write complete snapshots
+        """
+        self.client = client
+        self.limiter = limiter
+        self.workers = workers
+        self.attempts = attempts
+        self.backoff = backoff
+        self.directory = directory
+        self.limit = limit
+        self.checkpoint = checkpoint
+        self.failures = []
+        self.lock = threading.Lock()
+
+    def request(self, func, *args):
+        """Call func after waiting for the limiter, retrying on failure."""
+        for attempt in xrange(self.attempts):
+            self.limiter.acquire()
+            try:
+                return func(*args)
+            except Exception:
+                if attempt == self.attempts - 1:
+                    raise
+                self.limiter.sleep(self.backoff * 2 ** attempt)
+
+    def fetch(self, args):
+        """
+        Return (sub_id, Submission, comment IDs, comment count), or None if
+        it could not be fetched or has not changed since the checkpoint.
+        The Submission only holds comments not in the checkpoint.
+        """
+        name, submission = args
+        known = frozenset()
+        if self.checkpoint:
+            if self.checkpoint.unchanged(name, submission):
+                return None
+            known = self.checkpoint.known(name, submission.id)
+        try:
+            items = self.request(self.client.comment_items, submission)
+        except Exception as e:
+            with self.lock:
+                self.failures.append((name, submission.id, e))
+            return None
+        comments = [body for comment_id, body in items if comment_id not in known]
+        return (submission.id,
+                Submission(submission.url, submission.title, submission.selftext, comments),
+                [comment_id for comment_id, _ in items],
+                getattr(submission, 'num_comments', len(items)))
+
+    def top(self, name):
+        """Return (name, list of top submissions), the list is None on failure."""
+        try:
+            return name, self.request(self.client.top, name, self.limit)
+        except Exception as e:
+            with self.lock:
+                self.failures.append((name, None, e))
+            return name, None
+
+    def save(self, name, data):
+        """
+        Write the data of a sub-reddit as a complete snapshot, see write_snapshot.
+
+        A checkpoint left by incremental harvesting no longer describes the
+        stored comments, so the sub-reddit is dropped from it.
+        """
+        write_snapshot(self.directory, name, data)
+        if os.path.exists(self.directory + 'checkpoint.p'):
+            with self.lock:
+                Checkpoint(self.directory).forget(name)
+
+    def harvest(self, names, save=None):
+        """
+        Mine data from reddit.
+
+        -> names: names of the sub-reddits
+        -> save: function called with (name, data) when a sub-reddit is done,
+        defaults to self.save, ignored with a checkpoint. Without a checkpoint
+        a sub-reddit with failed submissions is not saved
+
+        <- list of the names of the sub-reddits that were saved
+        """
+        save = save or self.save
+        if self.checkpoint:
+            names = [name for name in names if name not in self.checkpoint.done]
+        pool = ThreadPool(self.workers)
+        saved = []
+        pending = []
+        try:
+            for name, submissions in pool.imap_unordered(self.top, names):
+                if submissions is None:
+                    continue
+
+                def done(results, name=name):
+                    fetched = filter(None, results)
+                    try:
+                        if self.checkpoint:
+                            self.checkpoint.commit(name, fetched)
+                            if not self.failures_of(name):
+                                self.checkpoint.finish(name)
+                        elif self.failures_of(name):
+                            # keep the last complete snapshot rather than a partial one
+                            return
+                        else:
+                            save(name, dict((sub[0], sub[1]) for sub in fetched))
+                        saved.append(name)
+                    except Exception as e:
+                        with self.lock:
+                            self.failures.append((name, None, e))
+
+                if submissions:
+                    pending.append(pool.map_async(self.fetch, [(name, s) for s in submissions],
+                                                  callback=done))
+                else:
+                    done([])
+            for result in pending:
+                result.wait()
+        finally:
+            pool.close()
+            pool.join()
+        if self.checkpoint and not self.failures:
+            self.checkpoint.complete()
+        return saved
+
+    def failures_of(self, name):
+        """Return the failures of a sub-reddit."""
+        with self.lock:
+            return [failure for failure in self.failures if failure[0] == name]
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+""" Contains timers and counters for the stages of the analysis. """
+
+from __future__ import division
+from contextlib import contextmanager
+import cProfile
+import csv
+import json
+import os
+import pstats
+import resource
+import time
+
+# The stages timed by the analysis
+STAGES = ('load', 'normalize', 'score', 'aggregate', 'render')
+
+FIELDS = ['level', 'stage', 'subreddit', 'submission', 'calls', 'seconds', 'self_seconds',
+          'comments', 'tokens', 'comments_per_sec', 'tokens_per_sec', 'peak_mb']
+
+_recorder = None
+
+
+class Stage(object):
+
+    """
+    A timed stage of a Recorder, used as a context manager.
+
+    Stages nest. The comments and tokens of a stage are added to the stages
+    around it, and its time is subtracted from their self time.
+    """
+
+    __slots__ = ('recorder', 'key', 'start', 'child', 'comments', 'tokens')
+
+    def __init__(self, recorder, key):
+        self.recorder = recorder
+        self.key = key
+        self.child = 0.0
+        self.comments = 0
+        self.tokens = 0
+
+    def add(self, comments=0, tokens=0):
+        """Count comments and tokens handled by the stage."""
+        self.comments += comments
+        self.tokens += tokens
+
+    def __enter__(self):
+        self.recorder.stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        recorder = self.recorder
+        recorder.stack.pop()
+        if recorder.stack:
+            parent = recorder.stack[-1]
+            parent.child += seconds
+            parent.comments += self.comments
+            parent.tokens += self.tokens
+        stats = recorder.stats.get(self.key)
+        if stats is None:
+            stats = recorder.stats[self.key] = [0, 0.0, 0.0, 0, 0, 0.0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += seconds - self.child
+        stats[3] += self.comments
+        stats[4] += self.tokens
+        if recorder.memory:
+            stats[5] = max(stats[5], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+        return False
+
+
+class NoStage(object):
+
+    """The stage returned while nothing is recorded, it does nothing."""
+
+    __slots__ = ()
+
+    def add(self, comments=0, tokens=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_STAGE = NoStage()
+
+
+class Recorder(object):
+
+    """
+    Time and counts of every (stage, sub-reddit, submission).
+
+    stats = dictionary from (stage, sub-reddit, submission) to
+    [calls, seconds, self seconds, comments, tokens, peak MB]
+    """
+
+    def __init__(self, memory=False):
+        """
+        Create a new recorder.
+
+        memory = record the peak resident memory of the process at the end of each stage
+        """
+        self.stats = {}
+        self.stack = []
+        self.memory = memory
+
+    def stage(self, name, subreddit=None, submission=None):
+        """Return a new stage, within the sub-reddit and submission of the current stage if None."""
+        if subreddit is None and self.stack:
+            _, subreddit, submission = self.stack[-1].key
+        return Stage(self, (name, subreddit, submission))
+
+    def rows(self, level='stage'):
+        """
+        Return the recorded stats as dictionaries with the keys in FIELDS.
+
+        -> level: 'stage' for totals per stage, 'subreddit' per stage
+        and sub-reddit, 'submission' per stage, sub-reddit and submission
+        """
+        depth = {'stage': 1, 'subreddit': 2, 'submission': 3}[level]
+        totals = {}
+        for key, stats in self.stats.items():
+            key = key[:depth] + (None,) * (3 - depth)
+            total = totals.setdefault(key, [0, 0.0, 0.0, 0, 0, 0.0])
+            for i in xrange(5):
+                total[i] += stats[i]
+            total[5] = max(total[5], stats[5])
+
+        rows = []
+        order = lambda item: (STAGES.index(item[0][0]) if item[0][0] in STAGES else len(STAGES),
+                              item[0])
+        for key, (calls, seconds, self_seconds, comments, tokens, peak) in sorted(totals.items(),
+                                                                                 key=order):
+            rows.append({'level': level, 'stage': key[0], 'subreddit': key[1],
+                         'submission': key[2], 'calls': calls, 'seconds': seconds,
+                         'self_seconds': self_seconds, 'comments': comments, 'tokens': tokens,
+                         'comments_per_sec': comments / seconds if seconds else 0.0,
+                         'tokens_per_sec': tokens / seconds if seconds else 0.0,
+                         'peak_mb': peak})
+        return rows
+
+    def summary(self, level='stage'):
+        """Print the recorded stats, see rows."""
+        print '%-10s %-20s %9s %9s %12s %12s' % ('stage', 'sub-reddit', 'seconds', 'self',
+                                               'comments/s', 'tokens/s')
+        for row in self.rows(level):
+            print '%-10s %-20s %9.3f %9.3f %12.0f %12.0f' % (
+                row['stage'], row['subreddit'] or '', row['seconds'], row['self_seconds'],
+                row['comments_per_sec'], row['tokens_per_sec'])
+
+    def write_json(self, path):
+        """Write the stats of every level to a JSON file."""
+        with open(path, 'wb') as out:
+            json.dump(dict((level, self.rows(level)) for level in ('stage', 'subreddit', 'submission')),
+                      out, indent=1, sort_keys=True)
+
+    def write_csv(self, path):
+        """Write the stats of every level to a CSV file, one row per stat."""
+        with open(path, 'wb') as out:
+            writer = csv.DictWriter(out, FIELDS)
+            writer.writeheader()
+            for level in ('stage', 'subreddit', 'submission'):
+                for row in self.rows(level):
+                    writer.writerow(dict((field, '' if value is None else value)
+                                         for field, value in row.items()))
+
+
+def enabled():
+    """Return True if the stages are recorded."""
+    return _recorder is not None
+
+
+def start(memory=False):
+    """Start recording the stages, see Recorder, and return the recorder."""
+    global _recorder
+    _recorder = Recorder(memory)
+    return _recorder
+
+
+def stop():
+    """Stop recording and return the recorder, or None if nothing was recorded."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def stage(name, subreddit=None, submission=None):
+    """
+    Return a context manager timing a stage of the analysis.
+
+    When nothing is recorded the same stage, which does nothing, is returned,
+    so that timing costs one function call.
+
+    -> name: one of STAGES
+    -> subreddit, submission: the data the stage works on, those of the
+    enclosing stage if None
+    """
+    if _recorder is None:
+        return NO_STAGE
+    return _recorder.stage(name, subreddit, submission)
+
+
+def tokenized(words_of):
+    """
+    Return words_of, a function giving the words of each comment of a submission,
+    timing and counting every comment in a normalize stage if stages are recorded.
+    """
+    if _recorder is None:
+        return words_of
+
+    def counted(sub):
+        iterator = iter(words_of(sub))
+        while True:
+            with stage('normalize') as current:
+                words = next(iterator, None)
+                if words is not None:
+                    current.add(1, len(words))
+            if words is None:
+                return
+            yield words
+    return counted
+
+
+@contextmanager
+def capture(directory='stats/', profile=True, memory=True):
+    """
+    Record the stages of a run and write them to files.
+
+    Writes stages.json and stages.csv, see Recorder.rows, to directory,
+    and with profile, the cProfile stats to profile.pstats and the
+    functions by cumulative time to profile.csv. The standard library
+    of Python 2 has no tracemalloc, with memory the peak resident memory
+    at the end of each stage is recorded instead.
+
+    -> directory: where the files are written
+    -> profile: run the cProfile profiler
+    -> memory: record the peak memory of each stage
+
+    <- the Recorder
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    recorder = start(memory)
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if profiler:
+            profiler.disable()
+        stop()
+        recorder.write_json(os.path.join(directory, 'stages.json'))
+        recorder.write_csv(os.path.join(directory, 'stages.csv'))
+        if profiler:
+            write_profile(profiler, directory)
+
+
+def write_profile(profiler, directory):
+    """Write the stats of a cProfile profiler to profile.pstats and profile.csv in directory."""
+    profiler.dump_stats(os.path.join(directory, 'profile.pstats'))
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.items():
+        rows.append((cumulative, total, calls, '%s:%d(%s)' % (filename, line, function)))
+    rows.sort(reverse=True)
+    with open(os.path.join(directory, 'profile.csv'), 'wb') as out:
+        writer = csv.writer(out)
+        writer.writerow(['function', 'calls', 'seconds', 'cumulative_seconds'])
+        for cumulative, total, calls, function in rows:
+            writer.writerow([function, calls, total, cumulative])
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+""" Contains modules that are imported on first use. """
+
+import importlib
+
+# Heavy packages that importing the analysis must not load
+HEAVY = ('nltk', 'matplotlib', 'wordcloud', 'praw', 'numpy')
+
+
+class LazyModule(object):
+
+    """
+    Stands in for a module until one of its attributes is used.
+
+    nltk, matplotlib and praw take about a second to import together,
+    numpy a tenth of that. Bound at module level in their place, importing
+    the analysis costs nothing until they are needed, and plotting and
+    scraping only need their packages installed when they are used.
+    """
+
+    def __init__(self, name, purpose=None):
+        """
+        Create a new lazy module.
+
+        name = full name of the module, such as 'matplotlib.pyplot'
+
+        purpose = what the module is needed for, given in the ImportError
+        if it is not installed
+        """
+        self._name = name
+        self._purpose = purpose
+        self._module = None
+
+    def _load(self):
+        """Import the module once and return it."""
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError as e:
+                if self._purpose is None:
+                    raise
+                raise ImportError('%s, %s needs the %s package' % (e, self._purpose,
+                                                                  self._name.split('.')[0]))
+        return self._module
+
+    def __getattr__(self, attr):
+        # kept on the instance, later uses cost no more than a module attribute
+        value = getattr(self._load(), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return '<lazy module %r%s>' % (self._name, ' (imported)' if self._module else '')
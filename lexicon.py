@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+""" Contains the sentiment lexicons and their compiled cache. """
+
+from array import array
+from itertools import izip
+import marshal
+import os
+
+import lazy as lazy
+
+nltk = lazy.LazyModule('nltk')
+
+# Bumped when the layout of the compiled files changes
+VERSION = 1
+
+
+def parse_afinn(lines):
+    """Yield (entry, valence) for the tab separated lines of an AFINN file."""
+    for line in lines:
+        if not line.strip():
+            continue
+        entry, value = line.rsplit('\t', 1)
+        yield entry.strip(), int(value)
+
+
+# name -> (path of the source file, function yielding (entry, valence) for its lines)
+LEXICONS = {'afinn': ('AFINN/AFINN-111.txt', parse_afinn)}
+
+
+def register_lexicon(name, path, parse):
+    """
+    Make a lexicon available to load_lexicon.
+
+    -> name: name of the lexicon
+    -> path: the source file
+    -> parse: function of the lines of the file yielding (entry, valence),
+    entries of several words are separated by spaces
+    """
+    LEXICONS[name] = (path, parse)
+
+
+class Lexicon(dict):
+
+    """
+    Sentiment lexicon.
+
+    A dictionary from single words to their valence, as scraper.load_sent
+    returned, which also holds the entries of several words. All words are
+    numbered, single word entries first, and each multi-word entry is stored
+    as a tuple of word IDs.
+    """
+
+    def __init__(self, words=(), tokens=(), phrases=(), stem=False):
+        """
+        Create a new lexicon.
+
+        words = dictionary or (word, valence) pairs of single words
+
+        tokens = every word of the lexicon, the position of a word is its ID
+
+        phrases = (tuple of word IDs, valence) pairs of multi-word entries
+
+        stem = Boolean telling if the words are stemmed
+        """
+        dict.__init__(self, words)
+        self.tokens = list(tokens)
+        self._token_ids = None
+        self.phrases = dict(phrases)
+        self.stem = stem
+
+    @property
+    def token_ids(self):
+        """Dictionary from the words of the lexicon to their ID."""
+        if self._token_ids is None:
+            self._token_ids = dict(izip(self.tokens, xrange(len(self.tokens))))
+        return self._token_ids
+
+    @classmethod
+    def build(cls, entries, stem=False):
+        """
+        Compile (entry, valence) pairs.
+
+        With stem, every word is stemmed by the Porter stemmer, as the Normalizer
+        does. Entries which end up the same get the rounded mean of their valences.
+        """
+        stemmer = nltk.stem.PorterStemmer() if stem else None
+        values = {}
+        for entry, value in entries:
+            words = entry.lower().split()
+            if stemmer:
+                words = [stemmer.stem(word) for word in words]
+            values.setdefault(tuple(words), []).append(value)
+
+        lexicon = cls(stem=stem)
+        token_ids = lexicon.token_ids
+        # single words first, so their IDs are the first len(lexicon) IDs
+        entries = sorted(values.items(), key=lambda item: (len(item[0]) > 1, item[0]))
+        for words, entry_values in entries:
+            value = int(round(sum(entry_values) / float(len(entry_values))))
+            if len(words) == 1:
+                lexicon[words[0]] = value
+            ids = []
+            for word in words:
+                if word not in token_ids:
+                    token_ids[word] = len(lexicon.tokens)
+                    lexicon.tokens.append(word)
+                ids.append(token_ids[word])
+            if len(words) > 1:
+                lexicon.phrases[tuple(ids)] = value
+        return lexicon
+
+    def phrase_words(self):
+        """Return a dictionary from multi-word entries, as tuples of words, to their valence."""
+        tokens = self.tokens
+        return dict((tuple(tokens[i] for i in ids), value) for ids, value in self.phrases.items())
+
+    def dumps(self, signature):
+        """
+        Return the compiled lexicon as a string, see loads.
+        
+        The words are stored once, as a tuple in ID order, 
+        with the valences of the single words in an integer array.
+        """
+        values = array('i', [self[word] for word in self.tokens[:len(self)]])
+        return marshal.dumps((VERSION, signature, self.stem, tuple(self.tokens),
+                              values.tostring(), tuple(self.phrases.items())))
+
+    @classmethod
+    def loads(cls, data, signature=None):
+        """Return a lexicon compiled by dumps, or None if it is outdated."""
+        version, saved, stem, tokens, values, phrases = marshal.loads(data)
+        if version != VERSION or (signature is not None and saved != signature):
+            return None
+        return cls(izip(tokens, array('i', values)), tokens, phrases, stem)
+
+
+def compiled_path(path, stem):
+    """Return the path of the compiled lexicon of a source file."""
+    return '%s.%s.lex' % (os.path.splitext(path)[0], 'stem' if stem else 'raw')
+
+
+def load_lexicon(name='afinn', stem=False):
+    """
+    Load a registered lexicon.
+
+    The compiled lexicon next to the source file is read if it is up to date,
+    otherwise the source is parsed and compiled again.
+
+    -> name: name given to register_lexicon
+    -> stem: stem the words of the lexicon, for text normalized with stem=True
+    """
+    path, parse = LEXICONS[name]
+    stat = os.stat(path)
+    signature = (name, stat.st_mtime, stat.st_size)
+    compiled = compiled_path(path, stem)
+    try:
+        with open(compiled, 'rb') as cached:
+            lexicon = Lexicon.loads(cached.read(), signature)
+        if lexicon is not None:
+            return lexicon
+    except (IOError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(path, 'rb') as source:
+        lexicon = Lexicon.build(parse(source), stem)
+    try:
+        with open(compiled, 'wb') as out:
+            out.write(lexicon.dumps(signature))
+    except IOError:
+        pass
+    return lexicon
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+""" Contains the persistent n-gram counts used for collocation queries. """
+
+from __future__ import division
+import os
+
+import corpus as corpus
+import lazy as lazy
+import scoring as scoring
+
+np = lazy.LazyModule('numpy')
+
+
+class NgramStore(object):
+
+    """
+    N-gram counts of every thread of a tokenized corpus.
+
+    An n-gram of token IDs (a, b, c) is kept as the integer key
+    a * V ** 2 + b * V + c, where V is the size of the vocabulary.
+    When V ** n does not fit in 63 bits the distinct n-grams of the corpus
+    are kept as rows of token IDs in grams[n], sorted, and the key of an
+    n-gram is its row, so keys sort the same way in both cases.
+    For each order n the sorted keys of every thread and their counts
+    are stored in flat arrays, with offsets giving the range of each
+    thread. N-grams are counted over all comments of a thread
+    concatenated, as the collocation functions in analyser do.
+    """
+
+    def __init__(self, words, threads, orders, keys, counts, offsets, signature=None, grams=None):
+        """
+        Create a store from its arrays, see build.
+
+        words = list of words indexed by token ID
+
+        threads = list of (name, sub_id, title) in corpus order
+
+        orders = the n-gram orders that were counted
+
+        keys, counts, offsets = dictionaries from order to arrays
+
+        grams = dictionary from the orders too large for packed keys
+        to arrays of the token IDs of their n-grams, one row per key
+        """
+        self.words = words
+        self.threads = threads
+        self.orders = tuple(orders)
+        self.keys = keys
+        self.counts = counts
+        self.offsets = offsets
+        self.signature = signature
+        self.grams = grams or {}
+        self.position = dict(((name, sub_id), i) for i, (name, sub_id, _) in enumerate(threads))
+
+    @classmethod
+    def build(cls, tokenized, orders=(2, 3)):
+        """
+        Count the n-grams of a corpus.TokenizedCorpus.
+
+        Orders whose packed keys would not fit in 63 bits are counted
+        from the rows of the n-grams of all threads at once.
+        """
+        size = max(len(tokenized.vocab), 1)
+        wide = [n for n in orders if size ** n >= 2 ** 63]
+        threads = []
+        keys = dict((n, []) for n in orders)
+        counts = dict((n, []) for n in orders)
+        rows = dict((n, []) for n in wide)
+        for name, data in tokenized.items():
+            for sub_id, sub in data.items():
+                threads.append((name, sub_id, sub.title))
+                tokens = scoring.as_numpy(sub.tokens).astype(np.int64)
+                for n in orders:
+                    if n in rows:
+                        rows[n].append(ngram_rows(tokens, n))
+                        continue
+                    thread_keys, thread_counts = np.unique(ngram_keys(tokens, n, size),
+                                                           return_counts=True)
+                    keys[n].append(thread_keys)
+                    counts[n].append(thread_counts)
+
+        grams = {}
+        for n in wide:
+            lengths = [len(thread_rows) for thread_rows in rows[n]]
+            all_rows = np.concatenate(rows[n]) if rows[n] else np.zeros((0, n), np.int64)
+            if len(all_rows):
+                grams[n], inverse = np.unique(all_rows, axis=0, return_inverse=True)
+            else:
+                # unique cannot reshape an empty array by rows
+                grams[n], inverse = all_rows, np.zeros(0, np.int64)
+            bounds = np.cumsum([0] + lengths)
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                thread_keys, thread_counts = np.unique(inverse[start:end].astype(np.int64),
+                                                       return_counts=True)
+                keys[n].append(thread_keys)
+                counts[n].append(thread_counts)
+
+        offsets = {}
+        for n in orders:
+            offsets[n] = np.zeros(len(threads) + 1, np.int64)
+            np.cumsum([len(k) for k in keys[n]], out=offsets[n][1:])
+            keys[n] = np.concatenate(keys[n]) if threads else np.zeros(0, np.int64)
+            counts[n] = np.concatenate(counts[n]) if threads else np.zeros(0, np.int64)
+        return cls(list(tokenized.vocab.words), threads, orders, keys, counts, offsets,
+                   tokenized.signature, grams)
+
+    def save(self, path):
+        """Write the store to a .npz file."""
+        arrays = {}
+        for n in self.orders:
+            arrays['keys%d' % n] = self.keys[n]
+            arrays['counts%d' % n] = self.counts[n]
+            arrays['offsets%d' % n] = self.offsets[n]
+        for n, grams in self.grams.items():
+            arrays['grams%d' % n] = grams
+        meta = np.empty(1, dtype=object)
+        meta[0] = (self.words, self.threads, self.orders, self.signature)
+        np.savez(path, meta=meta, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Read a store written by save."""
+        with np.load(path, allow_pickle=True) as arrays:
+            words, threads, orders, signature = arrays['meta'][0]
+            return cls(words, threads, orders,
+                       dict((n, arrays['keys%d' % n]) for n in orders),
+                       dict((n, arrays['counts%d' % n]) for n in orders),
+                       dict((n, arrays['offsets%d' % n]) for n in orders),
+                       signature,
+                       dict((n, arrays['grams%d' % n]) for n in orders if 'grams%d' % n in arrays))
+
+    def names(self):
+        """Return the names of the sub-reddits in corpus order."""
+        names = []
+        for name, _, _ in self.threads:
+            if not names or names[-1] != name:
+                names.append(name)
+        return names
+
+    def threads_of(self, name):
+        """Return (sub_id, title) of the threads of a sub-reddit."""
+        return [(sub_id, title) for thread_name, sub_id, title in self.threads
+                if thread_name == name]
+
+    def scope(self, name=None, sub_id=None):
+        """Return the (first, last) thread range of a thread, a sub-reddit or the corpus."""
+        if sub_id is not None:
+            i = self.position[(name, sub_id)]
+            return i, i + 1
+        if name is not None:
+            indices = [i for i, thread in enumerate(self.threads) if thread[0] == name]
+            return (indices[0], indices[-1] + 1) if indices else (0, 0)
+        return 0, len(self.threads)
+
+    def counted(self, n, name=None, sub_id=None):
+        """
+        Return the distinct keys and their counts of order n in a scope,
+        summing the counts of all threads in it.
+        """
+        first, last = self.scope(name, sub_id)
+        start, end = self.offsets[n][first], self.offsets[n][last]
+        keys = self.keys[n][start:end]
+        counts = self.counts[n][start:end]
+        if last - first <= 1:
+            return keys, counts
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        counts = counts[order]
+        if not len(keys):
+            return keys, counts
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+        return keys[starts], np.add.reduceat(counts, starts)
+
+    def decode(self, key, n):
+        """Return the words of an n-gram key."""
+        if n in self.grams:
+            return tuple(self.words[i] for i in self.grams[n][int(key)])
+        size = max(len(self.words), 1)
+        ids = []
+        for _ in xrange(n):
+            key, token_id = divmod(int(key), size)
+            ids.append(token_id)
+        return tuple(self.words[i] for i in reversed(ids))
+
+    def frequent(self, n, freq, name=None, sub_id=None):
+        """
+        Frequency filter.
+
+        Return the n-grams seen at least freq times in a scope,
+        most frequent first
+        """
+        keys, counts = self.counted(n, name, sub_id)
+        keep = counts >= freq
+        keys, counts = keys[keep], counts[keep]
+        order = np.argsort(-counts, kind='mergesort')
+        return [(self.decode(key, n), int(count)) for key, count in zip(keys[order], counts[order])]
+
+    def top(self, n, k, name=None, sub_id=None, freq=1, ngram_filter=None):
+        """
+        Topic mining.
+
+        Return the k most frequent n-grams seen at least freq times in a scope,
+        the same as nbest with raw_freq on an NLTK collocation finder after
+        apply_freq_filter(freq) and apply_ngram_filter(ngram_filter)
+
+        -> n: order of the n-grams, one of self.orders
+        -> k: number of n-grams to return
+        -> name, sub_id: the thread, the sub-reddit if sub_id is None,
+        or the whole corpus if both are None
+        -> ngram_filter: function of the n words, n-grams for which it
+        returns True are left out
+        """
+        keys, counts = self.counted(n, name, sub_id)
+        keep = counts >= freq
+        keys, counts = keys[keep], counts[keep]
+        if ngram_filter is None and len(counts) > k:
+            # only n-grams tied with the k-th count or above can be in the result
+            threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+            keep = counts >= threshold
+            keys, counts = keys[keep], counts[keep]
+        ngrams = [(self.decode(key, n), int(count)) for key, count in zip(keys, counts)]
+        if ngram_filter is not None:
+            ngrams = [(ngram, count) for ngram, count in ngrams if not ngram_filter(*ngram)]
+        ngrams.sort(key=lambda item: (-item[1], item[0]))
+        return [ngram for ngram, _ in ngrams[:k]]
+
+
+def ngram_keys(tokens, n, size):
+    """Return the integer keys of the n-grams of an int64 array of token IDs."""
+    if len(tokens) < n:
+        return np.zeros(0, np.int64)
+    keys = tokens[:len(tokens) - n + 1].copy()
+    for j in xrange(1, n):
+        keys *= size
+        keys += tokens[j:len(tokens) - n + 1 + j]
+    return keys
+
+
+def ngram_rows(tokens, n):
+    """Return an array of the n-grams of an int64 array of token IDs, one row per n-gram."""
+    if len(tokens) < n:
+        return np.zeros((0, n), np.int64)
+    return np.column_stack([tokens[j:len(tokens) - n + 1 + j] for j in xrange(n)])
+
+
+def ngrams_path(filename, stop, stem, split=False):
+    """Return the path of the n-gram store for a list of sub-reddits."""
+    return 'data/%s.ngrams-%d%d%d.npz' % (os.path.splitext(filename)[0], stop, stem, split)
+
+
+def load_ngrams(filename, stop, stem, split=False, orders=(2, 3)):
+    """
+    Load the n-gram store of the sub-reddits listed in data/filename.
+
+    The store is rebuilt from corpus.load_corpus when the data has changed
+    or it lacks one of the orders, with the orders it already had as well,
+    so asking for other orders in turn does not rebuild it every time.
+    """
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    signature = corpus.source_signature(names)
+    path = ngrams_path(filename, stop, stem, split)
+    cached = ()
+    try:
+        store = NgramStore.load(path)
+        if store.signature == signature:
+            if set(orders) <= set(store.orders):
+                return store
+            cached = store.orders
+    except (IOError, KeyError, ValueError):
+        pass
+
+    orders = tuple(sorted(set(orders) | set(cached)))
+    store = NgramStore.build(corpus.load_corpus(filename, stop, stem, split), orders)
+    store.save(path)
+    return store
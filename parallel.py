@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+""" Contains parallel versions of the analysis functions. """
+
+from __future__ import division
+from array import array
+import multiprocessing
+
+import nltk as nltk
+import numpy as np
+
+import scoring as scoring
+import unknownstats as unknownstats
+
+# Set in each worker by _init_worker
+_state = {}
+
+
+def _init_worker(state):
+    """Store the data shared by all tasks of a worker."""
+    _state.clear()
+    _state.update(state)
+
+
+def _unpack(tokens, offsets):
+    """Return the token and offset arrays of a packed submission."""
+    ids = array('I')
+    ids.fromstring(tokens)
+    bounds = array('I')
+    bounds.fromstring(offsets)
+    return ids, bounds
+
+
+def _sentiment_task(ids, bounds):
+    valence = _state['valence']
+    low, high = _state['neutral']
+    tokens = scoring.as_numpy(ids)
+    scores = scoring.segment_sum(valence[tokens], np.diff(scoring.as_numpy(bounds)))
+    keep = (scores < low) | (scores > high)
+    return float(scores[keep].sum()) / max(int(keep.sum()), 1)
+
+
+def _lexical_diversity_task(ids, bounds):
+    return len(set(ids)) / len(ids)
+
+
+def _bigram_task(ids, bounds):
+    words = _state['words']
+    finder = nltk.collocations.BigramCollocationFinder.from_words([words[i] for i in ids])
+    finder.apply_freq_filter(_state['freq'])
+    return finder.nbest(nltk.collocations.BigramAssocMeasures().raw_freq, _state['n'])
+
+
+def _trigram_task(ids, bounds):
+    words = _state['words']
+    finder = nltk.TrigramCollocationFinder.from_words([words[i] for i in ids])
+    finder.apply_freq_filter(_state['freq'])
+    finder.apply_ngram_filter(lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3))
+    return finder.nbest(nltk.TrigramAssocMeasures().raw_freq, _state['n'])
+
+
+def _unknownwords_task(ids, bounds):
+    words = _state['words']
+    valence = _state['valence']
+    known = _state['known']
+    unknown = {}
+    for c in xrange(len(bounds) - 1):
+        comment = ids[bounds[c]:bounds[c + 1]]
+        value = sum([valence[i] for i in comment])
+        average = value / len(comment) if comment else 0
+        for i in comment:
+            if not known[i]:
+                totals = unknown.get(i)
+                if totals is None:
+                    totals = unknown[i] = [0, 0, 0.0]
+                totals[0] += 1
+                totals[1] += value
+                totals[2] += average
+    return [(words[i], count, value, average) for i, (count, value, average) in unknown.items()]
+
+
+TASKS = {
+    'sentiment': _sentiment_task,
+    'lexical_diversity': _lexical_diversity_task,
+    'bigram': _bigram_task,
+    'trigram': _trigram_task,
+    'unknownwords': _unknownwords_task,
+}
+
+
+def _run_task(args):
+    task, tokens, offsets = args
+    return TASKS[task](*_unpack(tokens, offsets))
+
+
+def run(task, tokenized, state, workers=None, chunksize=16):
+    """
+    Parallel analysis.
+
+    Run a task on every submission of a tokenized corpus in a process pool.
+    Submissions are sent to the workers as packed token arrays,
+    the results are returned in the order of tokenized.items()
+
+    -> task: name of the task in TASKS
+    -> tokenized: corpus.TokenizedCorpus
+    -> state: dictionary shared by all tasks, available as _state in the workers
+    -> workers: number of processes, defaults to the number of CPUs, 1 runs in this process
+    -> chunksize: number of submissions sent to a worker at a time
+
+    <- (names, results_all, titles_all): Tuple of the names of the sub-reddits,
+    task results and titles of posts in each sub-reddit
+    """
+    names = []
+    titles_all = []
+    sizes = []
+    jobs = []
+    for name, data in tokenized.items():
+        names.append(name)
+        titles_all.append([sub.title for sub in data.values()])
+        sizes.append(len(data))
+        jobs += [(task, sub.tokens.tostring(), sub.offsets.tostring()) for sub in data.values()]
+
+    state = dict(state, words=tokenized.vocab.words)
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        _init_worker(state)
+        results = map(_run_task, jobs)
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (state,))
+        try:
+            results = pool.map(_run_task, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    results_all = []
+    start = 0
+    for size in sizes:
+        results_all.append(results[start:start + size])
+        start += size
+    return names, results_all, titles_all
+
+
+def _valences(tokenized, sentiment):
+    return scoring.SentimentEngine(sentiment).valences(tokenized.vocab)
+
+
+def _check(tokenized, settings):
+    if tokenized.settings[:len(settings)] != settings:
+        raise ValueError('corpus is tokenized with (stop, stem, split) = %s, expected %s'
+                         % (tokenized.settings, settings))
+
+
+def sentiment(tokenized, sentiment, workers=None, chunksize=16):
+    """
+    Sentiment analysis.
+
+    Parallel analyser.sentiment for a corpus.TokenizedCorpus with split=True
+    """
+    _check(tokenized, (False, False, True))
+    state = {'valence': _valences(tokenized, sentiment), 'neutral': (-2, 2)}
+    return run('sentiment', tokenized, state, workers, chunksize)
+
+
+def lexical_diversity(tokenized, workers=None, chunksize=16):
+    """
+    Lexical diversity.
+
+    Parallel analyser.lexical_diversity for a corpus.TokenizedCorpus with stop=True
+    """
+    _check(tokenized, (True, False, False))
+    return run('lexical_diversity', tokenized, {}, workers, chunksize)
+
+
+def collocations_bigram(tokenized, n=5, freq=4, workers=None, chunksize=16):
+    """
+    Topic mining.
+
+    Parallel analyser.collocations_bigram, returning the n best bigrams
+    seen at least freq times in each thread instead of printing them
+    """
+    return run('bigram', tokenized, {'n': n, 'freq': freq}, workers, chunksize)
+
+
+def collocations_trigram(tokenized, n=5, freq=4, workers=None, chunksize=16):
+    """
+    Topic mining.
+
+    Parallel analyser.collocations_trigram, returning the n best trigrams
+    seen at least freq times in each thread instead of printing them
+    """
+    return run('trigram', tokenized, {'n': n, 'freq': freq}, workers, chunksize)
+
+
+def get_unknownwords(tokenized, sentiment, workers=None, chunksize=16):
+    """
+    Extended sentiment analysis.
+
+    Parallel analyser.get_unknownwords for a corpus.TokenizedCorpus with stop=True
+
+    <- unknownstats.UnknownStats of the unknown words
+    """
+    _check(tokenized, (True,))
+    state = {'valence': _valences(tokenized, sentiment).tolist(),
+             'known': [word in sentiment for word in tokenized.vocab.words]}
+    names, results_all, _ = run('unknownwords', tokenized, state, workers, chunksize)
+
+    stats = unknownstats.UnknownStats()
+    for name, results in zip(names, results_all):
+        for unknown in results:
+            for word, count, value, average in unknown:
+                stats.add_totals(name, word, count, value, average)
+    return stats
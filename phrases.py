@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+""" Contains sentiment scoring with multi-word expressions and negation. """
+
+from __future__ import division
+from collections import deque
+
+import analyser as anl
+import corpus as corpus
+import instrument as instrument
+import lexicon as lexicon
+
+NEGATORS = frozenset(['not', 'no', 'never', 'nor', 'neither', 'without', 'cannot', 'nothing'])
+
+
+def is_negator(word):
+    """Return True for words that negate the words after them."""
+    return word in NEGATORS or word.endswith("n't")
+
+
+class PhraseMatcher(object):
+
+    """
+    Aho-Corasick automaton over the word IDs of a lexicon.
+
+    Finds, in one pass over a comment, the longest lexicon entry ending
+    at every word, for single words and multi-word entries alike.
+    """
+
+    def __init__(self, entries):
+        """
+        Build the automaton.
+
+        entries = dictionary from tuples of word IDs to valences
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        # (length, valence) of the longest entry that is a suffix of each state
+        self.out = [None]
+        for ids, value in entries.items():
+            state = 0
+            for token_id in ids:
+                if token_id not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(None)
+                    self.goto[state][token_id] = len(self.goto) - 1
+                state = self.goto[state][token_id]
+            self.out[state] = (len(ids), value)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token_id, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and token_id not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token_id, 0)
+                if self.out[child] is None:
+                    self.out[child] = self.out[self.fail[child]]
+                queue.append(child)
+
+    def matches(self, ids):
+        """
+        Yield (start, end, valence) of the longest entry ending at each word
+        of a list of word IDs, -1 for words that are not in the lexicon.
+        """
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        state = 0
+        for i, token_id in enumerate(ids):
+            while state and token_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token_id, 0)
+            match = out[state]
+            if match is not None:
+                yield i + 1 - match[0], i + 1, match[1]
+
+
+class PhraseScorer(object):
+
+    """
+    Sentiment analysis with multi-word expressions and negation.
+
+    Comments are scored by the lexicon entries they contain, the longest
+    entry winning where entries overlap, so 'does not work' is scored as
+    one entry instead of by its words. The valence of an entry starting
+    within window words after a negation like 'not' or "don't" is
+    multiplied by negation, unless the negation is part of an entry itself.
+    """
+
+    def __init__(self, sentiment, neutral=(-2, 2), window=3, negation=-1):
+        """
+        Create a new scorer.
+
+        sentiment = lexicon.Lexicon, or a dictionary of valences where
+        entries of several words are separated by spaces
+
+        neutral = (low, high) comment scores in this range are ignored
+
+        window = number of words after a negation that it applies to
+
+        negation = factor applied to negated valences
+        """
+        if not isinstance(sentiment, lexicon.Lexicon):
+            sentiment = lexicon.Lexicon.build(sentiment.items())
+        self.lexicon = sentiment
+        self.neutral = neutral
+        self.window = window
+        self.negation = negation
+        entries = dict(((sentiment.token_ids[word],), value) for word, value in sentiment.items())
+        entries.update(sentiment.phrases)
+        self.matcher = PhraseMatcher(entries)
+        self.negators = frozenset(i for i, word in enumerate(sentiment.tokens) if is_negator(word))
+        self.unknown_negator = len(sentiment.tokens)
+
+    def encode(self, words):
+        """Return the lexicon word IDs of a list of words, see comment_score."""
+        get = self.lexicon.token_ids.get
+        negator = self.unknown_negator
+        return [get(word, negator if is_negator(word) else -1) for word in words]
+
+    def comment_score(self, ids):
+        """
+        Return the score of a comment.
+
+        -> ids: lexicon word IDs of the comment, -1 for other words and
+        self.unknown_negator for negations that are not in the lexicon
+        """
+        goto = self.matcher.goto
+        fail = self.matcher.fail
+        out = self.matcher.out
+        negators = self.negators
+        unknown_negator = self.unknown_negator
+        chosen = []
+        negations = []
+        state = 0
+        for i, token_id in enumerate(ids):
+            if token_id < 0:
+                state = 0
+                continue
+            if token_id == unknown_negator or token_id in negators:
+                negations.append(i)
+            while state and token_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token_id, 0)
+            match = out[state]
+            if match is None:
+                continue
+            start = i + 1 - match[0]
+            # an entry replaces the earlier ones it contains, and is dropped
+            # if it only partly overlaps them
+            while chosen and chosen[-1][0] >= start:
+                chosen.pop()
+            if not chosen or chosen[-1][1] <= start:
+                chosen.append((start, i + 1, match[1]))
+
+        if not negations:
+            return sum([value for _, _, value in chosen])
+        score = 0
+        window = self.window
+        last_negation = None
+        n = 0
+        for start, end, value in chosen:
+            while n < len(negations) and negations[n] < start:
+                last_negation = negations[n]
+                n += 1
+            if last_negation is not None and start - last_negation <= window:
+                value *= self.negation
+            score += value
+            if end - start > 1:
+                # negations inside an entry belong to it
+                while n < len(negations) and negations[n] < end:
+                    n += 1
+        return score
+
+    def comments(self, subreddit):
+        """
+        Return a function giving the lexicon word IDs of each comment of a submission.
+
+        Submissions of a corpus.TokenizedCorpus are translated by token ID,
+        other submissions are tokenized without removing stopwords,
+        stemmed if the lexicon is.
+        """
+        words_of = anl.comment_words(subreddit, False, self.lexicon.stem)
+        if not isinstance(subreddit, corpus.TokenizedCorpus):
+            encode = self.encode
+            return lambda sub: (encode(words) for words in words_of(sub))
+
+        table = self.encode(subreddit.vocab.words)
+
+        def translated(sub):
+            for ids in sub.comment_ids():
+                yield [table[i] for i in ids]
+        return translated
+
+    def score(self, subreddit):
+        """
+        Sentiment analysis.
+
+        Calculate and return the average sentiment for each thread
+
+        -> subreddit: dictionary containing data from sub-reddits, or a
+        corpus.TokenizedCorpus with stop=False and stem as the lexicon
+
+        <- (names, scores_all, titles_all): as analyser.sentiment
+        """
+        low, high = self.neutral
+        ids_of = self.comments(subreddit)
+        names = []
+        scores_all = []
+        titles_all = []
+        for name, data in subreddit.items():
+            names.append(name)
+            scores_all.append([])
+            titles_all.append([])
+            for sub_id, sub in data.items():
+                with instrument.stage('score', name, sub_id):
+                    scores = [self.comment_score(ids) for ids in ids_of(sub)]
+                kept = [score for score in scores if not low <= score <= high]
+                scores_all[-1].append(sum(kept) / (len(kept) or 1))
+                titles_all[-1].append(sub.title)
+        return names, scores_all, titles_all
+
+
+def sentiment(subreddit, sentiment, window=3):
+    """
+    Sentiment analysis.
+
+    analyser.sentiment with multi-word lexicon entries and negation, see PhraseScorer
+    """
+    return PhraseScorer(sentiment, window=window).score(subreddit)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+""" Contains the command line runner of the analyses, with cached stages. """
+
+from __future__ import division
+import argparse
+import cPickle as pickle
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+import analyser as anl
+import cloudfarm as cloudfarm
+import corpus as corpus
+import lexicon as lexicon
+import results as results
+import scraper as scraper
+import stream as stream
+import visualizer as visualizer
+
+# Bumped when the results of the stages change
+VERSION = 1
+
+PARAMS = {'filename': 'sub-reddits.txt',
+          'lexicon': 'afinn',
+          'stop': True,
+          'stem': False,
+          'n': 3,
+          'freq': 4,
+          'top': 5,
+          'min_count': 100,
+          'min_value': 5,
+          'cloud_words': 10,
+          'plots': 'plots/',
+          'clouds': 'plots/clouds/',
+          'results': 'data/results.npz'}
+
+
+class Node(object):
+
+    """A stage of the pipeline."""
+
+    def __init__(self, name, func, deps=(), params=(), cached=True, files=False, signature=None):
+        """
+        Create a new stage.
+
+        name = name of the stage
+
+        func = function of the parameters and the results of deps
+
+        deps = names of the stages whose results func takes
+
+        params = names of the parameters in PARAMS that func uses
+
+        cached = Boolean to determine if the result is saved
+
+        files = Boolean telling that the result is a list of paths of files,
+        which are made again if one of them is missing
+
+        signature = function of the parameters returning what identifies the
+        input of a stage reading files, it is made again when this changes
+        """
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.params = params
+        self.cached = cached
+        self.files = files
+        self.signature = signature
+
+
+def data_signature(params):
+    """Signature of the sub-reddit pickles, see corpus.source_signature."""
+    with open('data/' + params['filename'], 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    return corpus.source_signature(names)
+
+
+def lexicon_signature(params):
+    """Signature of the source file of the lexicon."""
+    stat = os.stat(lexicon.LEXICONS[params['lexicon']][0])
+    return stat.st_mtime, stat.st_size
+
+
+def collocations(store, n, top, freq):
+    """
+    Topic mining.
+
+    Return [(name, [(title, n-grams)])] with the top most frequent n-grams
+    seen at least freq times in each thread, as analyser.collocations_bigram prints
+    """
+    return [(name, [(title, store.top(n, top, name, sub_id, freq=freq))
+                    for sub_id, title in store.threads_of(name)])
+            for name in store.names()]
+
+
+def ngrams(store, n, freq):
+    """
+    Topic mining.
+
+    Return [(name, [(title, n-grams)])] with the n-grams seen at least freq times
+    in each thread, as analyser.collocations_ngram prints
+    """
+    return [(name, [(title, [ngram for ngram, _ in store.frequent(n, freq, name, sub_id)])
+                    for sub_id, title in store.threads_of(name)])
+            for name in store.names()]
+
+
+def render(params, sent, lexical, freqs, words):
+    """Write the plots of visualizer.report in this process and return their paths."""
+    plots = visualizer.report_plots(sent, lexical, freqs, joined_results(sent, lexical, words))
+    return visualizer.render_plots(plots, params['plots'], workers=1)
+
+
+def clouds(params, index, unknown):
+    """Write the word clouds of analyser.unknowncoll in this process and return their paths."""
+    jobs = cloudfarm.cloud_jobs(index, unknown, params['cloud_words'])
+    cloudfarm.render_all(jobs, params['clouds'], workers=1, verbose=False)
+    return [cloudfarm.image_path(params['clouds'], job[0]) for job in jobs]
+
+
+def joined_results(sent, lexical, words):
+    """Return a results.ResultTable of the sentiment and lexical diversity scores, joined by submission."""
+    table = results.ResultTable.from_analysis(sent, results.submission_ids(words, sent[0]), 'sentiment')
+    return table.add(lexical, results.submission_ids(words, lexical[0]), 'lexical_diversity')
+
+
+def result_table(params, sent, lexical, words):
+    """Write the sentiment and lexical diversity scores to a results.ResultTable file and return its path."""
+    joined_results(sent, lexical, words).save(params['results'])
+    return [params['results']]
+
+
+NODES = [Node('data', lambda p: scraper.load_data(p['filename']), params=('filename',),
+              cached=False, signature=data_signature),
+         Node('lexicon', lambda p: scraper.load_sent(False, p['lexicon']), params=('lexicon',),
+              cached=False, signature=lexicon_signature),
+         Node('stemmed_lexicon', lambda p: scraper.load_sent(p['stem'], p['lexicon']),
+              params=('lexicon', 'stem'), cached=False, signature=lexicon_signature),
+         Node('words', lambda p, data: corpus.TokenizedCorpus.build(data, True, False), ('data',)),
+         Node('stemmed_words', lambda p, data: corpus.TokenizedCorpus.build(data, True, p['stem']),
+              ('data',), ('stem',)),
+         Node('split_words', lambda p, data: corpus.TokenizedCorpus.build(data, False, False, True),
+              ('data',)),
+         Node('colloc_words', lambda p, data: corpus.TokenizedCorpus.build(data, p['stop'], p['stem']),
+              ('data',), ('stop', 'stem')),
+         Node('sentiment', lambda p, words, sent: anl.sentiment(words, sent),
+              ('split_words', 'lexicon')),
+         Node('lexical', lambda p, words: anl.lexical_diversity(words), ('words',)),
+         Node('freqs', lambda p, words: anl.most_frequent_words(words), ('words',)),
+         Node('ngram_store', lambda p, words: anl.ngram_store(words, p['stop'], p['stem']),
+              ('colloc_words',), ('stop', 'stem')),
+         Node('bigrams', lambda p, store: collocations(store, 2, p['top'], p['freq']),
+              ('ngram_store',), ('top', 'freq')),
+         Node('trigrams', lambda p, store: collocations(store, 3, p['top'], p['freq']),
+              ('ngram_store',), ('top', 'freq')),
+         Node('split_store', lambda p, words: anl.ngram_store(words, False, False, True, (p['n'],)),
+              ('split_words',), ('n',)),
+         Node('ngrams', lambda p, store: ngrams(store, p['n'], p['freq']),
+              ('split_store',), ('n', 'freq')),
+         Node('unknown_stats', lambda p, words, sent: anl.unknown_stats(words, p['stem'], sent, False),
+              ('stemmed_words', 'stemmed_lexicon'), ('stem',)),
+         Node('unknown', lambda p, stats: stats.frequent(p['min_count'], p['min_value']),
+              ('unknown_stats',), ('min_count', 'min_value')),
+         Node('bigram_index', lambda p, words: stream.bigram_index(words, True, p['stem']),
+              ('stemmed_words',), ('stem',)),
+         Node('results', result_table, ('sentiment', 'lexical', 'words'), ('results',), files=True),
+         Node('plots', render, ('sentiment', 'lexical', 'freqs', 'words'), ('plots',), files=True),
+         Node('clouds', clouds, ('bigram_index', 'unknown'), ('clouds', 'cloud_words'), files=True)]
+
+
+class Pipeline(object):
+
+    """
+    Runs stages of NODES, only those whose inputs or parameters changed.
+
+    The result of a stage is saved in the cache directory under a key hashed
+    from its parameters, the keys of the stages it depends on and the signature
+    of the files it reads, so changing a parameter makes only the stages
+    depending on it run again. Results of earlier parameters are kept, changing
+    a parameter back reuses them.
+    """
+
+    def __init__(self, params=None, cache='data/pipeline/', nodes=NODES):
+        """
+        Create a new runner.
+
+        params = dictionary of parameters overriding PARAMS
+
+        cache = directory holding the results of the stages
+
+        nodes = the stages
+        """
+        self.params = dict(PARAMS)
+        self.params.update(params or {})
+        self.cache = cache
+        self.nodes = dict((node.name, node) for node in nodes)
+        self.order = [node.name for node in nodes]
+        self.keys = {}
+        self.values = {}
+
+    def key(self, name):
+        """Return the key of the result of a stage."""
+        if name not in self.keys:
+            node = self.nodes[name]
+            parts = (VERSION, name, [(param, self.params[param]) for param in node.params],
+                     [self.key(dep) for dep in node.deps],
+                     node.signature(self.params) if node.signature else None)
+            self.keys[name] = hashlib.md5(repr(parts)).hexdigest()
+        return self.keys[name]
+
+    def path(self, name):
+        """Return the path of the saved result of a stage."""
+        return os.path.join(self.cache, '%s-%s.p' % (name, self.key(name)))
+
+    def fresh(self, name):
+        """Return True if the result of a stage is saved and up to date."""
+        node = self.nodes[name]
+        if not node.cached or not os.path.exists(self.path(name)):
+            return False
+        if node.files:
+            return all(os.path.exists(path) for path in self.value(name))
+        return True
+
+    def plan(self, targets):
+        """
+        Return the stages to run for targets in the order of NODES.
+
+        Stages that are not cached are not listed, they are run
+        in each process that needs their result.
+        """
+        needed = set()
+
+        def visit(name):
+            if name in needed:
+                return
+            node = self.nodes[name]
+            if node.cached and self.fresh(name):
+                return
+            needed.add(name)
+            for dep in node.deps:
+                visit(dep)
+        for target in targets:
+            visit(target)
+        return [name for name in self.order if name in needed and self.nodes[name].cached]
+
+    def value(self, name):
+        """Return the result of a stage, loading it or running an uncached stage."""
+        if name not in self.values:
+            node = self.nodes[name]
+            if node.cached:
+                with open(self.path(name), 'rb') as saved:
+                    self.values[name] = pickle.load(saved)
+            else:
+                self.values[name] = self.compute(name)
+        return self.values[name]
+
+    def compute(self, name):
+        """Run a stage on the results of the stages it depends on."""
+        node = self.nodes[name]
+        return node.func(self.params, *[self.value(dep) for dep in node.deps])
+
+    def execute(self, name):
+        """Run a stage and save its result, return the seconds it took."""
+        start = time.time()
+        value = self.compute(name)
+        path = self.path(name)
+        with open(path + '.tmp', 'wb') as out:
+            pickle.dump(value, out, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+        self.values[name] = value
+        return time.time() - start
+
+    def run(self, targets=None, workers=1, verbose=True):
+        """
+        Bring the results of targets up to date.
+
+        Stages whose dependencies are done run concurrently in a process pool.
+
+        -> targets: names of stages, every stage if None
+        -> workers: number of processes, the number of CPUs if None, 1 runs in this process
+        -> verbose: print the stages as they finish
+
+        <- dictionary from the stages which were run to the seconds they took
+        """
+        targets = targets or self.order
+        todo = self.plan(targets)
+        # created here, workers checking and creating them at once could fail
+        directories = [self.cache]
+        for param in ('plots', 'clouds'):
+            if any(param in self.nodes[name].params for name in todo):
+                directories.append(self.params[param])
+        for directory in directories:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        if verbose:
+            for name in targets:
+                if name not in todo and self.nodes[name].cached:
+                    print '%-16s cached' % name
+        if workers == 1:
+            times = {}
+            for name in todo:
+                times[name] = self.execute(name)
+                if verbose:
+                    print '%-16s %8.2f s' % (name, times[name])
+            return times
+
+        times = {}
+        running = {}
+        pool = multiprocessing.Pool(workers)
+        try:
+            while todo or running:
+                for name in list(todo):
+                    if not any(dep in todo or dep in running for dep in self.deps(name)):
+                        todo.remove(name)
+                        running[name] = pool.apply_async(_execute_task,
+                                                         ((self.params, self.cache, name),))
+                finished = [name for name, result in running.items() if result.ready()]
+                if not finished:
+                    time.sleep(0.01)
+                for name in finished:
+                    times[name] = running.pop(name).get()
+                    if verbose:
+                        print '%-16s %8.2f s' % (name, times[name])
+        finally:
+            pool.close()
+            pool.join()
+        return times
+
+    def deps(self, name):
+        """Return the cached stages a stage depends on, through uncached stages too."""
+        found = set()
+        for dep in self.nodes[name].deps:
+            if self.nodes[dep].cached:
+                found.add(dep)
+            else:
+                found |= self.deps(dep)
+        return found
+
+
+def _execute_task(args):
+    params, cache, name = args
+    return Pipeline(params, cache).execute(name)
+
+
+def main(args=None):
+    """
+    Command line.
+
+    python pipeline.py [stage ...] [--stem] [--n 3] [--workers 4] ...
+
+    Runs the given stages, every stage if none are given, and those they depend on.
+    """
+    parser = argparse.ArgumentParser(description='Run the analyses, reusing cached results.')
+    parser.add_argument('stages', nargs='*', help='stages to run: ' + ', '.join(node.name for node in NODES))
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes, the number of CPUs by default, 1 runs in this process')
+    parser.add_argument('--cache', default='data/pipeline/', help='directory of the cached results')
+    parser.add_argument('--list', action='store_true', help='list the stages to run and exit')
+    for param, default in sorted(PARAMS.items()):
+        flag = '--' + param.replace('_', '-')
+        if isinstance(default, bool):
+            parser.add_argument(flag, dest=param, action='store_true', default=default)
+            parser.add_argument('--no-' + param.replace('_', '-'), dest=param, action='store_false')
+        else:
+            parser.add_argument(flag, dest=param, type=type(default), default=default)
+    options = parser.parse_args(args)
+
+    unknown = [name for name in options.stages if name not in [node.name for node in NODES]]
+    if unknown:
+        parser.error('unknown stages: ' + ', '.join(unknown))
+    pipeline = Pipeline(dict((param, getattr(options, param)) for param in PARAMS), options.cache)
+    try:
+        if options.list:
+            for name in pipeline.plan(options.stages or pipeline.order):
+                print name
+            return 0
+        pipeline.run(options.stages or None, options.workers)
+    except IOError as e:
+        print e
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+""" Contains the columnar table of analysis results per submission. """
+
+from __future__ import division
+
+import lazy as lazy
+
+np = lazy.LazyModule('numpy')
+
+REDUCTIONS = ('mean', 'sum', 'count', 'min', 'max', 'std')
+
+
+def submission_ids(subreddit, names):
+    """Return the submission IDs of each sub-reddit in names, in the order the analyses score them."""
+    return [list(subreddit[name].keys()) for name in names]
+
+
+class ResultTable(object):
+
+    """
+    Analysis results, one row per submission.
+
+    Columns are NumPy arrays, the sub-reddit of each row is stored as
+    an index into names. Rows of a sub-reddit need not be adjacent, and
+    sub-reddits may have any number of rows.
+    """
+
+    def __init__(self, names, codes, submissions, titles, metrics=None):
+        """
+        Create a new table.
+
+        names = list of the sub-reddit names
+
+        codes = array of the index in names of the sub-reddit of each row
+
+        submissions = array of the submission ID of each row
+
+        titles = array of the title of each row
+
+        metrics = dictionary from metric names to float arrays, one value per row
+        """
+        self.names = list(names)
+        self.codes = np.asarray(codes, np.int32)
+        self.submissions = np.asarray(submissions)
+        self.titles = np.asarray(titles)
+        self.metrics = dict((metric, np.asarray(values, np.float64))
+                            for metric, values in (metrics or {}).items())
+
+    @classmethod
+    def from_analysis(cls, result, ids, metric):
+        """
+        Create a table from the result of an analysis.
+
+        -> result: (names, scores_all, titles_all) as returned by analyser.sentiment,
+        analyser.lexical_diversity and the like
+        -> ids: submission IDs of each sub-reddit in the same order, see submission_ids
+        -> metric: name of the column of the scores
+        """
+        names, scores_all, titles_all = result
+        codes = np.repeat(np.arange(len(names), dtype=np.int32), [len(scores) for scores in scores_all])
+        submissions = [sub_id for sub_ids in ids for sub_id in sub_ids]
+        if len(submissions) != len(codes):
+            raise ValueError('%d submission IDs for %d scores' % (len(submissions), len(codes)))
+        titles = [title for titles in titles_all for title in titles]
+        scores = [score for scores in scores_all for score in scores]
+        return cls(names, codes, submissions, titles, {metric: scores})
+
+    def __len__(self):
+        return len(self.codes)
+
+    def keys(self):
+        """Return a dictionary from (sub-reddit, submission ID) to row."""
+        return dict(((self.names[code], sub_id), row)
+                    for row, (code, sub_id) in enumerate(zip(self.codes, self.submissions.tolist())))
+
+    def add(self, result, ids, metric):
+        """
+        Add the scores of another analysis as a column.
+
+        Scores are matched to rows by sub-reddit and submission ID,
+        rows without a score get NaN and scores without a row are dropped.
+        """
+        rows = self.keys()
+        column = np.full(len(self), np.nan)
+        names, scores_all, _ = result
+        for name, sub_ids, scores in zip(names, ids, scores_all):
+            for sub_id, score in zip(sub_ids, scores):
+                row = rows.get((name, sub_id))
+                if row is not None:
+                    column[row] = score
+        self.metrics[metric] = column
+        return self
+
+    def reduce(self, metric, how='mean'):
+        """
+        Grouped reduction.
+
+        Return an array of the reduced values of a metric for each
+        sub-reddit of names, NaN values are skipped.
+
+        -> how: one of REDUCTIONS, sub-reddits without values give 0 for
+        count and sum and NaN for the others
+        """
+        values = self.metrics[metric]
+        keep = ~np.isnan(values)
+        codes, values = self.codes[keep], values[keep]
+        groups = len(self.names)
+        count = np.bincount(codes, minlength=groups).astype(np.float64)
+        if how == 'count':
+            return count
+        total = np.bincount(codes, values, minlength=groups)
+        if how == 'sum':
+            return total
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            if how == 'mean':
+                return mean
+            if how == 'std':
+                squares = np.bincount(codes, values * values, minlength=groups)
+                return np.sqrt(np.maximum(squares / count - mean * mean, 0))
+        if how in ('min', 'max'):
+            result = np.full(groups, np.nan)
+            if len(values):
+                order = np.lexsort((values, codes))
+                codes, values = codes[order], values[order]
+                starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+                ends = np.r_[starts[1:], len(codes)] - 1
+                result[codes[starts]] = values[starts] if how == 'min' else values[ends]
+            return result
+        raise ValueError('unknown reduction %r, expected one of %s' % (how, ', '.join(REDUCTIONS)))
+
+    def nested(self, metric):
+        """
+        Return (names, scores_all, titles_all) of a metric, as the analysis returned it,
+        for the plot functions of visualizer.
+        """
+        order = np.argsort(self.codes, kind='mergesort')
+        bounds = np.searchsorted(self.codes[order], np.arange(len(self.names) + 1))
+        values = self.metrics[metric][order]
+        titles = self.titles[order]
+        return (list(self.names),
+                [values[start:end].tolist() for start, end in zip(bounds[:-1], bounds[1:])],
+                [titles[start:end].tolist() for start, end in zip(bounds[:-1], bounds[1:])])
+
+    def save(self, path):
+        """Write the table to a .npz file, readable without this module."""
+        columns = dict(('metric_' + metric, values) for metric, values in self.metrics.items())
+        submissions = self.submissions
+        if submissions.dtype == object:
+            submissions = np.array([unicode(sub_id) for sub_id in submissions], dtype=unicode)
+        np.savez(path, names=np.array(self.names, dtype=unicode), codes=self.codes,
+                 submissions=submissions, titles=np.array(self.titles.tolist(), dtype=unicode),
+                 **columns)
+
+    @classmethod
+    def load(cls, path):
+        """Read a table written by save."""
+        with np.load(path) as saved:
+            metrics = dict((key[len('metric_'):], saved[key]) for key in saved.files
+                           if key.startswith('metric_'))
+            return cls(saved['names'].tolist(), saved['codes'], saved['submissions'],
+                       saved['titles'], metrics)
+
+    def to_arrow(self):
+        """Return the table as a pyarrow.Table, requires pyarrow."""
+        import pyarrow as pa
+        columns = [pa.array([self.names[code] for code in self.codes]).dictionary_encode(),
+                   pa.array(self.submissions.tolist()),
+                   pa.array(self.titles.tolist())]
+        metrics = sorted(self.metrics)
+        columns += [pa.array(self.metrics[metric]) for metric in metrics]
+        return pa.Table.from_arrays(columns, ['subreddit', 'submission', 'title'] + metrics)
+
+    def save_parquet(self, path):
+        """Write the table to a Parquet file, requires pyarrow."""
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), path)
+
+
+def load_results(path):
+    """Read a ResultTable from a .npz file, or a Parquet file if pyarrow is installed."""
+    if not path.endswith('.parquet'):
+        return ResultTable.load(path)
+    import pyarrow.parquet as pq
+    columns = pq.read_table(path).to_pydict()
+    subreddits = columns.pop('subreddit')
+    index = {}
+    codes = [index.setdefault(name, len(index)) for name in subreddits]
+    names = sorted(index, key=index.get)
+    return ResultTable(names, codes, columns.pop('submission'), columns.pop('title'), columns)
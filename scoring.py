@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+""" Contains vectorized scoring of tokenized corpora. """
+
+from __future__ import division
+from array import array
+
+import corpus as corpus
+import lazy as lazy
+
+np = lazy.LazyModule('numpy')
+
+assert array('I').itemsize == 4, 'token arrays must hold 32 bit IDs'
+
+
+def as_numpy(ids):
+    """Return a view of an array('I') of token IDs as a NumPy array."""
+    if not len(ids):
+        return np.zeros(0, np.uint32)
+    return np.frombuffer(ids, dtype=np.uint32)
+
+
+def segment_sum(values, lengths):
+    """
+    Sum consecutive segments of values.
+
+    -> values: 1-d NumPy array
+    -> lengths: length of each segment, they must add up to len(values)
+
+    <- array with the sum of each segment, empty segments sum to 0
+    """
+    sums = np.zeros(len(lengths), values.dtype)
+    if not len(values) or not len(lengths):
+        return sums
+    starts = np.zeros(len(lengths), np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    # reduceat needs valid indices and returns values[start] for empty segments
+    nonempty = lengths > 0
+    sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+    return sums
+
+
+class SentimentEngine(object):
+
+    """
+    Vectorized sentiment analysis.
+
+    Gives the same results as analyser.sentiment for a corpus.TokenizedCorpus
+    tokenized with split=True, by looking up the valence of every token
+    in a dense array indexed by token ID.
+    """
+
+    def __init__(self, sentiment, neutral=(-2, 2)):
+        """
+        Create a new engine.
+
+        sentiment = dictionary of word valences, see scraper.load_sent
+
+        neutral = (low, high) comment scores in this range are ignored
+        """
+        self.sentiment = sentiment
+        self.neutral = neutral
+        self.valence = np.zeros(0, np.int64)
+        self.vocab = None
+
+    def valences(self, vocab):
+        """Return the valence of every word in vocab, indexed by token ID."""
+        if vocab is not self.vocab:
+            self.vocab = vocab
+            self.valence = np.zeros(0, np.int64)
+        if len(self.valence) < len(vocab):
+            get = self.sentiment.get
+            new = [get(word, 0) for word in vocab.words[len(self.valence):]]
+            self.valence = np.concatenate([self.valence, np.array(new, np.int64)])
+        return self.valence
+
+    def comment_scores(self, tokens, comment_lengths, vocab):
+        """Return the summed valence of each comment."""
+        return segment_sum(self.valences(vocab)[tokens], comment_lengths)
+
+    def thread_scores(self, scores, thread_lengths):
+        """Return the average non-neutral comment score of each thread."""
+        low, high = self.neutral
+        keep = (scores < low) | (scores > high)
+        totals = segment_sum(np.where(keep, scores, 0), thread_lengths)
+        counts = segment_sum(keep.astype(np.int64), thread_lengths)
+        return totals / np.maximum(counts, 1)
+
+    def score(self, tokenized):
+        """
+        Sentiment analysis.
+
+        Calculate and return the average sentiment for each thread
+
+        -> tokenized: corpus.TokenizedCorpus with split=True
+
+        <- (names, scores_all, titles_all): as analyser.sentiment
+        """
+        if tokenized.settings != (False, False, True):
+            raise ValueError('corpus is tokenized with (stop, stem, split) = %s, expected %s'
+                             % (tokenized.settings, (False, False, True)))
+        names = []
+        titles_all = []
+        tokens = []
+        comment_lengths = []
+        thread_lengths = []
+        sub_lengths = []
+        for name, data in tokenized.items():
+            names.append(name)
+            titles_all.append([])
+            sub_lengths.append(len(data))
+            for sub_id, sub in data.items():
+                titles_all[-1].append(sub.title)
+                tokens.append(as_numpy(sub.tokens))
+                comment_lengths.append(np.diff(as_numpy(sub.offsets)))
+                thread_lengths.append(len(sub))
+
+        tokens = np.concatenate(tokens) if tokens else np.zeros(0, np.uint32)
+        comment_lengths = (np.concatenate(comment_lengths) if comment_lengths
+                           else np.zeros(0, np.uint32))
+        scores = self.comment_scores(tokens, comment_lengths, tokenized.vocab)
+        averages = self.thread_scores(scores, np.array(thread_lengths, np.int64)).tolist()
+
+        scores_all = []
+        start = 0
+        for length in sub_lengths:
+            scores_all.append(averages[start:start + length])
+            start += length
+        return names, scores_all, titles_all
+
+
+def sentiment(subreddit, sentiment):
+    """
+    Sentiment analysis.
+
+    Vectorized analyser.sentiment, raw data is tokenized first
+
+    -> subreddit: dictionary containing data from sub-reddits or a corpus.TokenizedCorpus
+    -> sentiment: dictionary of word valences
+    """
+    if not isinstance(subreddit, corpus.TokenizedCorpus):
+        subreddit = corpus.TokenizedCorpus.build(subreddit, False, False, split=True)
+    return SentimentEngine(sentiment).score(subreddit)
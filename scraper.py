@@ -1,67 +1,88 @@
 # -*- coding: utf-8 -*-
 """ Responsible for downloading, saving and loading data. """
 
-import praw
 import cPickle as pickle
 from submission import Submission
+import harvester as harvester
+import instrument as instrument
+import lexicon as lexicon
+import sqlstore as sqlstore
 
 def load_data(filename):
     """
     Load reddit data from a filename.
     
     Returns a dictionary of dictionaries, with keys being the name of the respective sub-reddits.
+    Comments appended by incremental scraping are included.
     """
     with open('data/' + filename, 'rb') as subreddits:
-        return dict((sub.strip(), pickle.load(
-                open('data/' + sub.strip() + '.p', 'rb'))) for sub in subreddits)
+        names = [sub.strip() for sub in subreddits]
+    
+    return dict((name, load_data_sub(name)) for name in names)
+
 
+def load_data_sub(name):
+    """Load the data of a single sub-reddit, including its delta log."""
+    with instrument.stage('load', name) as current:
+        with open('data/' + name + '.p', 'rb') as sub:
+            data = harvester.merge_deltas('data/', name, pickle.load(sub))
+        current.add(sum(len(sub.comments) for sub in data.values()))
+    return data
 
-def load_sent():
-    """Load sentiment data."""
-    return dict(map(lambda (k, v): (k, int(v)),
-                    [line.split('\t') for line in open("AFINN/AFINN-111.txt", 'rb')]))
+
+def load_sent(stem=False, name='afinn'):
+    """
+    Load sentiment data.
+    
+    Returns a lexicon.Lexicon, a dictionary of word valences, compiled once 
+    from the AFINN word list or another lexicon registered by name.
+    
+    -> stem: stem the words, for comments normalized with stem=True
+    """
+    return lexicon.load_lexicon(name, stem)
 
 
-def scrape(username, password):
+def scrape(username, password, workers=4, rate=0.5, incremental=True, database=False):
     """
     Mine data from reddit.
     
     -> username: Login to reddit with this username
     -> password: Password matching the given username
+    -> workers: number of concurrent requests
+    -> rate: maximum number of requests per second
+    -> incremental: only fetch new comments and resume an interrupted run, 
+    see harvester.Checkpoint
+    -> database: also store each sub-reddit in the SQLite database 
+    of the sub-reddit list once it is harvested, see sqlstore
     """
-    latest = ''
-    try:
-        reddit = praw.Reddit('Scraper bot for sentiment analysis v 1.0'
-                    'Url: https://github.com/SwestJ/SAofReddit')
-        
-        reddit.login(username, password)
-        
-        subreddits = open('data/sub-reddits2.txt', 'rb')
-        for sub in subreddits:
-            data = dict()
-            sub = sub.strip()
-            subreddit = reddit.get_subreddit(sub)
-            latest = sub
-            for submission in subreddit.get_top_from_month(limit=10):
-                print submission.title
-                submission.replace_more_comments(limit=None, threshold=0)
-                comments = [c.body for c in praw.helpers.flatten_tree(submission.comments)]
-                sub_data = Submission(submission.url, 
-                                      submission.title,
-                                      submission.selftext,
-                                      comments)
-                data[submission.id] = sub_data
-            
-            pickle.dump(data, open(sub + '.p', 'wb'))
-    except Exception as e:
-        print e
-        print latest
+    client = harvester.PrawClient(username, password)
+    with open('data/sub-reddits2.txt', 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    
+    checkpoint = harvester.Checkpoint('data/') if incremental else None
+    crawler = harvester.Harvester(client, harvester.TokenBucket(rate), workers,
+                                  checkpoint=checkpoint)
+    store = sqlstore.SqlStore(sqlstore.database_path('sub-reddits2.txt')) if database else None
+    for name in crawler.harvest(names):
+        print name
+        if store is not None:
+            store.insert(name, load_data_sub(name), names.index(name))
+    for name, sub_id, e in crawler.failures:
+        print name, sub_id, e
 
         
-def resave_data():
-    """Fix classname error."""
-    subreddit = load_data()
-    for name, posts in subreddit.items():
+def resave_data(filename, directory='data_new/'):
+    """
+    Fix classname error and migrate to the compact Submission.
+    
+    Loads the sub-reddits listed in data/filename, which may have been saved 
+    with an older Submission class, and saves them again in directory.
+    """
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    
+    for name in names:
+        posts = load_data_sub(name)
         data = dict()
         for sub_id, sub in posts.items():
             sub_data = Submission(sub.url,
@@ -69,8 +90,9 @@ def resave_data():
                                   sub.text,
                                   sub.comments)
             data[sub_id] = sub_data
-            
-        pickle.dump(data, open('data_new/' + name + '.p', 'wb'))
+        
+        with open(directory + name + '.p', 'wb') as out:
+            pickle.dump(data, out, pickle.HIGHEST_PROTOCOL)
 
 
 class UnknownWord:
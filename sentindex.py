@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+""" Contains the persistent index of sentiment scores per thread. """
+
+from __future__ import division
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import os
+
+import analyser as anl
+import corpus as corpus
+import instrument as instrument
+import scraper as scraper
+
+
+def lexicon_key(sentiment, neutral):
+    """Return a fingerprint of a sentiment dictionary and neutral band."""
+    md5 = hashlib.md5(repr(neutral))
+    for word, value in sorted(sentiment.items()):
+        md5.update('%s\t%s\n' % (word.encode('utf-8') if isinstance(word, unicode) else word,
+                                 value))
+    return md5.hexdigest()
+
+
+def comments_digest(comments):
+    """Return the md5 hash of a list of comments."""
+    md5 = hashlib.md5()
+    for comment in comments:
+        data = comment.encode('utf-8') if isinstance(comment, unicode) else comment
+        md5.update('%d:%s' % (len(data), data))
+    return md5
+
+
+class SentimentIndex(object):
+
+    """
+    Incremental sentiment analysis.
+
+    Keeps, for every thread, the number of comments scored, the sum of
+    their scores, the sum and number of scores outside the neutral band
+    and a digest of the first and last scored comments, so new comments
+    can be added without scoring or hashing the old ones again.
+    """
+
+    COUNT, TOTAL, KEPT_TOTAL, KEPT_COUNT, DIGEST = range(1, 6)
+
+    def __init__(self, sentiment, neutral=(-2, 2)):
+        """
+        Create a new empty index.
+
+        sentiment = dictionary of word valences, see scraper.load_sent
+
+        neutral = (low, high) comment scores in this range are ignored
+        """
+        self.lexicon = sentiment
+        self.neutral = neutral
+        self.key = lexicon_key(sentiment, neutral)
+        self.signature = None
+        # name -> sub_id -> [title, count, total, kept_total, kept_count, digest]
+        self.threads = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lexicon']
+        return state
+
+    def score(self, comment):
+        """Return the sentiment score of a comment, as in analyser.sentiment."""
+        sentiment = self.lexicon
+        words = anl.get_normalizer(False, False, True).tokens(comment)
+        return sum([sentiment[word] for word in words if word in sentiment])
+
+    def ends_digest(self, comments, scored):
+        """Return the digest of the first and last of the scored comments."""
+        return comments_digest([comments[0], comments[scored - 1]]).hexdigest()
+
+    def add(self, name, sub_id, title, comments):
+        """Score new comments of a thread and add them to its totals."""
+        low, high = self.neutral
+        entry = self.threads.setdefault(name, OrderedDict()).setdefault(sub_id, [title, 0, 0, 0, 0, None])
+        entry[0] = title
+        with instrument.stage('score', name, sub_id) as current:
+            for comment in comments:
+                score = self.score(comment)
+                entry[self.COUNT] += 1
+                entry[self.TOTAL] += score
+                if not low <= score <= high:
+                    entry[self.KEPT_TOTAL] += score
+                    entry[self.KEPT_COUNT] += 1
+            current.add(len(comments))
+
+    def update(self, subreddit):
+        """
+        Bring the index up to date with sub-reddit data.
+
+        Only comments after the ones already scored are scored. Threads
+        whose first or last scored comment changed, e.g. by a scrape that
+        was not incremental, are scored again in place, and threads that are
+        no longer in the data are removed. Checking the two ends keeps the
+        cost of an update proportional to the new comments.
+        """
+        for name in self.threads.keys():
+            if name not in subreddit:
+                del self.threads[name]
+        for name, data in subreddit.items():
+            threads = self.threads.setdefault(name, OrderedDict())
+            for sub_id in threads.keys():
+                if sub_id not in data:
+                    del threads[sub_id]
+            for sub_id, sub in data.items():
+                entry = threads.get(sub_id)
+                scored = entry[self.COUNT] if entry else 0
+                if scored and (len(sub.comments) < scored or len(entry) <= self.DIGEST
+                               or self.ends_digest(sub.comments, scored) != entry[self.DIGEST]):
+                    # reset in place, so the thread keeps its position
+                    entry[:] = [sub.title, 0, 0, 0, 0, None]
+                    scored = 0
+                comments = sub.comments[scored:]
+                self.add(name, sub_id, sub.title, comments)
+                scored += len(comments)
+                threads[sub_id][self.DIGEST] = self.ends_digest(sub.comments, scored) if scored else None
+
+    def sentiment(self):
+        """
+        Sentiment analysis.
+
+        <- (names, scores_all, titles_all): as analyser.sentiment
+        """
+        names = []
+        scores_all = []
+        titles_all = []
+        for name, threads in self.threads.items():
+            names.append(name)
+            scores_all.append([entry[self.KEPT_TOTAL] / (entry[self.KEPT_COUNT] or 1)
+                               for entry in threads.values()])
+            titles_all.append([entry[0] for entry in threads.values()])
+        return names, scores_all, titles_all
+
+    def check(self, subreddit):
+        """
+        Consistency check.
+
+        Return (name, sub_id, indexed, recomputed) for the threads where
+        the index differs from a full recompute with analyser.sentiment
+        """
+        names, scores_all, _ = anl.sentiment(subreddit, self.lexicon)
+        mismatches = []
+        for (name, data), scores in zip(subreddit.items(), scores_all):
+            threads = self.threads.get(name, {})
+            for sub_id, score in zip(data.keys(), scores):
+                entry = threads.get(sub_id)
+                indexed = entry and entry[self.KEPT_TOTAL] / (entry[self.KEPT_COUNT] or 1)
+                if indexed != score:
+                    mismatches.append((name, sub_id, indexed, score))
+        return mismatches
+
+
+def index_path(filename):
+    """Return the path of the sentiment index for a list of sub-reddits."""
+    return 'data/%s.sentiment.p' % os.path.splitext(filename)[0]
+
+
+def load_index(filename, sentiment, neutral=(-2, 2)):
+    """
+    Load the sentiment index of the sub-reddits listed in data/filename.
+
+    The data is only loaded, and new comments scored, if the sub-reddit
+    pickles have changed since the index was saved.
+    """
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    signature = corpus.source_signature(names)
+    path = index_path(filename)
+
+    index = None
+    try:
+        with open(path, 'rb') as saved:
+            index = pickle.load(saved)
+        index.lexicon = sentiment
+    except (IOError, EOFError, pickle.UnpicklingError):
+        pass
+    if index is None or index.key != lexicon_key(sentiment, neutral):
+        index = SentimentIndex(sentiment, neutral)
+
+    if index.signature != signature:
+        index.update(scraper.load_data(filename))
+        index.signature = signature
+        with open(path, 'wb') as out:
+            pickle.dump(index, out, pickle.HIGHEST_PROTOCOL)
+    return index
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+""" Contains bounded-memory sketches for word counts and distinct words. """
+
+from __future__ import division
+import hashlib
+import heapq
+import math
+import struct
+
+import lazy as lazy
+
+np = lazy.LazyModule('numpy')
+
+_hashes = {}
+
+
+def hash64(word, cache_size=20000):
+    """Return a 64-bit hash of a word, the same in every process."""
+    try:
+        return _hashes[word]
+    except KeyError:
+        pass
+    data = word.encode('utf-8') if isinstance(word, unicode) else word
+    value = struct.unpack('<Q', hashlib.md5(data).digest()[:8])[0]
+    if len(_hashes) >= cache_size:
+        _hashes.clear()
+    _hashes[word] = value
+    return value
+
+
+def hashes(words):
+    """Return an array of the 64-bit hashes of a list of words."""
+    values = map(_hashes.get, words)
+    if None in values:
+        values = [hash64(word) if value is None else value for word, value in zip(words, values)]
+    return np.array(values, np.uint64)
+
+
+class CountMinSketch(object):
+
+    """
+    Count-Min sketch of word frequencies.
+
+    Estimates never undercount. With width = ceil(e / eps) and
+    depth = ceil(ln(1 / delta)), an estimate exceeds the true count by more
+    than eps * N, N being the number of words added, with probability
+    at most delta. Memory is width * depth counters whatever N is.
+    """
+
+    def __init__(self, eps=0.001, delta=0.01):
+        """
+        Create a new empty sketch.
+
+        eps = error bound relative to the number of words added
+
+        delta = probability of exceeding the error bound
+        """
+        self.width = int(math.ceil(math.e / eps))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), np.int64)
+        self.total = 0
+
+    def columns(self, values):
+        """Return the column of each hash in every row, one row per row of the table."""
+        low = values & np.uint64(0xffffffff)
+        high = (values >> np.uint64(32)) | np.uint64(1)
+        return [((low + np.uint64(row) * high) % np.uint64(self.width)).astype(np.int64)
+                for row in xrange(self.depth)]
+
+    def add_hashes(self, values, counts=None):
+        """Add words by their hashes, each once or counts times."""
+        for row, columns in enumerate(self.columns(values)):
+            self.table[row] += np.bincount(columns, counts, self.width).astype(np.int64)
+        self.total += len(values) if counts is None else int(np.sum(counts))
+
+    def update(self, words):
+        """Add the words of a comment."""
+        self.add_hashes(hashes(words))
+
+    def estimates(self, words):
+        """Return an array of the estimated counts of words."""
+        columns = self.columns(hashes(words))
+        return np.min([self.table[row][cols] for row, cols in enumerate(columns)], axis=0)
+
+    def __getitem__(self, word):
+        return int(self.estimates([word])[0])
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same eps and delta."""
+        if self.table.shape != other.table.shape:
+            raise ValueError('sketches of %s and %s counters cannot be merged'
+                             % (self.table.shape, other.table.shape))
+        self.table += other.table
+        self.total += other.total
+        return self
+
+
+class SpaceSaving(object):
+
+    """
+    Space-Saving summary of the most frequent words.
+
+    Monitors at most k words. Every word seen more than N / k times,
+    N being the number of words added, is monitored, and its count is
+    overestimated by at most error[word] <= N / k.
+    """
+
+    def __init__(self, k=1000):
+        """
+        Create a new empty summary.
+
+        k = number of monitored words
+        """
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def minimum(self):
+        """Return the smallest monitored count, 0 if fewer than k words are monitored."""
+        if len(self.counts) < self.k:
+            return 0
+        heap = self.heap
+        while heap[0][0] != self.counts.get(heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0][0]
+
+    def add(self, word, count=1):
+        """Add count occurrences of a word."""
+        self.total += count
+        counts = self.counts
+        if word in counts:
+            counts[word] += count
+        elif len(counts) < self.k:
+            counts[word] = count
+            self.errors[word] = 0
+        else:
+            minimum = self.minimum()
+            evicted = heapq.heappop(self.heap)[1]
+            del counts[evicted]
+            del self.errors[evicted]
+            counts[word] = minimum + count
+            self.errors[word] = minimum
+        heapq.heappush(self.heap, (counts[word], word))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(count, word) for word, count in counts.items()]
+            heapq.heapify(self.heap)
+
+    def update(self, words):
+        """Add the words of a comment."""
+        for word in words:
+            self.add(word)
+
+    def add_counts(self, counts):
+        """
+        Add a dictionary of exact word counts at once.
+
+        The same as adding every word by add, except that the evicted words
+        are chosen after all counts are added.
+        """
+        minimum = self.minimum()
+        merged = dict(self.counts)
+        errors = dict(self.errors)
+        for word, count in counts.iteritems():
+            if word in merged:
+                merged[word] += count
+            else:
+                merged[word] = minimum + count
+                errors[word] = minimum
+        self.keep(merged, errors)
+        self.total += sum(counts.itervalues())
+
+    def merge(self, other):
+        """
+        Add the counts of another summary.
+
+        Words monitored by only one summary are counted with the minimum of
+        the other, so the merged counts still overestimate by at most N / k.
+        """
+        mine, theirs = self.minimum(), other.minimum()
+        merged = {}
+        errors = {}
+        for word in set(self.counts) | set(other.counts):
+            merged[word] = self.counts.get(word, mine) + other.counts.get(word, theirs)
+            errors[word] = self.errors.get(word, mine) + other.errors.get(word, theirs)
+        self.keep(merged, errors)
+        self.total += other.total
+        return self
+
+    def keep(self, counts, errors):
+        """Monitor the k words with the highest counts."""
+        if len(counts) > self.k:
+            counts = dict(heapq.nlargest(self.k, counts.iteritems(), key=lambda item: item[1]))
+        self.counts = counts
+        self.errors = dict((word, errors[word]) for word in counts)
+        self.heap = [(count, word) for word, count in counts.iteritems()]
+        heapq.heapify(self.heap)
+
+    def most_common(self, n=None):
+        """Return the n words with the highest counts and their counts."""
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return items if n is None else items[:n]
+
+
+class TopWords(object):
+
+    """
+    Approximate frequency distribution of the most frequent words.
+
+    The words are chosen by SpaceSaving and their counts are the smaller of
+    its count and the CountMinSketch estimate. Words are buffered and added
+    in batches.
+    """
+
+    def __init__(self, k=1000, eps=0.001, delta=0.01, batch=10000):
+        """
+        Create a new empty distribution.
+
+        k = number of words kept, see SpaceSaving
+
+        eps, delta = error bound of the counts, see CountMinSketch
+
+        batch = number of words buffered before they are added
+        """
+        self.summary = SpaceSaving(k)
+        self.sketch = CountMinSketch(eps, delta)
+        self.batch = batch
+        self.pending = []
+
+    def update(self, words):
+        """Add the words of a comment."""
+        self.pending.extend(words)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered words."""
+        if not self.pending:
+            return
+        counts = {}
+        for word in self.pending:
+            counts[word] = counts.get(word, 0) + 1
+        words = counts.keys()
+        self.sketch.add_hashes(hashes(words), np.array([counts[word] for word in words]))
+        self.summary.add_counts(counts)
+        self.pending = []
+
+    def merge(self, other):
+        """Add the words of another distribution with the same parameters."""
+        self.flush()
+        other.flush()
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def most_common(self, n=None):
+        """Return the n most frequent words and their estimated counts."""
+        self.flush()
+        words = self.summary.counts.keys()
+        estimates = self.sketch.estimates(words) if words else []
+        counts = [(word, min(self.summary.counts[word], int(estimate)))
+                  for word, estimate in zip(words, estimates)]
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts if n is None else counts[:n]
+
+    def total(self):
+        """Return the number of words added."""
+        self.flush()
+        return self.sketch.total
+
+
+class HyperLogLog(object):
+
+    """
+    HyperLogLog estimate of the number of distinct words.
+
+    Uses 2 ** p one-byte registers. The standard error of the estimate
+    is about 1.04 / sqrt(2 ** p), 1.6% for the default p = 12 in 4 KB.
+    """
+
+    def __init__(self, p=12):
+        """
+        Create a new empty estimate.
+
+        p = number of index bits, between 4 and 16
+        """
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, np.uint8)
+
+    def add_hashes(self, values):
+        """Add words by their hashes."""
+        if not len(values):
+            return
+        bits = 64 - self.p
+        index = (values >> np.uint64(bits)).astype(np.int64)
+        rest = (values & np.uint64((1 << bits) - 1)).astype(np.float64)
+        # position of the first 1 bit in the remaining bits, counted from 1
+        rank = np.full(len(values), bits + 1, np.uint8)
+        nonzero = rest > 0
+        rank[nonzero] = bits - np.floor(np.log2(rest[nonzero])).astype(np.int64)
+        np.maximum.at(self.registers, index, rank)
+
+    def update(self, words):
+        """Add the words of a comment, or any list of words."""
+        self.add_hashes(hashes(list(set(words))))
+
+    def estimate(self):
+        """Return the estimated number of distinct words."""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.sum(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+    def merge(self, other):
+        """Add the words of an estimate with the same p."""
+        if self.p != other.p:
+            raise ValueError('estimates with p = %d and %d cannot be merged' % (self.p, other.p))
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+""" Contains the SQLite store for reddit data, with a full-text index of the comments. """
+
+from __future__ import division
+from collections import Mapping
+import os
+import sqlite3
+import sys
+
+import analyser as anl
+import scraper as scraper
+from submission import Submission
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subreddits (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    subreddit_id INTEGER NOT NULL REFERENCES subreddits(id) ON DELETE CASCADE,
+    sub_id NOT NULL,
+    url TEXT,
+    title TEXT,
+    text TEXT,
+    position INTEGER NOT NULL,
+    UNIQUE (subreddit_id, sub_id)
+);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    submission_id INTEGER NOT NULL REFERENCES submissions(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_submission ON comments (submission_id, position);
+CREATE TABLE IF NOT EXISTS scores (
+    comment_id INTEGER NOT NULL REFERENCES comments(id) ON DELETE CASCADE,
+    submission_id INTEGER NOT NULL,
+    lexicon TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (lexicon, comment_id)
+);
+CREATE INDEX IF NOT EXISTS scores_submission ON scores (lexicon, submission_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5 (
+    body, content='comments', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS comments_delete AFTER DELETE ON comments BEGIN
+    INSERT INTO comments_fts (comments_fts, rowid, body) VALUES ('delete', old.id, old.body);
+END;
+"""
+
+
+def database_path(filename):
+    """Return the path of the database for a list of sub-reddits."""
+    return 'data/' + os.path.splitext(filename)[0] + '.db'
+
+
+def text(value):
+    """Return a str or unicode value as unicode, str is taken to be UTF-8."""
+    return value.decode('utf-8', 'replace') if isinstance(value, str) else value
+
+
+class DatabaseSubreddit(Mapping):
+
+    """Mapping of submission IDs to Submissions of one sub-reddit, read when accessed."""
+
+    def __init__(self, database, posts):
+        """
+        Create a new sub-reddit view.
+
+        database = the SqlStore
+
+        posts = list of (row id, sub_id, url, title, text) in the order they were inserted
+        """
+        self.database = database
+        self.posts = posts
+        self.index = dict((post[1], i) for i, post in enumerate(posts))
+
+    def __getitem__(self, sub_id):
+        row, _, url, title, body = self.posts[self.index[sub_id]]
+        return Submission(url, title, body, self.database.comments(row))
+
+    def __iter__(self):
+        return (post[1] for post in self.posts)
+
+    def __len__(self):
+        return len(self.posts)
+
+
+class SqlStore(Mapping):
+
+    """
+    SQLite database of reddit data.
+
+    Behaves like the dictionary of dictionaries returned by scraper.load_data,
+    in the order of the sub-reddit list, reading the comments of a submission
+    when it is accessed. Comments are indexed for full-text search, and
+    per-comment sentiment scores can be stored and queried by thread.
+    """
+
+    def __init__(self, path, batch=10000):
+        """
+        Open or create a database.
+
+        path = path of the database file
+
+        batch = number of rows inserted per statement
+        """
+        self.path = path
+        self.batch = batch
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.executescript(SCHEMA)
+
+    def names(self):
+        """Return the names of the sub-reddits in order."""
+        return [name for name, in self.connection.execute(
+            'SELECT name FROM subreddits ORDER BY position')]
+
+    def __getitem__(self, name):
+        posts = self.connection.execute(
+            'SELECT s.id, s.sub_id, s.url, s.title, s.text FROM submissions s '
+            'JOIN subreddits r ON r.id = s.subreddit_id WHERE r.name = ? ORDER BY s.position',
+            (name,)).fetchall()
+        if not posts and name not in self.names():
+            raise KeyError(name)
+        return DatabaseSubreddit(self, posts)
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM subreddits').fetchone()[0]
+
+    def comments(self, submission):
+        """Return the comments of a submission by its row id."""
+        return [body for body, in self.connection.execute(
+            'SELECT body FROM comments WHERE submission_id = ? ORDER BY position', (submission,))]
+
+    def insert(self, name, data, position=None):
+        """
+        Add the data of a sub-reddit, replacing what was stored for it before.
+
+        Everything is written in one transaction, comments in batches,
+        and the comments are added to the full-text index at the end,
+        which is several times faster than indexing them one by one.
+
+        -> name: name of the sub-reddit
+        -> data: dictionary of Submissions, as loaded by scraper.load_data_sub
+        -> position: index of the sub-reddit in the sub-reddit list, if None
+        a stored sub-reddit keeps its place and a new one goes last
+        """
+        with self.connection as connection:
+            if position is None:
+                position = connection.execute(
+                    'SELECT COALESCE((SELECT position FROM subreddits WHERE name = ?), '
+                    '(SELECT MAX(position) + 1 FROM subreddits), 0)', (name,)).fetchone()[0]
+            connection.execute('DELETE FROM subreddits WHERE name = ?', (name,))
+            subreddit = connection.execute('INSERT INTO subreddits (name, position) VALUES (?, ?)',
+                                           (name, position)).lastrowid
+            rows = []
+            for position, (sub_id, sub) in enumerate(data.items()):
+                submission = connection.execute(
+                    'INSERT INTO submissions (subreddit_id, sub_id, url, title, text, position) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (subreddit, sub_id, text(sub.url), text(sub.title), text(sub.text), position)).lastrowid
+                rows.extend((submission, i, text(comment)) for i, comment in enumerate(sub.comments))
+                if len(rows) >= self.batch:
+                    connection.executemany('INSERT INTO comments (submission_id, position, body) '
+                                           'VALUES (?, ?, ?)', rows)
+                    rows = []
+            connection.executemany('INSERT INTO comments (submission_id, position, body) '
+                                   'VALUES (?, ?, ?)', rows)
+            connection.execute('INSERT INTO comments_fts (rowid, body) SELECT c.id, c.body '
+                               'FROM comments c JOIN submissions s ON s.id = c.submission_id '
+                               'WHERE s.subreddit_id = ?', (subreddit,))
+
+    def search(self, query, subreddit=None, limit=None):
+        """
+        Full-text search of the comments.
+
+        -> query: FTS5 query, a word finds the comments containing it
+        -> subreddit: only search the comments of this sub-reddit
+        -> limit: at most this many comments
+
+        <- list of (sub-reddit, sub_id, comment) in the order they were inserted
+        """
+        sql = ('SELECT r.name, s.sub_id, c.body FROM comments_fts f '
+               'JOIN comments c ON c.id = f.rowid '
+               'JOIN submissions s ON s.id = c.submission_id '
+               'JOIN subreddits r ON r.id = s.subreddit_id '
+               'WHERE comments_fts MATCH ?')
+        args = [query]
+        if subreddit is not None:
+            sql += ' AND r.name = ?'
+            args.append(subreddit)
+        # ordered by the index, so that a limit stops the search early
+        sql += ' ORDER BY f.rowid'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(limit)
+        return self.connection.execute(sql, args).fetchall()
+
+    def add_scores(self, sentiment, lexicon='afinn'):
+        """
+        Score every comment as analyser.sentiment does and store the scores.
+
+        -> sentiment: dictionary of word valences
+        -> lexicon: name the scores are stored under, replacing earlier scores
+        """
+        tokens = anl.get_normalizer(False, False, True).tokens
+        with self.connection as connection:
+            connection.execute('DELETE FROM scores WHERE lexicon = ?', (lexicon,))
+            cursor = connection.execute('SELECT id, submission_id, body FROM comments')
+            while True:
+                rows = cursor.fetchmany(self.batch)
+                if not rows:
+                    break
+                connection.executemany(
+                    'INSERT INTO scores (comment_id, submission_id, lexicon, score) VALUES (?, ?, ?, ?)',
+                    [(comment, submission, lexicon,
+                      sum([sentiment[word] for word in tokens(body) if word in sentiment]))
+                     for comment, submission, body in rows])
+
+    def thread_sentiment(self, lexicon='afinn', neutral=(-2, 2), below=None, above=None):
+        """
+        Sentiment analysis.
+
+        Return the average score of the comments of each thread, leaving out
+        scores in the neutral range, 0 if all are, as analyser.sentiment does
+
+        -> lexicon: name given to add_scores
+        -> below, above: only threads with an average below or above these
+
+        <- list of (sub-reddit, sub_id, title, average score)
+        """
+        low, high = neutral
+        sql = ('SELECT r.name, s.sub_id, s.title, '
+               'COALESCE(SUM(CASE WHEN c.score NOT BETWEEN ? AND ? THEN c.score END) '
+               '/ MAX(SUM(c.score NOT BETWEEN ? AND ?), 1), 0) AS average '
+               'FROM submissions s JOIN subreddits r ON r.id = s.subreddit_id '
+               'LEFT JOIN scores c ON c.submission_id = s.id AND c.lexicon = ? '
+               'GROUP BY s.id')
+        args = [low, high, low, high, lexicon]
+        having = []
+        if below is not None:
+            having.append('average < ?')
+            args.append(below)
+        if above is not None:
+            having.append('average > ?')
+            args.append(above)
+        if having:
+            sql += ' HAVING ' + ' AND '.join(having)
+        sql += ' ORDER BY r.position, s.position'
+        return self.connection.execute(sql, args).fetchall()
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+
+def open_database(filename):
+    """
+    Load reddit data from the SQLite database of a filename.
+
+    -> filename: file in data/ listing the sub-reddits, as for scraper.load_data
+
+    <- SqlStore that has been written by migrate
+    """
+    path = database_path(filename)
+    if not os.path.exists(path):
+        raise IOError('no database at %s, see sqlstore.migrate' % path)
+    return SqlStore(path)
+
+
+def migrate(filename, verbose=True):
+    """
+    Copy the pickles of the sub-reddits in data/filename to their database.
+
+    The sub-reddits are loaded one at a time, including comments appended
+    by incremental scraping, and each is written in one transaction.
+
+    <- the SqlStore
+    """
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+    database = SqlStore(database_path(filename))
+    for position, name in enumerate(names):
+        if verbose:
+            print name
+        database.insert(name, scraper.load_data_sub(name), position)
+    return database
+
+
+if __name__ == '__main__':
+    # python sqlstore.py [file in data/ listing the sub-reddits]
+    migrate(sys.argv[1] if len(sys.argv) > 1 else 'sub-reddits.txt').close()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+""" Contains the memory-mapped columnar store for reddit data. """
+
+from collections import Mapping, Sequence
+import cPickle as pickle
+import mmap
+import os
+
+import numpy as np
+
+import scraper as scraper
+
+
+def store_path(filename):
+    """Return the path prefix of the store for a list of sub-reddits."""
+    return 'data/' + os.path.splitext(filename)[0]
+
+
+class LazyComments(Sequence):
+
+    """Read-only sequence of comments, decoded from the blob when accessed."""
+
+    def __init__(self, blob, offsets, first, last):
+        """
+        Create a new sequence of comments.
+
+        blob = mmap holding the UTF-8 text of all comments
+
+        offsets = array where comment i is blob[offsets[i]:offsets[i + 1]]
+
+        first, last = range of comment indices in this sequence
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return self.last - self.first
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('comment index out of range')
+        start, end = self.offsets[self.first + index:self.first + index + 2].tolist()
+        return self.blob[start:end].decode('utf-8')
+
+    def __iter__(self):
+        blob = self.blob
+        offsets = self.offsets[self.first:self.last + 1].tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield blob[start:end].decode('utf-8')
+
+
+class StoredSubmission(object):
+
+    """Submission-like view of a submission in a CorpusStore."""
+
+    __slots__ = ('url', 'title', 'text', 'comments')
+
+    def __init__(self, url, title, text, comments):
+        self.url = url
+        self.title = title
+        self.text = text
+        self.comments = comments
+
+
+class LazySubreddit(Mapping):
+
+    """Mapping of submission IDs to StoredSubmissions of one sub-reddit."""
+
+    def __init__(self, store, posts):
+        """
+        Create a new sub-reddit view.
+
+        store = the CorpusStore holding the comments
+
+        posts = list of (sub_id, url, title, text, first, last) tuples
+        """
+        self.store = store
+        self.posts = posts
+        self.index = dict((post[0], i) for i, post in enumerate(posts))
+
+    def __getitem__(self, sub_id):
+        _, url, title, text, first, last = self.posts[self.index[sub_id]]
+        return StoredSubmission(url, title, text,
+                                LazyComments(self.store.blob, self.store.offsets, first, last))
+
+    def __iter__(self):
+        return (post[0] for post in self.posts)
+
+    def __len__(self):
+        return len(self.posts)
+
+
+class CorpusStore(Mapping):
+
+    """
+    Memory-mapped reddit data.
+
+    Behaves like the dictionary of dictionaries returned by scraper.load_data,
+    in the order of the sub-reddit list, but comments are only read and 
+    decoded when touched.
+    """
+
+    def __init__(self, path):
+        """
+        Open a store written by convert.
+
+        path = path prefix of the store files, see store_path
+        """
+        with open(path + '.index.p', 'rb') as index:
+            self.subreddits = pickle.load(index)
+        self.names = dict((name, i) for i, (name, _) in enumerate(self.subreddits))
+        self.offsets = np.memmap(path + '.offsets', dtype=np.uint64, mode='r')
+        with open(path + '.blob', 'rb') as blob:
+            # mmap can not map empty files
+            if os.fstat(blob.fileno()).st_size:
+                self.blob = mmap.mmap(blob.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.blob = ''
+
+    def __getitem__(self, name):
+        return LazySubreddit(self, self.subreddits[self.names[name]][1])
+
+    def __iter__(self):
+        return (name for name, _ in self.subreddits)
+
+    def __len__(self):
+        return len(self.subreddits)
+
+    def close(self):
+        """Unmap the comment text."""
+        if self.blob:
+            self.blob.close()
+
+
+def open_store(filename):
+    """
+    Load reddit data lazily from a filename.
+
+    -> filename: file in data/ listing the sub-reddits, as for scraper.load_data
+
+    <- CorpusStore that has been written by convert
+    """
+    return CorpusStore(store_path(filename))
+
+
+def convert(filename):
+    """
+    Convert the pickles of the sub-reddits in data/filename to a CorpusStore.
+
+    The sub-reddits are loaded one at a time, including comments appended 
+    by incremental scraping, and the comment text and offsets are appended 
+    to the files as it goes, so only one sub-reddit is in memory.
+    """
+    path = store_path(filename)
+    with open('data/' + filename, 'rb') as subreddits:
+        names = [sub.strip() for sub in subreddits]
+
+    index = []
+    count = 0
+    position = 0
+    with open(path + '.blob', 'wb') as blob, open(path + '.offsets', 'wb') as offsets:
+        np.zeros(1, np.uint64).tofile(offsets)
+        for name in names:
+            data = scraper.load_data_sub(name)
+            posts = []
+            ends = []
+            for sub_id, sub in data.items():
+                first = count
+                for comment in sub.comments:
+                    if isinstance(comment, unicode):
+                        comment = comment.encode('utf-8')
+                    blob.write(comment)
+                    position += len(comment)
+                    ends.append(position)
+                count += len(sub.comments)
+                posts.append((sub_id, sub.url, sub.title, sub.text, first, count))
+            np.array(ends, dtype=np.uint64).tofile(offsets)
+            index.append((name, posts))
+
+    with open(path + '.index.p', 'wb') as out:
+        pickle.dump(index, out, pickle.HIGHEST_PROTOCOL)
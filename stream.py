@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+""" Contains generator stages and incremental aggregators for the analysis. """
+
+from __future__ import division
+from collections import defaultdict, deque
+import heapq
+
+import analyser as anl
+import instrument as instrument
+import lazy as lazy
+import sketch as sketch
+
+nltk = lazy.LazyModule('nltk')
+
+
+def submissions(subreddit):
+    """
+    Load stage.
+
+    Yield (name, sub_id, sub) for every submission of every sub-reddit
+    """
+    for name, data in subreddit.items():
+        for sub_id, sub in data.items():
+            yield name, sub_id, sub
+
+
+def normalize(subreddit, stop, stem, split=False):
+    """
+    Normalize stage.
+
+    Return a function yielding the words of each comment of a submission,
+    see analyser.comment_words
+    """
+    words_of = anl.comment_words(subreddit, stop, stem, split)
+
+    def tokens(sub):
+        for words in words_of(sub):
+            yield words
+    return tokens
+
+
+def remove(token_lists, exclude):
+    """
+    Filter stage.
+
+    Yield the words of each comment without the words in exclude
+    """
+    for words in token_lists:
+        yield [word for word in words if word not in exclude]
+
+
+def aggregate(token_lists, *aggregators):
+    """
+    Aggregate stage.
+
+    Feed the words of each comment to every aggregator and return the aggregators
+    """
+    for words in token_lists:
+        for aggregator in aggregators:
+            aggregator.update(words)
+    return aggregators
+
+
+class WordCounter(object):
+
+    """Frequency distribution of words."""
+
+    def __init__(self):
+        self.freq_dist = nltk.probability.FreqDist()
+
+    def update(self, words):
+        """Count the words of a comment."""
+        self.freq_dist.update(words)
+
+
+class TopWords(sketch.TopWords):
+
+    """Frequency distribution of the most frequent words in bounded memory, see sketch.TopWords."""
+
+    @property
+    def freq_dist(self):
+        """FreqDist of the k most frequent words and their estimated counts."""
+        return nltk.probability.FreqDist(dict(self.most_common()))
+
+
+class DistinctCounter(object):
+
+    """Number of words and distinct words."""
+
+    def __init__(self):
+        self.words = set()
+        self.total = 0
+
+    def update(self, words):
+        """Count the words of a comment."""
+        self.words.update(words)
+        self.total += len(words)
+
+    def diversity(self):
+        """Return the lexical diversity, distinct words per word."""
+        return len(self.words) / self.total
+
+
+class DistinctSketch(DistinctCounter):
+
+    """
+    Number of words and estimated distinct words in bounded memory, see
+    sketch.HyperLogLog. Words are buffered and added in batches.
+    """
+
+    def __init__(self, p=12, batch=10000):
+        self.words = sketch.HyperLogLog(p)
+        self.total = 0
+        self.batch = batch
+        self.pending = []
+
+    def update(self, words):
+        """Count the words of a comment."""
+        self.pending.extend(words)
+        self.total += len(words)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered words to the estimate."""
+        self.words.update(self.pending)
+        self.pending = []
+
+    def diversity(self):
+        """Return the estimated lexical diversity, distinct words per word."""
+        self.flush()
+        return min(len(self.words), self.total) / self.total
+
+    def merge(self, other):
+        """Add the words of another counter with the same p."""
+        self.flush()
+        other.flush()
+        self.words.merge(other.words)
+        self.total += other.total
+        return self
+
+
+class BigramCounter(object):
+
+    """
+    Word and bigram counts as BigramCollocationFinder.from_words would collect them
+    from the words of all comments concatenated.
+    """
+
+    def __init__(self):
+        self.word_fd = nltk.probability.FreqDist()
+        self.bigram_fd = nltk.probability.FreqDist()
+        self.last = None
+
+    def update(self, words):
+        """Count the words of a comment, continuing the bigrams of the previous one."""
+        if not words:
+            return
+        self.word_fd.update(words)
+        if self.last is not None:
+            self.bigram_fd[(self.last, words[0])] += 1
+        self.bigram_fd.update(zip(words, words[1:]))
+        self.last = words[-1]
+
+    def finder(self):
+        """Return a BigramCollocationFinder over the counts."""
+        return nltk.collocations.BigramCollocationFinder(self.word_fd, self.bigram_fd)
+
+
+class TrigramCounter(object):
+
+    """
+    Word, bigram and trigram counts as TrigramCollocationFinder.from_words would collect
+    them from the words of all comments concatenated.
+    """
+
+    def __init__(self):
+        self.word_fd = nltk.probability.FreqDist()
+        self.bigram_fd = nltk.probability.FreqDist()
+        self.wildcard_fd = nltk.probability.FreqDist()
+        self.trigram_fd = nltk.probability.FreqDist()
+        self.window = deque(maxlen=2)
+
+    def update(self, words):
+        """Count the words of a comment, continuing the trigrams of the previous one."""
+        window = self.window
+        for word in words:
+            if len(window) == 2:
+                w1, w2 = window
+                self.word_fd[w1] += 1
+                self.bigram_fd[(w1, w2)] += 1
+                self.wildcard_fd[(w1, word)] += 1
+                self.trigram_fd[(w1, w2, word)] += 1
+            window.append(word)
+
+    def finder(self):
+        """Return a TrigramCollocationFinder over the counts, including the last two words."""
+        word_fd = self.word_fd.copy()
+        bigram_fd = self.bigram_fd.copy()
+        window = list(self.window)
+        word_fd.update(window)
+        if len(window) == 2:
+            bigram_fd[tuple(window)] += 1
+        return nltk.collocations.TrigramCollocationFinder(word_fd, bigram_fd,
+                                                          self.wildcard_fd, self.trigram_fd)
+
+
+class NgramCounter(object):
+
+    """Frequency distribution of the n-grams of all comments concatenated."""
+
+    def __init__(self, n):
+        self.freq_dist = nltk.probability.FreqDist()
+        self.window = deque(maxlen=n)
+
+    def update(self, words):
+        """Count the n-grams ending in the words of a comment."""
+        window = self.window
+        for word in words:
+            window.append(word)
+            if len(window) == window.maxlen:
+                self.freq_dist[tuple(window)] += 1
+
+
+class BigramIndex(object):
+
+    """
+    Inverted bigram index.
+
+    Maps every word to the bigrams it occurs in, so the bigrams of one word
+    are found without scanning all bigrams of the corpus.
+    """
+
+    def __init__(self, bigram_fd, total):
+        """
+        Index bigram counts in one pass.
+
+        bigram_fd = frequency distribution of (w1, w2) bigrams
+
+        total = number of words, raw_freq scores are count / total
+        """
+        self.total = total
+        self.bigrams = defaultdict(list)
+        for bigram, count in bigram_fd.items():
+            w1, w2 = bigram
+            self.bigrams[w1].append((bigram, count))
+            if w2 != w1:
+                self.bigrams[w2].append((bigram, count))
+
+    @classmethod
+    def from_finder(cls, finder):
+        """Index the counts of a BigramCollocationFinder."""
+        return cls(finder.ngram_fd, finder.word_fd.N())
+
+    def neighbours(self, word, k=10):
+        """
+        Return the k most frequent (bigram, raw_freq) containing word, the same
+        as score_ngrams(raw_freq)[:k] on a finder filtered to bigrams with word
+        """
+        top = heapq.nsmallest(k, self.bigrams.get(word, ()),
+                              key=lambda item: (-item[1], item[0]))
+        return [(bigram, count / self.total) for bigram, count in top]
+
+
+def lexical_diversity(subreddit, sketch=False, p=12):
+    """
+    Lexical diversity.
+
+    Streaming analyser.lexical_diversity, only the distinct words of one thread are kept,
+    or a DistinctSketch of 2 ** p bytes with sketch
+    """
+    tokens = normalize(subreddit, True, False)
+    counter = (lambda: DistinctSketch(p)) if sketch else DistinctCounter
+    scores_all = []
+    names = []
+    titles_all = []
+    for name, data in subreddit.items():
+        names.append(name)
+        scores_all.append([])
+        titles_all.append([])
+        for sub_id, sub in data.items():
+            with instrument.stage('aggregate', name, sub_id):
+                distinct, = aggregate(tokens(sub), counter())
+            scores_all[-1].append(distinct.diversity())
+            titles_all[-1].append(sub.title)
+    return names, scores_all, titles_all
+
+
+def most_frequent_words(subreddit, sketch=False, k=1000):
+    """
+    Word counting.
+
+    Streaming analyser.most_frequent_words. With sketch, the words of each
+    sub-reddit are counted by a sketch.TopWords and the distributions hold
+    only its k most frequent words, with approximate counts.
+    """
+    tokens = normalize(subreddit, True, False)
+    freq_dists = []
+    names = []
+    titles_all = []
+    for name, data in subreddit.items():
+        titles_subs = []
+        counter = TopWords(k) if sketch else WordCounter()
+        for sub_id, sub in data.items():
+            with instrument.stage('aggregate', name, sub_id):
+                aggregate(tokens(sub), counter)
+            titles_subs.append(sub.title)
+        names.append(name)
+        titles_all.append(titles_subs)
+        freq_dists.append(counter.freq_dist)
+    return names, freq_dists, titles_all
+
+
+def thread_counters(subreddit, counter, stop=True, stem=True, split=False):
+    """
+    Topic mining.
+
+    Count the words of each thread with a new counter, one thread at a time
+
+    -> subreddit: data or corpus.TokenizedCorpus
+    -> counter: function returning a new aggregator, e.g. BigramCounter
+
+    <- yields (name, sub, aggregator) for every submission
+    """
+    tokens = normalize(subreddit, stop, stem, split)
+    for name, sub_id, sub in submissions(subreddit):
+        yield name, sub, aggregate(tokens(sub), counter())[0]
+
+
+def bigram_finder(subreddit, stop, stem):
+    """
+    Topic mining.
+
+    Return a BigramCollocationFinder over all comments concatenated,
+    as used by analyser.unknowncoll
+    """
+    tokens = normalize(subreddit, stop, stem)
+    counter = BigramCounter()
+    for name, sub_id, sub in submissions(subreddit):
+        with instrument.stage('aggregate', name, sub_id):
+            aggregate(tokens(sub), counter)
+    return counter.finder()
+
+
+def bigram_index(subreddit, stop, stem):
+    """
+    Topic mining.
+
+    Return a BigramIndex over all comments concatenated,
+    as used by analyser.unknowncoll
+    """
+    return BigramIndex.from_finder(bigram_finder(subreddit, stop, stem))
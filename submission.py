@@ -1,29 +1,132 @@
 # -*- coding: utf-8 -*-
 """ Contains the class used to store reddit data. """
 
+from array import array
+from collections import Sequence
 
-class Submission:
-    
-    """Class for a reddit submission."""
-    
-    url = ''
-    title = ''
-    text = ''
-    comments = []
-    
-    def __init__(self, url, title, text, comments):
+
+class CommentList(Sequence):
+
+    """Read-only sequence of comments stored in one buffer."""
+
+    __slots__ = ('buffer', 'offsets', 'unicode')
+
+    def __init__(self, buffer, offsets, unicode):
+        """
+        Create a new sequence of comments.
+
+        buffer = all comments concatenated, UTF-8 encoded if unicode is True
+
+        offsets = array('I') where comment i is buffer[offsets[i]:offsets[i + 1]]
+
+        unicode = Boolean to determine if the comments are decoded when accessed
+        """
+        self.buffer = buffer
+        self.offsets = offsets
+        self.unicode = unicode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('comment index out of range')
+        comment = self.buffer[self.offsets[index]:self.offsets[index + 1]]
+        return comment.decode('utf-8') if self.unicode else comment
+
+    def __iter__(self):
+        buffer = self.buffer
+        offsets = self.offsets
+        for i in xrange(len(offsets) - 1):
+            comment = buffer[offsets[i]:offsets[i + 1]]
+            yield comment.decode('utf-8') if self.unicode else comment
+
+    def __eq__(self, other):
+        # strings are sequences too, but never equal to a list of comments
+        if not isinstance(other, (CommentList, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def pack(comments):
+    """Return a CommentList holding a list of comments."""
+    unicode_ = any(isinstance(comment, unicode) for comment in comments)
+    if unicode_:
+        comments = [comment.encode('utf-8') if isinstance(comment, unicode) else comment
+                    for comment in comments]
+    offsets = array('I', [0])
+    position = 0
+    for comment in comments:
+        position += len(comment)
+        offsets.append(position)
+    return CommentList(''.join(comments), offsets, unicode_)
+
+
+class Submission(object):
+
+    """
+    Class for a reddit submission.
+
+    The comments are kept in a single buffer, see CommentList.
+    Pickles of the old class, which kept them in a list,
+    can still be loaded, see scraper.resave_data.
+    """
+
+    __slots__ = ('url', 'title', 'text', '_comments')
+
+    def __init__(self, url='', title='', text='', comments=()):
         """
         Create a new submission.
-        
+
         url = the exact address of this submission
-        
+
         text = the content of this submission
-        
+
         title = the title of this submission
-        
+
         comments = list of all comments made on this submission
         """
         self.url = url
         self.text = text
         self.title = title
-        self.comments = comments
\ No newline at end of file
+        self.comments = comments
+
+    @property
+    def comments(self):
+        """Sequence of all comments made on this submission."""
+        return self._comments
+
+    @comments.setter
+    def comments(self, comments):
+        self._comments = comments if isinstance(comments, CommentList) else pack(list(comments))
+
+    def __getstate__(self):
+        comments = self._comments
+        return (self.url, self.title, self.text,
+                comments.buffer, comments.offsets.tostring(), comments.unicode)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled by the old class with a __dict__
+            self.__init__(state.get('url', ''), state.get('title', ''),
+                          state.get('text', ''), state.get('comments', []))
+            return
+        self.url, self.title, self.text, buffer, offsets, unicode_ = state
+        self._comments = CommentList(buffer, array('I', offsets), unicode_)
@@ -1,6 +1,33 @@
 from visualizer import *
 from scraper import *
 from analyser import *
+from corpus import *
+import scoring as scoring
+import parallel as parallel
+import store as store
+import sqlstore as sqlstore
+import stream as stream
+import harvester as harvester
+import sentindex as sentindex
+import ngramstore as ngramstore
+import unknownstats as unknownstats
+import cloudfarm as cloudfarm
+import lexicon as lexicon
+import phrases as phrases
+import sketch as sketch
+import benchmark as benchmark
+import instrument as instrument
+import pipeline as pipeline
+import results as results
+import lazy as lazy
+from nltk.collocations import BigramCollocationFinder, TrigramCollocationFinder
+from nltk.util import ngrams
+import nltk as nltk
+import numpy as np
+from collections import defaultdict
+import cPickle as pickle
+import os
+import random
 import pytest as pytest
 
     
@@ -51,3 +78,685 @@ def test_load_data():
     assert data
     with pytest.raises(IOError):
         data = load_data('wrong_path')
+
+
+def test_normalizer():
+    """Used to test the Normalizer against the fixer it replaced"""
+    comment = "Isn't THIS the running-man's 2nd movie?!"
+    for stop in (True, False):
+        for stem in (True, False):
+            normalizer = Normalizer(stop, stem, cache_size=2)
+            assert normalizer.tokens(comment) == benchmark.legacy_fixer(comment, stop, stem).split()
+            assert fixer(comment, stop, stem) == benchmark.legacy_fixer(comment, stop, stem)
+            assert normalizer.words([comment, comment]) == 2 * normalizer.tokens(comment)
+    assert Normalizer(True, False).tokens(comment) == ['running', "man's", 'nd', 'movie']
+
+
+def write_data(data):
+    """Write data in the layout expected by load_data"""
+    os.mkdir('data')
+    with open('data/sub-reddits.txt', 'wb') as subreddits:
+        subreddits.write('\n'.join(sorted(data)))
+    for name, posts in data.items():
+        with open('data/' + name + '.p', 'wb') as out:
+            pickle.dump(posts, out)
+
+
+def test_tokenized_corpus(tmpdir, monkeypatch):
+    """Used to test that the tokenized corpus gives the same results as raw data"""
+    monkeypatch.chdir(tmpdir)
+    write_data({'a': {1: Submission('url', 'title', 'text', ["Good stuff, isn't it?", 'bad day'])},
+                'b': {2: Submission('url', 'title2', 'text', ['What a LOVELY day!'])}})
+    data = load_data('sub-reddits.txt')
+    tokenized = load_corpus('sub-reddits.txt', True, False)
+    assert lexical_diversity(tokenized) == lexical_diversity(data)
+    
+    tokenized = load_corpus('sub-reddits.txt', True, False)
+    assert tokenized.signature == source_signature(['a', 'b'])
+    assert lexical_diversity(tokenized) == lexical_diversity(data)
+    
+    split = load_corpus('sub-reddits.txt', False, False, split=True)
+    sentiments = {'good': 3, 'lovely': 3, 'day!': 2}
+    assert sentiment(split, sentiments) == sentiment(data, sentiments)
+    with pytest.raises(ValueError):
+        sentiment(tokenized, sentiments)
+
+
+def test_sentiment_engine():
+    """Used to test that the vectorized sentiment gives the same results"""
+    rand = random.Random(1)
+    words = ['good', 'bad', 'awful', 'ok', 'nice!', 'meh', 'Great']
+    sentiments = {'good': 3, 'bad': -3, 'awful': -5, 'ok': 1, 'nice!': 2, 'great': 4}
+    data = {}
+    for name in 'abc':
+        data[name] = {}
+        for i in range(rand.randint(0, 4)):
+            comments = [' '.join(rand.choice(words) for _ in range(rand.randint(0, 6)))
+                        for _ in range(rand.randint(0, 8))]
+            data[name][i] = Submission('url', 'title %d' % i, 'text', comments)
+    tokenized = TokenizedCorpus.build(data, False, False, split=True)
+    assert scoring.SentimentEngine(sentiments).score(tokenized) == sentiment(data, sentiments)
+    assert scoring.sentiment(data, sentiments) == sentiment(data, sentiments)
+
+
+def test_parallel():
+    """Used to test that the process pool gives the same results in the same order"""
+    words = ['good', 'bad', 'game', 'the', 'love', 'movie', 'Great!']
+    data = {}
+    for name in 'abc':
+        data[name] = {}
+        for i in range(3):
+            comments = [' '.join(words[(i + j + k) % len(words)] for k in range(5))
+                        for j in range(6)]
+            data[name][i] = Submission('url', 'title %d' % i, 'text', comments)
+    sentiments = {'good': 3, 'bad': -3, 'love': 3, 'great': 3}
+    split = TokenizedCorpus.build(data, False, False, split=True)
+    stop = TokenizedCorpus.build(data, True, False)
+    for workers in (1, 2):
+        assert parallel.sentiment(split, sentiments, workers, 1) == sentiment(data, sentiments)
+        assert parallel.lexical_diversity(stop, workers, 2) == lexical_diversity(data)
+    names, bigrams, titles = parallel.collocations_bigram(stop, freq=1, workers=2)
+    assert names == stop.keys() and len(bigrams[0]) == 3
+
+
+def test_store(tmpdir, monkeypatch):
+    """Used to test that the memory-mapped store gives the same data"""
+    monkeypatch.chdir(tmpdir)
+    write_data({'a': {1: Submission('url', 'title', 'text', [u'caf\xe9 au lait', '', 'x']),
+                      2: Submission('url2', 'title2', 'text2', [])},
+                'b': {3: Submission('url3', 'title3', 'text3', ['last one'])}})
+    store.convert('sub-reddits.txt')
+    data = load_data('sub-reddits.txt')
+    lazy = store.open_store('sub-reddits.txt')
+    assert lazy.keys() == ['a', 'b']
+    for name, posts in data.items():
+        assert sorted(lazy[name].keys()) == sorted(posts.keys())
+        for sub_id, sub in posts.items():
+            assert lazy[name][sub_id].title == sub.title
+            assert list(lazy[name][sub_id].comments) == sub.comments
+    assert lazy['a'][1].comments[0] == u'caf\xe9 au lait'
+    assert lazy['a'][1].comments[-1] == 'x'
+    assert lazy['a'][1].comments[1:] == ['', 'x']
+    assert sorted(lexical_diversity({'b': lazy['b']})[1]) == sorted(lexical_diversity({'b': data['b']})[1])
+    lazy.close()
+
+
+def test_stream():
+    """Used to test that the streaming analyses give the same results"""
+    comments = ['The cat sat on the mat', '', 'cat sat', "the cat's mat, sat on the cat!", 'mat']
+    data = {'a': {1: Submission('url', 'title', 'text', comments),
+                  2: Submission('url', 'title2', 'text', comments[::-1])},
+            'b': {3: Submission('url', 'title3', 'text', comments[2:])}}
+    assert stream.lexical_diversity(data) == lexical_diversity(data)
+    assert stream.most_frequent_words(data) == most_frequent_words(data)
+    
+    words = [word for comment in comments for word in fixer(comment, False, False).split()]
+    counters = [stream.BigramCounter(), stream.TrigramCounter(), stream.NgramCounter(3)]
+    stream.aggregate(stream.normalize(data, False, False)(data['a'][1]), *counters)
+    bigrams = BigramCollocationFinder.from_words(words)
+    assert counters[0].finder().ngram_fd == bigrams.ngram_fd
+    assert counters[0].finder().word_fd == bigrams.word_fd
+    trigrams = TrigramCollocationFinder.from_words(words)
+    for attr in ('word_fd', 'bigram_fd', 'wildcard_fd', 'ngram_fd'):
+        assert getattr(counters[1].finder(), attr) == getattr(trigrams, attr)
+    assert counters[2].freq_dist == nltk.FreqDist(ngrams(words, 3))
+    
+    for name, sub, counter in stream.thread_counters(data, stream.BigramCounter, True, False):
+        finder = BigramCollocationFinder.from_words(fixer(' '.join(sub.comments), True, False).split())
+        assert counter.finder().ngram_fd == finder.ngram_fd
+
+
+def test_bigram_index():
+    """Used to test that the bigram index gives the same neighbours as filtered finders"""
+    random.seed(5)
+    words = [random.choice(['the', 'cat', 'sat', 'on', 'mat', 'dog', 'ran']) for _ in xrange(500)]
+    finder = BigramCollocationFinder.from_words(words)
+    index = stream.BigramIndex.from_finder(finder)
+    for word in set(words) | set(['missing']):
+        filtered = BigramCollocationFinder(finder.word_fd, finder.ngram_fd.copy())
+        filtered.apply_ngram_filter(lambda w1, w2: word != w1 and word != w2)
+        expected = filtered.score_ngrams(nltk.collocations.BigramAssocMeasures.raw_freq)[:10]
+        assert index.neighbours(word, 10) == expected
+
+
+class FakePost:
+    """Submission as returned by the reddit client"""
+    def __init__(self, id, num_comments=1):
+        self.id = id
+        self.url = 'url' + id
+        self.title = 'title' + id
+        self.selftext = 'text' + id
+        self.num_comments = num_comments
+
+
+class FakeClient:
+    """Reddit client without network access, failing on some requests"""
+    def __init__(self, failing=('b1',)):
+        self.calls = defaultdict(int)
+        self.failing = failing
+        self.new = {}
+
+    def top(self, name, limit):
+        self.calls[name] += 1
+        if name == 'down':
+            raise IOError('503')
+        return [FakePost(name + str(i), 1 + len(self.new.get(name + str(i), [])))
+                for i in range(limit)]
+
+    def comment_items(self, post):
+        self.calls[post.id] += 1
+        if post.id == 'a0' and self.calls[post.id] == 1:
+            raise IOError('timeout')
+        if post.id in self.failing:
+            raise IOError('404')
+        return [(post.id, 'comment on ' + post.id)] + self.new.get(post.id, [])
+
+
+def test_harvester():
+    """Used to test that the harvester retries and saves every complete sub-reddit"""
+    client = FakeClient()
+    crawler = harvester.Harvester(client, harvester.TokenBucket(1000, 5), workers=3, backoff=0, limit=3)
+    saved = {}
+    assert crawler.harvest(['a', 'b', 'down'], saved.__setitem__) == ['a']
+    assert sorted(saved) == ['a'] and sorted(saved['a']) == ['a0', 'a1', 'a2']
+    assert saved['a']['a0'].comments == ['comment on a0']
+    assert client.calls['a0'] == 2 and client.calls['b1'] == 3 and client.calls['down'] == 3
+    assert sorted((name, sub_id) for name, sub_id, e in crawler.failures) == [('b', 'b1'), ('down', None)]
+
+
+def test_token_bucket():
+    """Used to test that the token bucket waits for tokens"""
+    now = [0.0]
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+    bucket = harvester.TokenBucket(2, 2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        bucket.acquire()
+    assert now[0] == pytest.approx(2.0)
+
+
+def test_incremental_harvest(tmpdir, monkeypatch):
+    """Used to test that incremental harvesting only stores new comments and resumes"""
+    monkeypatch.chdir(tmpdir)
+    tmpdir.mkdir('data')
+    with open('data/sub-reddits.txt', 'wb') as subreddits:
+        subreddits.write('a\nb\n')
+    client = FakeClient()
+    crawler = harvester.Harvester(client, harvester.TokenBucket(1000, 5), backoff=0, limit=2,
+                                  checkpoint=harvester.Checkpoint())
+    crawler.harvest(['a', 'b'])
+    assert harvester.Checkpoint().done == set(['a'])
+    
+    client.failing = ()
+    client.new['a1'] = [('x', 'new comment')]
+    crawler = harvester.Harvester(client, harvester.TokenBucket(1000, 5), backoff=0, limit=2,
+                                  checkpoint=harvester.Checkpoint())
+    calls = dict(client.calls)
+    assert crawler.harvest(['a', 'b']) == ['b']
+    assert client.calls['a1'] == calls['a1'] and client.calls['b0'] == calls['b0']
+    assert harvester.Checkpoint().done == set()
+    
+    crawler.harvest(['a', 'b'])
+    assert client.calls['a1'] == calls['a1'] + 1 and client.calls['a0'] == calls['a0']
+    data = load_data('sub-reddits.txt')
+    assert data['a']['a1'].comments == ['comment on a1', 'new comment']
+    assert data['b']['b1'].comments == ['comment on b1']
+    assert sorted(data['b']) == ['b0', 'b1']
+    store.convert('sub-reddits.txt')
+    assert list(store.open_store('sub-reddits.txt')['a']['a1'].comments) == data['a']['a1'].comments
+
+    os.remove('data/checkpoint.p')
+    crawler = harvester.Harvester(client, harvester.TokenBucket(1000, 5), backoff=0, limit=2,
+                                  checkpoint=harvester.Checkpoint())
+    crawler.harvest(['a', 'b'])
+    assert not os.path.exists(harvester.delta_path('data/', 'a'))
+    assert load_data('sub-reddits.txt')['a']['a1'].comments == ['comment on a1', 'new comment']
+    
+    client.new['a1'].append(('y', 'newer comment'))
+    crawler.harvest(['a', 'b'])
+    harvester.Harvester(client, harvester.TokenBucket(1000, 5), backoff=0, limit=2).harvest(['a'])
+    assert not os.path.exists(harvester.delta_path('data/', 'a'))
+    assert 'a' not in harvester.Checkpoint().sizes and 'b' in harvester.Checkpoint().sizes
+    assert load_data('sub-reddits.txt')['a']['a1'].comments == ['comment on a1', 'new comment', 
+                                                                'newer comment']
+
+
+def test_submission():
+    """Used to test the compact Submission and loading old pickles"""
+    sub = Submission('url', 'title', 'text', [u'caf\xe9', '', 'last'])
+    assert len(sub.comments) == 3 and sub.comments[0] == u'caf\xe9' and sub.comments[-1] == 'last'
+    assert sub.comments == [u'caf\xe9', '', 'last'] and sub.comments[1:] == ['', 'last']
+    assert Submission('', '', '', ['a', 'b']).comments != 'ab'
+    assert list(pickle.loads(pickle.dumps(sub, 2)).comments) == list(sub.comments)
+    assert pickle.loads(pickle.dumps(sub)).title == 'title'
+    assert Submission().comments == [] and not hasattr(sub, '__dict__')
+    
+    old = Submission.__new__(Submission)
+    old.__setstate__({'url': 'url', 'title': 'title', 'text': 'text', 'comments': ['a', 'b']})
+    assert old.comments == ['a', 'b'] and old.url == 'url'
+    old.comments = old.comments + ['c']
+    assert list(old.comments) == ['a', 'b', 'c']
+
+
+def test_sentiment_index(tmpdir, monkeypatch):
+    """Used to test that the sentiment index stays consistent with a full recompute"""
+    monkeypatch.chdir(tmpdir)
+    sentiments = {'good': 3, 'bad': -3, 'great': 4, 'ok': 1}
+    data = {'a': {1: Submission('url', 'title', 'text', ['good good', 'ok', 'bad bad bad']),
+                  2: Submission('url', 'title2', 'text', [])},
+            'b': {3: Submission('url', 'title3', 'text', ['great', 'great ok'])}}
+    write_data(data)
+    index = sentindex.load_index('sub-reddits.txt', sentiments)
+    assert index.check(load_data('sub-reddits.txt')) == []
+    
+    def fail(filename):
+        raise AssertionError('data loaded although it did not change')
+    monkeypatch.setattr(sentindex.scraper, 'load_data', fail)
+    assert sentindex.load_index('sub-reddits.txt', sentiments).sentiment() == index.sentiment()
+    monkeypatch.undo()
+    monkeypatch.chdir(tmpdir)
+    
+    data['a'][2].comments = ['great great']
+    data['b'][3].comments = data['b'][3].comments + ['bad bad', 'ok']
+    del data['a'][1]
+    index = sentindex.SentimentIndex(sentiments)
+    index.update(load_data('sub-reddits.txt'))
+    index.update(data)
+    assert index.check(data) == []
+    assert dict(zip(*index.sentiment()[:2]))['b'] == [(4 + 5 - 6) / 3]
+
+    data['b'][4] = Submission('url', 'title4', 'text', ['ok'])
+    index.update(data)
+    data['b'][3].comments = ['bad bad'] + data['b'][3].comments[1:]
+    index.update(data)
+    assert index.check(data) == []
+    assert dict(zip(index.sentiment()[0], index.sentiment()[2]))['b'] == ['title3', 'title4']
+
+
+def test_ngram_store(tmpdir, monkeypatch):
+    """Used to test that the n-gram store gives the same collocations as NLTK finders"""
+    monkeypatch.chdir(tmpdir)
+    random.seed(3)
+    vocabulary = ['the', 'and', 'cat', 'sat', 'mat', 'dog', 'ran', 'far']
+    data = {}
+    for name in ('a', 'b'):
+        data[name] = {}
+        for sub_id in xrange(3):
+            comments = [' '.join(random.choice(vocabulary) for _ in xrange(random.randint(0, 30)))
+                        for _ in xrange(20)]
+            data[name][name + str(sub_id)] = Submission('url', 'title', 'text', comments)
+    write_data(data)
+    
+    store = ngramstore.load_ngrams('sub-reddits.txt', False, False)
+    no_the = lambda w1, w2, w3: 'the' == w3 or 'and' in (w1, w3)
+    for name, sub_id, _ in store.threads:
+        words = fixer(' '.join(data[name][sub_id].comments), False, False).split()
+        bigrams = BigramCollocationFinder.from_words(words)
+        bigrams.apply_freq_filter(4)
+        assert store.top(2, 5, name, sub_id, freq=4) == bigrams.nbest(nltk.collocations.BigramAssocMeasures.raw_freq, 5)
+        trigrams = TrigramCollocationFinder.from_words(words)
+        trigrams.apply_freq_filter(4)
+        trigrams.apply_ngram_filter(no_the)
+        assert (store.top(3, 5, name, sub_id, freq=4, ngram_filter=no_the) 
+                == trigrams.nbest(nltk.collocations.TrigramAssocMeasures.raw_freq, 5))
+    
+    counts = nltk.FreqDist()
+    for sub in data['b'].values():
+        counts.update(ngrams(fixer(' '.join(sub.comments), False, False).split(), 2))
+    assert dict(store.frequent(2, 1, 'b')) == dict(counts)
+    
+    def fail(*args):
+        raise AssertionError('corpus loaded although the data did not change')
+    monkeypatch.setattr(ngramstore.corpus, 'load_corpus', fail)
+    loaded = ngramstore.load_ngrams('sub-reddits.txt', False, False)
+    assert loaded.threads == store.threads
+    assert loaded.top(2, 10, 'a') == store.top(2, 10, 'a')
+    monkeypatch.undo()
+    monkeypatch.chdir(tmpdir)
+    
+    # 8 ** 22 keys do not fit in 63 bits
+    wide = ngramstore.load_ngrams('sub-reddits.txt', False, False, orders=(22,))
+    assert wide.orders == (2, 3, 22) and 22 in wide.grams
+    counts = nltk.FreqDist()
+    for sub in data['b'].values():
+        counts.update(ngrams(fixer(' '.join(sub.comments), False, False).split(), 22))
+    assert dict(wide.frequent(22, 1, 'b')) == dict(counts)
+    assert wide.top(2, 10, 'a') == store.top(2, 10, 'a')
+    monkeypatch.setattr(ngramstore.corpus, 'load_corpus', fail)
+    assert ngramstore.load_ngrams('sub-reddits.txt', False, False, orders=(3, 22)).frequent(22, 1, 'b') \
+        == wide.frequent(22, 1, 'b')
+
+
+def test_unknown_stats(tmpdir, monkeypatch):
+    """Used to test that the unknown word statistics match the old lists of UnknownWords"""
+    monkeypatch.chdir(tmpdir)
+    os.mkdir('data')
+    sentiments = {'good': 3, 'bad': -3, 'great': 10}
+    monkeypatch.setattr(scraper, 'load_sent', lambda stem: sentiments)
+    comments = ['good cat good', 'bad dog', 'great cat dog great', 'cat'] * 40
+    data = {'a': {1: Submission('url', 'title', 'text', comments)},
+            'b': {2: Submission('url', 'title2', 'text', comments[:8])}}
+    get_unknownwords('data/unknown', False, data)
+    
+    legacy = defaultdict(list)
+    for name, sub in (('a', data['a'][1]), ('b', data['b'][2])):
+        for words in (fixer(comment, True, False).split() for comment in sub.comments):
+            value = sum(sentiments.get(word, 0) for word in words)
+            for word in words:
+                if word not in sentiments:
+                    legacy[word].append(UnknownWord(name, value, value / len(words)))
+    with open('data/legacy.p', 'wb') as out:
+        pickle.dump(legacy, out)
+    
+    stats = unknownstats.load_unknown('data/unknown')
+    assert unknownsent('unknown') == unknownsent('legacy') == [('cat', 26.0 / 3)]
+    assert stats.subreddits('dog') == {'a': 80, 'b': 4}
+    assert (sorted(stats.frequent(1, 0)) 
+            == sorted(unknownstats.load_unknown('data/legacy').frequent(1, 0)))
+    
+    tokenized = TokenizedCorpus.build(data, True, False)
+    merged = parallel.get_unknownwords(tokenized, sentiments, workers=2, chunksize=1)
+    assert sorted(merged.frequent(1, 0)) == sorted(stats.frequent(1, 0))
+
+
+def test_cloudfarm(tmpdir):
+    """Used to test that word clouds are rendered once per change"""
+    words = 'the cat sat on the mat and the dog sat on the cat'.split() * 3
+    index = stream.BigramIndex.from_finder(BigramCollocationFinder.from_words(words))
+    jobs = cloudfarm.cloud_jobs(index, [('cat', 6), ('dog', -7), ('missing', 8)])
+    assert [job[0] for job in jobs] == ['cat', 'dog']
+    assert max(score for _, score in jobs[0][2]) == 1
+    
+    directory = str(tmpdir.join('plots'))
+    assert sorted(word for word, _ in cloudfarm.render_all(jobs, directory, workers=2)) == ['cat', 'dog']
+    assert os.path.exists(cloudfarm.image_path(directory, 'dog'))
+    assert cloudfarm.render_all(jobs, directory, workers=2) == []
+    jobs[1] = ('dog', 7, jobs[1][2])
+    assert [word for word, _ in cloudfarm.render_all(jobs, directory, workers=1)] == ['dog']
+    
+    jobs = [('cat', -3, jobs[0][2]), ('dog', 3, None)]
+    with pytest.raises(Exception):
+        cloudfarm.render_all(jobs, directory, workers=1)
+    assert cloudfarm.render_all(jobs[:1], directory, workers=1) == []
+
+
+def test_report(tmpdir, monkeypatch):
+    """Used to test that the batch report writes every plot without a display"""
+    monkeypatch.chdir(tmpdir)
+    sentiments = {'good': 3, 'bad': -3, 'great': 4, 'awful': -4}
+    monkeypatch.setattr(scraper, 'load_sent', lambda: sentiments)
+    comments = ['good great day', 'bad awful day', 'great great great', 'awful bad bad news', 'ok']
+    write_data(dict((name, dict((i, Submission('url', 'title %d' % i, 'text', comments[i + j:]))
+                                for i in range(2)))
+                    for j, name in enumerate('abc')))
+    paths = report('reports/', workers=2)
+    assert len(paths) == 7
+    assert all(os.path.getsize(path) > 0 for path in paths)
+    
+    sent = (['a', 'b'], [[1.0, 2.0], [3.0]], [['x', 'y'], ['z']])
+    lexical = (['b', 'a'], [[0.3], [0.2, 0.1]], [['z'], ['y', 'x']])
+    table = results.ResultTable.from_analysis(sent, [[1, 2], [3]], 'sentiment')
+    table.add(lexical, [[3], [2, 1]], 'lexical_diversity')
+    plots = dict((name, args) for name, _, args in report_plots(sent, lexical, sent, table))
+    assert plots['sent_lex'] == (['a', 'b'], [[1.0, 2.0], [3.0]], [[0.1, 0.2], [0.3]])
+
+
+def test_plot_math(tmpdir):
+    """Used to test the vectorized plot math and plots of any number of sub-reddits"""
+    assert [grid(n) for n in (1, 3, 5, 7, 10, 12)] == [(1, 1), (1, 3), (1, 5), (2, 5), (2, 5), (3, 5)]
+    assert normalize([2, 4, 3]).tolist() == [0, 1, 0.5]
+    assert normalize([3, 3]).tolist() == [0, 0]
+    assert means([[1, 2], [4], []]).tolist() == [1.5, 4, 0]
+    
+    freq_dist = nltk.FreqDist('the cat sat on the mat with the other cat'.split())
+    freq_values = sorted(freq_dist.values(), reverse=True)
+    cum_dist = [sum(freq_values[:i + 1]) / float(sum(freq_values)) for i in range(len(freq_values))]
+    ranks, shares = cumulative_distribution(freq_dist)
+    assert ranks.tolist() == range(len(cum_dist)) and np.allclose(shares, cum_dist)
+    ranks, shares = cumulative_distribution(freq_dist, 3)
+    assert ranks.tolist() == [0, 3, 6] and np.allclose(shares, [cum_dist[i] for i in (0, 3, 6)])
+    
+    names = ['sub%d' % i for i in range(12)]
+    scores = [[i, i + 1, 2 * i] for i in range(12)]
+    plots = [('freqs', 'plot_bar_compare_freqs', (names, [freq_dist] * 12)),
+             ('compare', 'plot_bar_compare', (names, scores, scores[::-1])),
+             ('posts', 'plot_bar', (names[:3], scores[:3]))]
+    assert len(render_plots(plots, str(tmpdir), workers=1)) == 3
+
+
+def test_lexicon(tmpdir, monkeypatch):
+    """Used to test that lexicons are compiled once, with stemmed and multi-word entries"""
+    monkeypatch.chdir(tmpdir)
+    os.mkdir('AFINN')
+    with open('AFINN/AFINN-111.txt', 'wb') as afinn:
+        afinn.write('abandon\t-2\nabandoned\t-2\nloved\t3\nloving\t2\n'
+                    'does not work\t-3\ngood\t3\n')
+    sentiments = load_sent()
+    assert sentiments == {'abandon': -2, 'abandoned': -2, 'loved': 3, 'loving': 2, 'good': 3}
+    assert sentiments.phrase_words() == {('does', 'not', 'work'): -3}
+    stemmed = load_sent(stem=True)
+    assert stemmed == {'abandon': -2, 'love': 3, 'good': 3}
+    assert stemmed.phrase_words() == {('doe', 'not', 'work'): -3}
+    assert os.path.exists(lexicon.compiled_path('AFINN/AFINN-111.txt', True))
+    
+    def fail(lines):
+        raise AssertionError('lexicon parsed although it did not change')
+    monkeypatch.setitem(lexicon.LEXICONS, 'afinn', ('AFINN/AFINN-111.txt', fail))
+    assert load_sent(stem=True) == stemmed
+    assert load_sent(stem=True).phrases == stemmed.phrases
+    
+    with open('other.txt', 'wb') as other:
+        other.write('great,4\nawful,-4\n')
+    lexicon.register_lexicon('other', 'other.txt', 
+                             lambda lines: ((w, int(v)) for w, v in (l.split(',') for l in lines)))
+    assert load_sent(name='other') == {'great': 4, 'awful': -4}
+
+
+def test_phrases():
+    """Used to test multi-word and negation scoring against a brute force search"""
+    random.seed(11)
+    entries = dict((tuple(random.randint(0, 3) for _ in range(random.randint(1, 3))), random.randint(-5, 5))
+                   for _ in range(15))
+    matcher = phrases.PhraseMatcher(entries)
+    for _ in range(50):
+        ids = [random.choice([-1, 0, 1, 2, 3]) for _ in range(20)]
+        expected = []
+        for end in range(1, len(ids) + 1):
+            found = [(end - n, end, entries[tuple(ids[end - n:end])]) for n in (3, 2, 1)
+                     if n <= end and tuple(ids[end - n:end]) in entries]
+            expected += found[:1]
+        assert list(matcher.matches(ids)) == expected
+    
+    lex = lexicon.Lexicon.build([('good', 3), ('fun', 4), ('does not work', -3), ('no fun', -3)])
+    scorer = phrases.PhraseScorer(lex)
+    scores = dict((comment, scorer.comment_score(scorer.encode(comment.split())))
+                  for comment in ['good', 'not very good', 'it does not work', 'no fun', 
+                                  "don't think it is good", 'does not work but good'])
+    assert scores == {'good': 3, 'not very good': -3, 'it does not work': -3, 'no fun': -3,
+                      "don't think it is good": 3, 'does not work but good': 0}
+    
+    sentiments = {'good': 3, 'bad': -3, 'love': 3, 'great': 3}
+    comments = ['good good bad', 'love it', 'great great day', 'bad', 'what a good day']
+    data = {'a': {1: Submission('url', 'title', 'text', comments)},
+            'b': {2: Submission('url', 'title2', 'text', comments[::-1][:3])}}
+    assert sentiment(data, sentiments, phrases=True) == sentiment(data, sentiments)
+    tokenized = TokenizedCorpus.build(data, False, False)
+    assert sentiment(tokenized, sentiments, phrases=True) == sentiment(data, sentiments)
+
+
+def test_sketch():
+    """Used to test the sketches against exact counts, and that merged sketches count all words"""
+    random.seed(12)
+    words = ['w%d' % int(random.paretovariate(1)) for _ in range(20000)]
+    exact = {}
+    for word in words:
+        exact[word] = exact.get(word, 0) + 1
+    
+    halves = [sketch.TopWords(50, eps=0.01, batch=1000) for _ in range(2)]
+    distinct = [sketch.HyperLogLog(10) for _ in range(2)]
+    for i in range(0, len(words), 10):
+        halves[i % 20 // 10].update(words[i:i + 10])
+        distinct[i % 20 // 10].update(words[i:i + 10])
+    top = halves[0].merge(halves[1])
+    assert top.total() == len(words)
+    for word, count in top.most_common(10):
+        assert exact[word] <= count <= exact[word] + 0.01 * len(words)
+    expected = sorted(exact, key=lambda word: -exact[word])[:5]
+    assert [word for word, _ in top.most_common(5)] == expected
+    assert top.summary.most_common(1)[0][1] - top.summary.errors[expected[0]] <= exact[expected[0]]
+    
+    estimate = len(distinct[0].merge(distinct[1]))
+    assert abs(estimate - len(exact)) <= 0.1 * len(exact)
+    
+    comments = ['The cat sat on the mat', 'cat sat', "the cat's mat, sat on the cat!", 'mat']
+    data = {'a': {1: Submission('url', 'title', 'text', comments),
+                  2: Submission('url', 'title2', 'text', comments[::-1])}}
+    assert most_frequent_words(data, sketch=True) == most_frequent_words(data)
+    assert lexical_diversity(data, sketch=True) == lexical_diversity(data)
+
+
+def test_zipf_corpus(tmpdir, monkeypatch):
+    """Used to test that the synthetic corpus is deterministic and loads like scraped data"""
+    monkeypatch.chdir(tmpdir)
+    data = benchmark.zipf_corpus(2, 3, 40, 8, 500, seed=1)
+    assert [len(sub.comments) for posts in data.values() for sub in posts.values()] == [40] * 6
+    again = benchmark.zipf_corpus(2, 3, 40, 8, 500, seed=1)
+    assert [sub.comments for sub in data['sub1'].values()] == [sub.comments for sub in again['sub1'].values()]
+    words = [word for comment in data['sub0']['p0_0'].comments for word in fixer(comment, False, False).split()]
+    assert set(words) - set(['ok']) <= set(benchmark.synthetic_vocabulary(500))
+    
+    benchmark.write_data(data)
+    benchmark.write_lexicon(500)
+    loaded = load_data('sub-reddits.txt')
+    assert sorted(loaded) == sorted(data)
+    assert loaded['sub0']['p0_2'].comments == data['sub0']['p0_2'].comments
+    assert load_sent()['good'] == 3
+
+
+def test_instrument(tmpdir):
+    """Used to test that stages are timed and counted per sub-reddit and submission"""
+    comments = ['The cat sat on the mat', 'cat sat', 'mat']
+    data = {'a': {1: Submission('url', 'title', 'text', comments),
+                  2: Submission('url', 'title2', 'text', comments[:1])},
+            'b': {3: Submission('url', 'title3', 'text', comments[1:])}}
+    assert instrument.stage('score') is instrument.NO_STAGE
+    expected = lexical_diversity(data)
+    
+    with instrument.capture(str(tmpdir), profile=False) as recorder:
+        assert lexical_diversity(data) == expected
+    assert not instrument.enabled()
+    totals = dict((row['stage'], row) for row in recorder.rows())
+    assert totals['normalize']['comments'] == totals['aggregate']['comments'] == 6
+    assert totals['normalize']['tokens'] == 12
+    assert totals['aggregate']['calls'] == 3
+    assert totals['aggregate']['seconds'] >= totals['aggregate']['self_seconds']
+    subs = dict((row['submission'], row['comments']) for row in recorder.rows('submission')
+                if row['stage'] == 'aggregate')
+    assert subs == {1: 3, 2: 1, 3: 2}
+    assert [row['subreddit'] for row in recorder.rows('subreddit')] == ['a', 'b', 'a', 'b']
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['stages.csv', 'stages.json']
+
+
+def test_pipeline(tmpdir, monkeypatch):
+    """Used to test that the pipeline reruns only the stages whose inputs changed"""
+    monkeypatch.chdir(tmpdir)
+    data = benchmark.zipf_corpus(2, 3, 30, 10, 300)
+    benchmark.write_data(data)
+    benchmark.write_lexicon(300)
+    runner = pipeline.Pipeline({'min_count': 5})
+    assert sorted(runner.run(['lexical', 'unknown'], verbose=False)) == [
+        'lexical', 'stemmed_words', 'unknown', 'unknown_stats', 'words']
+    assert runner.value('lexical') == lexical_diversity(data)
+    
+    assert pipeline.Pipeline({'min_count': 5}).run(['lexical', 'unknown'], verbose=False) == {}
+    runner = pipeline.Pipeline({'min_count': 1})
+    assert runner.plan(['lexical', 'unknown']) == ['unknown']
+    assert runner.run(['unknown'], verbose=False).keys() == ['unknown']
+    assert pipeline.Pipeline({'min_count': 1, 'stem': True}).plan(['lexical', 'unknown']) == [
+        'stemmed_words', 'unknown_stats', 'unknown']
+    
+    benchmark.write_data(benchmark.zipf_corpus(2, 3, 30, 10, 300, seed=1))
+    assert 'words' in pipeline.Pipeline({'min_count': 1}).plan(['lexical'])
+    
+    nodes = dict((node.name, node) for node in pipeline.NODES)
+    assert 'plots' not in nodes['clouds'].params and 'clouds' not in nodes['plots'].params
+    assert pipeline.PARAMS['clouds'] != pipeline.PARAMS['plots']
+
+
+def test_results(tmpdir):
+    """Used to test the result table against the nested lists of the analyses"""
+    comments = ['The cat sat on the mat', 'cat sat', 'good mat', 'bad cat sat']
+    data = {'a': {1: Submission('url', 'title', 'text', comments),
+                  2: Submission('url', 'title2', 'text', comments[:2]),
+                  3: Submission('url', u'title\xe93', 'text', comments[2:])},
+            'b': {4: Submission('url', 'title4', 'text', comments[1:])}}
+    sent = sentiment(data, {'good': 3, 'bad': -3, 'cat': 1})
+    lexical = lexical_diversity(data)
+    table = results.ResultTable.from_analysis(sent, results.submission_ids(data, sent[0]), 'sentiment')
+    shuffled = [list(reversed(part)) for part in lexical]
+    table.add(shuffled, results.submission_ids(data, shuffled[0]), 'lexical_diversity')
+    assert table.nested('sentiment') == sent
+    assert table.nested('lexical_diversity')[1] == lexical[1]
+    
+    assert np.allclose(table.reduce('lexical_diversity'), means(lexical[1]))
+    assert table.reduce('sentiment', 'count').tolist() == [3, 1]
+    scores = lexical[1][0]
+    assert np.allclose(table.reduce('lexical_diversity', 'std')[:1], np.std(scores))
+    assert table.reduce('lexical_diversity', 'min')[0] == min(scores)
+    assert table.reduce('lexical_diversity', 'max')[0] == max(scores)
+    
+    table.metrics['lexical_diversity'][0] = np.nan
+    assert table.reduce('lexical_diversity', 'count').tolist() == [2, 1]
+    path = str(tmpdir.join('results.npz'))
+    table.save(path)
+    loaded = results.load_results(path)
+    assert loaded.nested('sentiment') == table.nested('sentiment')
+    assert loaded.submissions.tolist() == table.submissions.tolist()
+    assert np.isnan(loaded.metrics['lexical_diversity'][0])
+
+
+def test_lazy():
+    """Used to test that the analysis imports without the heavy packages"""
+    for module in ('analyser', 'scraper', 'visualizer', 'pipeline'):
+        assert benchmark.import_time(module)[1] == []
+    pyplot = lazy.LazyModule('matplotlib.pyplot', 'plotting')
+    assert pyplot.figure is plt.figure
+    missing = lazy.LazyModule('no_such_package.sub', 'testing')
+    with pytest.raises(ImportError) as error:
+        missing.anything
+    assert 'testing needs the no_such_package package' in str(error.value)
+
+
+def test_sqlstore(tmpdir, monkeypatch):
+    """Used to test that the SQLite store gives the same data and sentiment"""
+    monkeypatch.chdir(tmpdir)
+    comments = ['I love this, great', 'bad bad awful', 'ok']
+    write_data({'a': {1: Submission('url', 'title', 'text', [u'caf\xe9 au lait', '', 'the cat sat']),
+                      'x': Submission('url2', 'title2', 'text2', [])},
+                'b': {3: Submission('url3', 'title3', 'text3', comments)}})
+    database = sqlstore.migrate('sub-reddits.txt', verbose=False)
+    database.insert('a', load_data_sub('a'))
+    database.close()
+    data = load_data('sub-reddits.txt')
+    database = sqlstore.open_database('sub-reddits.txt')
+    assert database.keys() == ['a', 'b']
+    for name, posts in data.items():
+        assert sorted(database[name].keys()) == sorted(posts.keys())
+        for sub_id, sub in posts.items():
+            assert database[name][sub_id].title == sub.title
+            assert database[name][sub_id].comments == sub.comments
+    assert database.search('cat') == [('a', 1, 'the cat sat')]
+    assert database.search('bad', subreddit='a') == []
+    assert [row[2] for row in database.search('caf*')] == [u'caf\xe9 au lait']
+
+    sentiments = {'love': 3, 'great': 3, 'bad': -3, 'awful': -3}
+    database.add_scores(sentiments)
+    names, scores_all, _ = sentiment(data, sentiments)
+    expected = dict(((name, sub_id), score) for name, scores in zip(names, scores_all)
+                    for sub_id, score in zip(data[name].keys(), scores))
+    assert dict(((name, sub_id), score) for name, sub_id, _, score
+                in database.thread_sentiment()) == expected
+    assert [row[:2] for row in database.thread_sentiment(below=0)] == [('b', 3)]
+    database.close()
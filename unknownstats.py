@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+""" Contains the running statistics of words without sentiment valence. """
+
+from __future__ import division
+from array import array
+import cPickle as pickle
+import os
+
+import lazy as lazy
+
+np = lazy.LazyModule('numpy')
+
+
+class UnknownStats(object):
+
+    """
+    Words without sentiment valence.
+
+    Keeps, for every word, the number of times it was seen, the sum of the
+    values and of the per-word averages of the comments it was seen in, see
+    scraper.UnknownWord, and the number of times it was seen per sub-reddit.
+    Nothing is kept per occurrence.
+    """
+
+    def __init__(self):
+        """
+        Create a new empty summary.
+
+        words = list of words, the position of a word is its ID
+
+        names = list of sub-reddit names, the position of a name is its ID
+
+        count, value, average = arrays indexed by word ID
+
+        histogram = list with an array of counts by word ID for each sub-reddit
+        """
+        self.words = []
+        self.ids = {}
+        self.names = []
+        self.count = array('l')
+        self.value = array('d')
+        self.average = array('d')
+        self.histogram = []
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.ids
+
+    def word_id(self, word):
+        """Return the ID of a word, adding it if it is new."""
+        try:
+            return self.ids[word]
+        except KeyError:
+            self.ids[word] = len(self.words)
+            self.words.append(word)
+            self.count.append(0)
+            self.value.append(0.0)
+            self.average.append(0.0)
+            for counts in self.histogram:
+                counts.append(0)
+            return self.ids[word]
+
+    def sub_counts(self, name):
+        """Return the array of counts by word ID of a sub-reddit, adding it if it is new."""
+        if name not in self.names:
+            self.names.append(name)
+            self.histogram.append(array('l', [0]) * len(self.words))
+        return self.histogram[self.names.index(name)]
+
+    def add(self, name, words, value, average):
+        """
+        Count the unknown words of a comment.
+
+        -> name: name of the sub-reddit
+        -> words: the words without valence, once for every time they were seen
+        -> value, average: sentiment value and value per word of the comment
+        """
+        counts = self.sub_counts(name)
+        for word in words:
+            i = self.ids.get(word)
+            if i is None:
+                i = self.word_id(word)
+            self.count[i] += 1
+            self.value[i] += value
+            self.average[i] += average
+            counts[i] += 1
+
+    def add_totals(self, name, word, count, value, average):
+        """Add the summed statistics of a word seen count times in a sub-reddit."""
+        counts = self.sub_counts(name)
+        i = self.word_id(word)
+        self.count[i] += count
+        self.value[i] += value
+        self.average[i] += average
+        counts[i] += count
+
+    @classmethod
+    def from_legacy(cls, unknowndict):
+        """Summarize a dictionary of lists of scraper.UnknownWord, as pickled before."""
+        stats = cls()
+        for word, points in unknowndict.items():
+            for point in points:
+                # UnknownWord stores the sub-reddit in a 1-tuple
+                stats.add_totals(point.sub[0], word, 1, point.value, point.average)
+        return stats
+
+    def mean_values(self):
+        """Return the arrays of counts and mean comment values by word ID."""
+        count = np.array(self.count, np.int64)
+        return count, np.array(self.value) / np.maximum(count, 1)
+
+    def frequent(self, min_count=100, min_value=5):
+        """
+        Extended sentiment analysis.
+
+        Return (word, mean value) for the words seen more than min_count times
+        with an absolute mean value greater than min_value, as analyser.unknownsent
+        """
+        count, mean = self.mean_values()
+        keep = np.flatnonzero((count > min_count) & (np.abs(mean) > min_value))
+        return [(self.words[i], float(mean[i])) for i in keep]
+
+    def subreddits(self, word):
+        """Return a dictionary of the number of times a word was seen per sub-reddit."""
+        i = self.ids[word]
+        return dict((name, counts[i]) for name, counts in zip(self.names, self.histogram)
+                    if counts[i])
+
+    def save(self, path):
+        """Write the summary to a .npz file."""
+        meta = np.empty(1, dtype=object)
+        meta[0] = (self.words, self.names)
+        np.savez(path, meta=meta, count=np.array(self.count, np.int64),
+                 value=np.array(self.value), average=np.array(self.average),
+                 histogram=np.array(self.histogram, np.int64).reshape(len(self.names),
+                                                                      len(self.words)))
+
+    @classmethod
+    def load(cls, path):
+        """Read a summary written by save."""
+        stats = cls()
+        with np.load(path, allow_pickle=True) as arrays:
+            stats.words, stats.names = arrays['meta'][0]
+            stats.count = array('l', arrays['count'].tolist())
+            stats.value = array('d', arrays['value'].tolist())
+            stats.average = array('d', arrays['average'].tolist())
+            stats.histogram = [array('l', counts.tolist()) for counts in arrays['histogram']]
+        stats.ids = dict((word, i) for i, word in enumerate(stats.words))
+        return stats
+
+
+def load_unknown(path):
+    """
+    Load the unknown words written by analyser.get_unknownwords.
+
+    -> path: path without extension, path.npz is read if it exists,
+    otherwise the old pickle path.p of lists of scraper.UnknownWord
+    """
+    if os.path.exists(path + '.npz'):
+        return UnknownStats.load(path + '.npz')
+    with open(path + '.p', 'rb') as legacy:
+        return UnknownStats.from_legacy(pickle.load(legacy))
@@ -2,11 +2,21 @@
 """ Contains functions for visualizing data. """
 
 from __future__ import division
-import matplotlib.pyplot as plt
-import numpy as np
+import multiprocessing
+import os
+import sys
+import time
 
 import analyser as anl
+import corpus as corpus
+import results as results
+import instrument as instrument
+import lazy as lazy
 import scraper as scraper
+import sentindex as sentindex
+
+np = lazy.LazyModule('numpy')
+plt = lazy.LazyModule('matplotlib.pyplot', 'plotting')
 
 
 def analyse_lexical():
@@ -16,7 +26,7 @@ def analyse_lexical():
     Loads data, retrieves lexical diversity scores and plots them
     """
     try:
-        subreddit = scraper.load_data('sub-reddits.txt')
+        subreddit = corpus.load_corpus('sub-reddits.txt', True, False)
     except IOError as e:
         print e
         return
@@ -29,21 +39,21 @@ def analyse_sentiment():
     """
     Runner script.
     
-    Loads data, retrieves sentiment scores and plots them
+    Loads the sentiment index, updating it if the data has changed, and plots the scores
     """
     try:
-        subreddit = scraper.load_data('sub-reddits.txt')
+        sentiments = scraper.load_sent()
     except IOError as e:
         print e
         return
         
     try:
-        sentiments = scraper.load_sent()
+        index = sentindex.load_index('sub-reddits.txt', sentiments)
     except IOError as e:
         print e
         return
     
-    names, scores, titles = anl.sentiment(subreddit, sentiments)
+    names, scores, titles = index.sentiment()
     
     plot_bar_avg(names, scores)
     plot_bar(names, scores)
@@ -56,7 +66,7 @@ def compare_freqs():
     Loads data, retrieves word frequency distributions and plots them
     """
     try:
-        subreddit = scraper.load_data('sub-reddits.txt')
+        subreddit = corpus.load_corpus('sub-reddits.txt', True, False)
     except IOError as e:
         print e
         return
@@ -72,23 +82,219 @@ def compare_sent_lex():
     Loads data, retrieves sentiment and lexical scores and plots them
     """
     try:
-        subreddit = scraper.load_data('sub-reddits.txt')
+        sentiments = scraper.load_sent()
     except IOError as e:
         print e
         return
         
     try:
-        sentiments = scraper.load_sent()
+        index = sentindex.load_index('sub-reddits.txt', sentiments)
+        subreddit = corpus.load_corpus('sub-reddits.txt', True, False)
     except IOError as e:
         print e
         return
     
-    names, scores1, titles = anl.sentiment(subreddit, sentiments)
-    _, scores2, _ = anl.lexical_diversity(subreddit)
+    names, scores1, titles = index.sentiment()
+    lex_names, lex_scores, _ = anl.lexical_diversity(subreddit)
+    lex_scores = dict(zip(lex_names, lex_scores))
+    scores2 = [lex_scores[name] for name in names]
     
     plot_bar_compare_avg(names, scores1, scores2)
 
-def plot_bar_compare_freqs(names, freq_dists):  
+
+def report(directory='reports/', workers=None, stats=None):
+    """
+    Runner script.
+    
+    Loads the data and the sentiment index once, runs every analysis of the 
+    runner scripts and writes all of their plots to PNG files without a display. 
+    The plots are drawn in a process pool, the time of each stage is printed. 
+    The sentiment and lexical diversity scores are saved to results.npz, 
+    see results.ResultTable
+    
+    -> directory: where the plots are written
+    -> workers: number of processes, the number of CPUs if None
+    -> stats: directory to write the time of every stage and a profile of 
+    the run to, see instrument.capture
+    
+    <- list of the paths of the plots
+    """
+    if stats:
+        with instrument.capture(stats) as recorder:
+            paths = report(directory, workers)
+        recorder.summary()
+        return paths
+    
+    start = time.time()
+    try:
+        sentiments = scraper.load_sent()
+        index = sentindex.load_index('sub-reddits.txt', sentiments)
+        subreddit = corpus.load_corpus('sub-reddits.txt', True, False)
+    except IOError as e:
+        print e
+        return []
+    print 'load: %.2f s' % (time.time() - start)
+    
+    start = time.time()
+    sent = index.sentiment()
+    lexical = anl.lexical_diversity(subreddit)
+    freqs = anl.most_frequent_words(subreddit)
+    print 'analyse: %.2f s' % (time.time() - start)
+    
+    table = results.ResultTable.from_analysis(sent, results.submission_ids(index.threads, sent[0]),
+                                              'sentiment')
+    table.add(lexical, results.submission_ids(subreddit, lexical[0]), 'lexical_diversity')
+    plots = report_plots(sent, lexical, freqs, table)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    table.save(os.path.join(directory, 'results.npz'))
+    
+    start = time.time()
+    with instrument.stage('render'):
+        paths = render_plots(plots, directory, workers)
+    print 'render: %.2f s' % (time.time() - start)
+    return paths
+
+
+def analyse_results(path='reports/results.npz'):
+    """
+    Runner script.
+    
+    Plots the sentiment and lexical diversity scores saved by report, 
+    without loading the data or analysing it again
+    """
+    try:
+        table = results.load_results(path)
+    except IOError as e:
+        print e
+        return
+    
+    names, scores, _ = table.nested('sentiment')
+    lex_names, lex_scores, _ = table.nested('lexical_diversity')
+    plot_bar_avg(names, scores)
+    plot_bar_compare(names, scores, lex_scores)
+
+
+def report_plots(sent, lexical, freqs, table):
+    """
+    Return the plots of report, see render_plots.
+    
+    -> sent, lexical, freqs: results of the sentiment, lexical diversity 
+    and word frequency analyses, (names, scores or freq_dists, titles)
+    -> table: results.ResultTable of the sentiment with the lexical diversity 
+    added, which pairs the scores of each submission for the comparisons
+    """
+    names, sent_scores, _ = sent
+    lex_names, lex_scores, _ = lexical
+    freq_names, freq_dists, _ = freqs
+    pair_names, pair_sent, _ = table.nested('sentiment')
+    _, pair_lex, _ = table.nested('lexical_diversity')
+    return [('lexical_avg', 'plot_bar_avg', (lex_names, lex_scores)),
+            ('lexical', 'plot_bar', (lex_names, lex_scores)),
+            ('sentiment_avg', 'plot_bar_avg', (names, sent_scores)),
+            ('sentiment', 'plot_bar', (names, sent_scores)),
+            ('freqs', 'plot_bar_compare_freqs', (freq_names, freq_dists)),
+            ('sent_lex_avg', 'plot_bar_compare_avg', (pair_names, pair_sent, pair_lex)),
+            ('sent_lex', 'plot_bar_compare', (pair_names, pair_sent, pair_lex))]
+
+
+def render_plots(plots, directory, workers=None):
+    """
+    Write plots to PNG files in a process pool, using the Agg backend.
+    
+    -> plots: list of (file name without extension, name of a plot function, arguments)
+    -> directory: where the plots are written
+    -> workers: number of processes, the number of CPUs if None, 1 draws in this process
+    
+    <- list of the paths of the plots
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    tasks = [(plot, args, os.path.join(directory, name + '.png')) for name, plot, args in plots]
+    if workers == 1:
+        return map(_plot_task, tasks)
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_plot_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _plot_task(args):
+    plot, plot_args, path = args
+    plt.switch_backend('Agg')
+    globals()[plot](*plot_args, path=path)
+    return path
+
+
+def show(path=None):
+    """Show the current figure, or write it to path and close it if path is given."""
+    if path is None:
+        plt.show()
+    else:
+        with instrument.stage('render'):
+            plt.savefig(path, bbox_inches='tight')
+        plt.close('all')
+
+
+def grid(count, max_cols=5):
+    """Return (nrows, ncols) of a grid with room for count plots, at most max_cols wide."""
+    ncols = max(min(count, max_cols), 1)
+    return max(-(-count // ncols), 1), ncols
+
+
+def subplot_grid(count, max_cols=5, **kwargs):
+    """
+    Create a figure with a grid of count plots, see grid.
+    
+    <- (figure, list of count axes), unused axes of the last row are hidden
+    """
+    nrows, ncols = grid(count, max_cols)
+    fig, ax = plt.subplots(nrows=nrows, ncols=ncols, squeeze=False, **kwargs)
+    ax_list = ax.ravel().tolist()
+    for unused in ax_list[count:]:
+        unused.axis('off')
+    return fig, ax_list[:count]
+
+
+def means(scores):
+    """Return an array of the mean of each list of scores, which may differ in length."""
+    return np.array([np.mean(subscores) if len(subscores) else 0.0 for subscores in scores])
+
+
+def normalize(values):
+    """Min-max normalize values to [0, 1], all zeros if they are all equal."""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values
+    minimum = values.min()
+    spread = values.max() - minimum
+    return (values - minimum) / spread if spread else np.zeros_like(values)
+
+
+def cumulative_distribution(freq_dist, points=None):
+    """
+    Cummulative distribution.
+    
+    Return (ranks, shares) where shares[i] is the share of all words taken 
+    by the ranks[i] + 1 most frequent words
+    
+    -> freq_dist: a frequency distribution
+    -> points: at most this many points are returned, evenly spaced by rank 
+    and always including the last one, all points if None
+    """
+    freq_values = np.sort(np.fromiter(freq_dist.values(), np.float64, len(freq_dist)))[::-1]
+    cum_dist = np.cumsum(freq_values)
+    if len(cum_dist):
+        cum_dist /= cum_dist[-1]
+    ranks = np.arange(len(cum_dist))
+    if points is not None and len(cum_dist) > points:
+        ranks = np.unique(np.linspace(0, len(cum_dist) - 1, max(points, 2)).astype(np.int64))
+    return ranks, cum_dist[ranks]
+
+
+def plot_bar_compare_freqs(names, freq_dists, path=None, downsample=True):  
     """
     Cummulative distribution.
     
@@ -96,37 +302,22 @@ def plot_bar_compare_freqs(names, freq_dists):
     
     -> name: Names of sub-reddits
     -> freq_dists: A list of frequency distributions
+    -> path: write the plot to this file instead of showing it
+    -> downsample: plot about one point per pixel of each plot instead of every word
     """
-    fig, ax = plt.subplots(nrows=2, ncols=5)
-    
-    ax_list = ax.tolist()
-    ax_list = [item for sublist in ax_list for item in sublist]
+    fig, ax_list = subplot_grid(len(names), 5)
     
-#    width = 0.35
     for freq_dist, name, ax in zip(freq_dists, names, ax_list):
-        freq_values = sorted(freq_dist.values(), reverse=True)
-        nr_of_words = sum(freq_dist.values())
-        
-        percents = [value / nr_of_words for value in freq_values]
-        cum_dist = []
-        s = 0
-        for p in percents:
-            s = s + p
-            cum_dist.append(s)
-#        minimum = min(freq_values)
-        maximum = max(cum_dist)
-#        norm_scores = [(score - minimum) / (maximum - minimum) for score in subscores1]
-#        ax.bar(np.arange(len(freq_values)), freq_values, width, color='black')
-        ax.plot(np.arange(len(cum_dist)), cum_dist)
+        points = int(ax.get_window_extent().width) if downsample else None
+        ranks, cum_dist = cumulative_distribution(freq_dist, points)
+        ax.plot(ranks, cum_dist)
         ax.set_title(name)
-#        print cum_dist
-#        ax.set_xlim(-2 * width, len(freq_values)+2*width)
-        ax.set_ylim(0, maximum)
+        ax.set_ylim(0, cum_dist.max() if len(cum_dist) else 1)
     
-    plt.show()
+    show(path)
 
 
-def plot_bar_compare_avg(names, scores1, scores2):
+def plot_bar_compare_avg(names, scores1, scores2, path=None):
     """
     Bar graph.
 
@@ -136,21 +327,15 @@ def plot_bar_compare_avg(names, scores1, scores2):
     -> name: Names of sub-reddits
     -> scores1: Nested lists containing data for each post for each sub-reddit
     -> scores2: Nested lists containing data for each post for each sub-reddit
+    -> path: write the plot to this file instead of showing it
     """   
-    averages1 = np.average(scores1, axis=1)
-    averages2 = np.average(scores2, axis=1)
-    
-    minimum = min(averages1)
-    maximum = max(averages1)
-    norm_averages1 = [(score - minimum) / (maximum - minimum) for score in averages1]
-    minimum = min(averages2)
-    maximum = max(averages2)
-    norm_averages2 = [(score - minimum) / (maximum - minimum) for score in averages2]
+    norm_averages1 = normalize(means(scores1))
+    norm_averages2 = normalize(means(scores2))
     width = 0.35
-    indent = np.arange(len(averages1))
+    indent = np.arange(len(norm_averages1))
     ax = plt.axes()
-    rects1 = ax.bar(np.arange(len(scores1)), norm_averages1, width, color='black')
-    rects2 = ax.bar(np.arange(len(scores2)) + width, norm_averages2, width, color='red')
+    rects1 = ax.bar(indent, norm_averages1, width, color='black')
+    rects2 = ax.bar(indent + width, norm_averages2, width, color='red')
     
     ax.set_xlim(-0.5 * width, len(indent) + 0.5 * width)
     ax.set_ylim(0, 1.2)
@@ -160,9 +345,9 @@ def plot_bar_compare_avg(names, scores1, scores2):
     ax.legend((rects1[0], rects2[0]), ('Sentiment', 'Lexical diversity'))
     
     
-    plt.show()
+    show(path)
 
-def plot_bar_avg(names, scores):
+def plot_bar_avg(names, scores, path=None):
     """
     Bar graph.
     
@@ -170,8 +355,9 @@ def plot_bar_avg(names, scores):
     
     -> name: Names of sub-reddits
     -> scores: Nested lists containing data for each post for each sub-reddit
+    -> path: write the plot to this file instead of showing it
     """
-    averages = np.average(scores, axis=1)
+    averages = means(scores)
     indent = np.arange(len(averages))
     width = 0.7
     rects = plt.bar(indent, averages, width=width)
@@ -182,33 +368,30 @@ def plot_bar_avg(names, scores):
     ax.set_ylim(min(averages) - 0.5, max(averages) + 0.5)
     ax.set_ylabel('Average sentiment')
     ax.legend((rects[0],), ('Average sentiment',))
-    plt.show()
+    show(path)
 
 
-def plot_bar(names, scores):  
+def plot_bar(names, scores, path=None):  
     """
     Bar graph.
     
-    Plots data for all posts in a bar graph
+    Plots data for all posts in a bar graph, one plot per sub-reddit in a single row
     
     -> name: Names of sub-reddits
     -> scores: Nested lists containing data for each post for each sub-reddit
+    -> path: write the plot to this file instead of showing it
     """
-    fig, ax = plt.subplots(nrows=1, ncols=10, sharey='row')
-    
-    ax_list = ax.tolist()
-
-#    ax_list = [item for sublist in ax_list for item in sublist]
+    fig, ax_list = subplot_grid(len(names), max(len(names), 1), sharey='row')
     
     for subscores, name, ax in zip(scores, names, ax_list):
         ax.bar(np.arange(len(subscores)), subscores, 0.35, color='black')
         ax.set_title(name)
         ax.set_xticks([])
     
-    plt.show()
+    show(path)
     
 
-def plot_bar_compare(names, scores1, scores2):   
+def plot_bar_compare(names, scores1, scores2, path=None):   
     """
     Bar graph.
     
@@ -217,20 +400,14 @@ def plot_bar_compare(names, scores1, scores2):
     -> name: Names of sub-reddits
     -> scores1: Nested lists containing data for each post for each sub-reddit
     -> scores2: Nested lists containing data for each post for each sub-reddit
+    -> path: write the plot to this file instead of showing it
     """
-    fig, ax = plt.subplots(nrows=2, ncols=5, sharey='row')
-    
-    ax_list = ax.tolist()
-    ax_list = [item for sublist in ax_list for item in sublist]
+    fig, ax_list = subplot_grid(len(names), 5, sharey='row')
     
     width = 0.35
     for subscores1, subscores2, name, ax in zip(scores1, scores2, names, ax_list):
-        minimum = min(subscores1)
-        maximum = max(subscores1)
-        norm_scores1 = [(score - minimum) / (maximum - minimum) for score in subscores1]
-        minimum = min(subscores2)
-        maximum = max(subscores2)
-        norm_scores2 = [(score - minimum) / (maximum - minimum) for score in subscores2]
+        norm_scores1 = normalize(subscores1)
+        norm_scores2 = normalize(subscores2)
         
         ax.bar(np.arange(len(subscores1)), norm_scores1, width, color='black')
         ax.bar(np.arange(len(subscores2)) + width, norm_scores2, width, color='red')
@@ -238,5 +415,10 @@ def plot_bar_compare(names, scores1, scores2):
         ax.set_xticks([])
         ax.set_xlim(-2 * width, len(subscores1) + 2 * width)
     
-    plt.show()
-    
\ No newline at end of file
+    show(path)
+    
+
+
+if __name__ == '__main__':
+    # python visualizer.py [directory for the stats of the run]
+    report(stats=sys.argv[1] if len(sys.argv) > 1 else None)